@@ -52,6 +52,19 @@ api.interceptors.response.use(
     }
 );
 
+// 逐页读取总是分页的接口（成绩、播放记录），按 next 链接取完后返回完整列表
+const MAX_PAGE_SIZE = 500;
+
+async function getAll(url, params) {
+    let response = await api.get(url, { params: { ...params, page_size: MAX_PAGE_SIZE } });
+    const results = [...response.data.results];
+    while (response.data.next) {
+        response = await api.get(response.data.next);
+        results.push(...response.data.results);
+    }
+    return { data: results, status: response.status };
+}
+
 function getCookie(name) {
     const value = `; ${document.cookie}`;
     const parts = value.split(`; ${name}=`);
@@ -73,7 +86,7 @@ export default {
     deleteUser: (userId) => api.delete(`/users/${userId}/`),
     getUserName:(id)=>api.get(`/users/${id}/get_name/`),
     // 合辑相关
-    getCollections: () => api.get('/collections/'),
+    getCollections: (params) => api.get('/collections/', { params }),
     getCollection: (id) => api.get(`/collections/${id}/`),
     createCollection: (data) => api.post('/collections/', data),
     updateCollection: (id, data) => api.patch(`/collections/${id}/`, data),
@@ -83,6 +96,7 @@ export default {
     getFavoriteCollections: () => api.get('/collections/favorites/'),
     getCreatedCollections: () => api.get('/collections/get_created_collections/'),
     getCourseVideoStats:(id)=>api.get(`/collections/${id}/video_stats`),
+    getCoursesVideoStats: (ids) => api.get('/collections/video_stats_batch/', { params: { ids: ids.join(',') } }),
     // 分类相关
     getCategory: (id) => api.get(`/categories/${id}/`),
     getCategoryResources: (id) => api.get(`/categories/${id}/get_category_resources/`),
@@ -94,6 +108,7 @@ export default {
     getVideos: () => api.get('/videos/'),
     getVideo: (id) => api.get(`/videos/${id}/`),
     getVideoDetail: (id) => api.get(`/videos/${id}/get_video_detail/`),
+    getVideoHeatmap: (id) => api.get(`/videos/${id}/heatmap/`),
     addVideo: (data) => api.post('/videos/', data),
     updateVideo: (id, data) => api.patch(`/videos/${id}/`, data),
     deleteVideo: (id) => api.delete(`/videos/${id}/`),
@@ -108,8 +123,12 @@ export default {
     getHomeworkQuestions: (id) => api.get(`/homeworks/${id}/questions/`),
     saveQuestions: (id, questions) => api.post(`/homeworks/${id}/save_questions/`,questions),
     submitAnswers: (id, answers) => api.post(`/homeworks/${id}/submit_answers/`, answers),
-    getScores: (id) => api.get(`/homeworks/${id}/scores/`),
+    regradeHomework: (id) => api.post(`/homeworks/${id}/regrade/`),
+    getRegradeStatus: (id) => api.get(`/homeworks/${id}/regrade_status/`),
+    getItemAnalysis: (id) => api.get(`/homeworks/${id}/item_analysis/`),
+    getScores: (id) => getAll(`/homeworks/${id}/scores/`),
     getCurrentUserScores:(id)=>api.get(`/homeworks/${id}/get_current_user_scores/`),
+    getHomeworkLeaderboard: (id, params) => api.get(`/homeworks/${id}/leaderboard/`, { params }),
     // 资料相关
     getMaterials: () => api.get('/materials/'),
     getMaterial: (id) => api.get(`/materials/${id}/`),
@@ -118,15 +137,20 @@ export default {
     deleteMaterial: (id) => api.delete(`/materials/${id}/`),
     getCategoryMaterials: (id) => api.get(`/categories/${id}/materials/`),
     // 播放记录相关
-    getPlaybackStats: () => api.get('/playback-stats/'),
+    getPlaybackStats: () => getAll('/playback-stats/'),
     updatePlaybackProgress: (data) => api.post('/playback-stats/update_progress/', data),
+    syncPlaybackProgress: (records) => api.post('/playback-stats/sync_progress/', { records }),
     getPlaybackUse:(id)=>api.get(`/analyze_course_stats/${id}`),
+    getCourseLeaderboard: (id, params) => api.get(`/course-leaderboard/${id}/`, { params }),
     getFavoriteCourseStats: () => api.get('/favorite-course-stats/'),
+    // 目录增量同步，since 为上次返回的 cursor
+    getCatalogChanges: (since) => api.get('/catalog/changes/', { params: since ? { since } : {} }),
     // 搜索功能
-    search: (query) => api.get('/search/search/?q=' + query),
+    search: (query, params) => api.get('/search/search/', { params: { q: query, ...params } }),
+    searchSuggest: (query, limit) => api.get('/search/suggest/', { params: { q: query, limit } }),
     //成绩相关
-    getCourseScores:(id) => api.get(`course-scores/${id}/`),
-    getScoresByCourse:(params)=>api.get('/score/get_course_scores/', {params}),
+    getCourseScores:(id) => getAll(`course-scores/${id}/`),
+    getScoresByCourse:(params)=>getAll('/score/get_course_scores/', params),
     // 文件上传
     uploadFile: (file) => {
         const formData = new FormData();
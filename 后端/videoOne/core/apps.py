@@ -3,4 +3,10 @@ from django.apps import AppConfig
 class App01Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
-    verbose_name = '学习平台数据管理'
\ No newline at end of file
+    verbose_name = '学习平台数据管理'
+
+    def ready(self):
+        # 注册派生数据维护相关的信号处理
+        from . import (  # noqa: F401
+            authentication, autocomplete, favorites, grading, heatmap, leaderboard, resource_cache, rollups, search
+        )
@@ -0,0 +1,132 @@
+"""
+带进程内缓存的 Token 认证。
+
+Token -> 用户 的解析结果缓存在进程内的 LRU 中（有数量上限和过期时间），命中时不查询数据库。
+Token 删除、用户修改（包括改密码、禁用）或删除时，在事务提交后写入共享缓存中的撤销标记，
+各进程在使用缓存条目前检查标记，缓存时间早于标记的条目作废，从而跨进程保持一致。
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+REVOKED_KEY = 'auth_revoked:{}'
+
+
+def _config():
+    return {'MAX_ENTRIES': 10000, 'TTL': 300, 'SHARED_CACHE': 'default', **getattr(settings, 'TOKEN_CACHE', {})}
+
+
+class TokenCache:
+    """有数量上限和过期时间的 LRU：key -> (用户, Token, 缓存时间)"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, user, token):
+        with self._lock:
+            self._entries[key] = (user, token, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0].pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = _config()
+                _cache = TokenCache(config['MAX_ENTRIES'], config['TTL'])
+    return _cache
+
+
+def _shared_cache():
+    return caches[_config()['SHARED_CACHE']]
+
+
+def resolve_token(key):
+    """通过缓存解析 Token，返回 (用户, Token)，不存在时返回 None；每次返回用户对象的副本"""
+    token_cache = get_token_cache()
+    entry = token_cache.get(key)
+    if entry is not None:
+        user, token, cached_at = entry
+        revoked_at = _shared_cache().get(REVOKED_KEY.format(user.pk))
+        if revoked_at is None or revoked_at < cached_at:
+            return copy.copy(user), token
+        token_cache.discard(key)
+
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    token_cache.set(key, token.user, token)
+    return copy.copy(token.user), token
+
+
+def revoke_user(user_id):
+    """作废该用户的所有缓存条目，本进程立即生效，其他进程通过共享缓存中的标记生效"""
+    get_token_cache().discard_user(user_id)
+    _shared_cache().set(REVOKED_KEY.format(user_id), time.time(), _config()['TTL'])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        resolved = resolve_token(key)
+        if resolved is None:
+            # 交给父类生成与原来一致的错误信息
+            return super().authenticate_credentials(key)
+        user, token = resolved
+        if not user.is_active:
+            return super().authenticate_credentials(key)
+        return user, token
+
+
+@receiver(post_delete, sender=Token)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoke_cached_tokens(sender, instance, **kwargs):
+    # 改密码、禁用等都通过保存用户完成，任何修改都作废缓存，让下一次请求重新读取
+    user_id = instance.user_id if sender is Token else instance.pk
+    transaction.on_commit(lambda: revoke_user(user_id))
@@ -0,0 +1,187 @@
+"""
+搜索框输入提示：合辑名称、视频标题、作业标题的前缀索引。
+
+索引是进程内的有序数组，每个标题从开头、每个英文单词开头和每个汉字处各取一个键（最长 MAX_KEY_LENGTH 个字符），
+前缀查询用二分查找定位后顺序扫描。
+本进程的内容修改在事务提交后增量更新；其他进程的修改通过定期比对目录版本戳（CatalogVersion）发现后重建。
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CatalogVersion, Collection, Homework, Video
+from .versions import CATALOG, changed_locally
+
+MAX_KEY_LENGTH = 16
+
+# 每次查询最多扫描的键数量
+MAX_SCAN = 500
+
+# 检查其他进程是否修改过目录的间隔（秒）
+CHECK_INTERVAL = 30
+
+# 类型 -> (模型, 标题字段)，顺序即同等匹配时的优先级
+SOURCES = {
+    'collection': (Collection, 'name'),
+    'video': (Video, 'title'),
+    'homework': (Homework, 'title'),
+}
+_PRIORITY = {kind: index for index, kind in enumerate(SOURCES)}
+_KINDS = {model: kind for kind, (model, _) in SOURCES.items()}
+
+_KEY_START_RE = re.compile('[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower().strip()
+
+
+def _keys(normalized):
+    keys = {normalized[:MAX_KEY_LENGTH]}
+    for match in _KEY_START_RE.finditer(normalized):
+        keys.add(normalized[match.start():match.start() + MAX_KEY_LENGTH])
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex:
+    """有序数组实现的前缀索引，元素为 (键, 类型, ID)"""
+
+    def __init__(self, titles=()):
+        self._titles = {}
+        entries = []
+        for kind, object_id, title in titles:
+            normalized = normalize(title)
+            self._titles[(kind, object_id)] = (title, normalized)
+            entries.extend((key, kind, object_id) for key in _keys(normalized))
+        entries.sort()
+        self._entries = entries
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._titles)
+
+    def _remove(self, kind, object_id):
+        old = self._titles.pop((kind, object_id), None)
+        if old is None:
+            return
+        for key in _keys(old[1]):
+            position = bisect.bisect_left(self._entries, (key, kind, object_id))
+            if position < len(self._entries) and self._entries[position] == (key, kind, object_id):
+                del self._entries[position]
+
+    def update(self, kind, object_id, title):
+        with self._lock:
+            self._remove(kind, object_id)
+            normalized = normalize(title)
+            self._titles[(kind, object_id)] = (title, normalized)
+            for key in _keys(normalized):
+                bisect.insort(self._entries, (key, kind, object_id))
+
+    def remove(self, kind, object_id):
+        with self._lock:
+            self._remove(kind, object_id)
+
+    def suggest(self, prefix, limit=10):
+        """前缀匹配的标题，开头匹配的优先，其次按类型和标题长度"""
+        query = normalize(prefix)
+        if not query:
+            return []
+        lookup = query[:MAX_KEY_LENGTH]
+        matches = {}
+        with self._lock:
+            position = bisect.bisect_left(self._entries, (lookup,))
+            end = min(position + MAX_SCAN, len(self._entries))
+            while position < end:
+                key, kind, object_id = self._entries[position]
+                if not key.startswith(lookup):
+                    break
+                title, normalized = self._titles[(kind, object_id)]
+                # 查询超过键长度时再核对完整标题
+                if len(query) <= MAX_KEY_LENGTH or query in normalized:
+                    matches[(kind, object_id)] = (
+                        not normalized.startswith(query), _PRIORITY[kind], len(title), title
+                    )
+                position += 1
+        ranked = heapq.nsmallest(limit, matches.items(), key=lambda item: item[1])
+        return [
+            {'type': kind, 'id': object_id, 'title': rank[3]}
+            for (kind, object_id), rank in ranked
+        ]
+
+
+_index = None
+_index_version = None
+_checked_at = 0
+_index_lock = threading.Lock()
+
+
+def _catalog_version():
+    return CatalogVersion.objects.filter(scope=CATALOG).values_list('version', flat=True).first()
+
+
+def _build():
+    titles = []
+    for kind, (model, field) in SOURCES.items():
+        titles.extend((kind, object_id, title) for object_id, title in model.objects.values_list('id', field))
+    return PrefixIndex(titles)
+
+
+def get_index():
+    """当前进程的前缀索引，首次使用时构建，目录被其他进程修改后重建"""
+    global _index, _index_version, _checked_at
+    if _index is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return _index
+    with _index_lock:
+        if _index is None or time.monotonic() - _checked_at >= CHECK_INTERVAL:
+            version = _catalog_version()
+            # 目录只被本进程修改过时，修改已在提交后增量应用，不需要重建
+            if _index is None or not changed_locally(_index_version, version):
+                _index = _build()
+                _index_version = version
+            _checked_at = time.monotonic()
+    return _index
+
+
+def suggest(prefix, limit=10):
+    return get_index().suggest(prefix, limit)
+
+
+def _apply(change):
+    global _index_version, _checked_at
+    if _index is None:
+        return
+    change(_index)
+    with _index_lock:
+        version = _catalog_version()
+        if changed_locally(_index_version, version):
+            # 期间的修改都来自本进程，已经增量应用，记下新的版本戳，避免下次检查时重建
+            _index_version = version
+        else:
+            # 其他进程也修改过目录，下次使用时检查版本戳并重建
+            _checked_at = 0
+
+
+@receiver(post_save)
+def update_on_save(sender, instance, raw=False, **kwargs):
+    kind = _KINDS.get(sender)
+    if kind is None or raw:
+        return
+    title = getattr(instance, SOURCES[kind][1])
+    transaction.on_commit(lambda: _apply(lambda index: index.update(kind, instance.pk, title)))
+
+
+@receiver(post_delete)
+def remove_on_delete(sender, instance, **kwargs):
+    kind = _KINDS.get(sender)
+    if kind is None:
+        return
+    object_id = instance.pk
+    transaction.on_commit(lambda: _apply(lambda index: index.remove(kind, object_id)))
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import watchmap
+from .authentication import resolve_token
+from .models import Video
+from .playback import upsert_progress_many
+
+logger = logging.getLogger(__name__)
+
+
+def database_sync_to_async(func):
+    """在线程中执行数据库操作，前后清理失效连接"""
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=True)
+
+
+@database_sync_to_async
+def get_token_user(key):
+    resolved = resolve_token(key)
+    if resolved is None:
+        return None
+    user, _ = resolved
+    return user if user.is_active else None
+
+
+@database_sync_to_async
+def filter_existing_videos(video_ids):
+    return set(Video.objects.filter(id__in=video_ids).values_list('id', flat=True))
+
+
+@database_sync_to_async
+def write_progress(records):
+    upsert_progress_many(records)
+
+
+class PlaybackProgressConsumer:
+    """
+    播放进度 WebSocket 通道，每个观看会话一条长连接。
+    连接: ws://<host>/ws/playback/?token=<token>
+    消息: {"videoId": 1, "progress": 35.2, "duration": 120}
+    连接内按视频合并进度，按间隔批量写入 PlaybackStat，断开时写入剩余进度；
+    鉴权只在建立连接时进行一次，省去每次心跳的 HTTP、token 校验和中间件开销。
+    """
+
+    # 关闭码：4001 未认证
+    CLOSE_UNAUTHORIZED = 4001
+
+    def __init__(self):
+        config = getattr(settings, 'PLAYBACK_STREAM', {})
+        self.flush_interval = config.get('FLUSH_INTERVAL', 10)
+        self.user = None
+        self.pending = {}
+        self.known_videos = set()
+        self.last_flush = time.monotonic()
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        query = parse_qs(scope.get('query_string', b'').decode())
+        key = query.get('token', [None])[0]
+        self.user = await get_token_user(key) if key else None
+        if self.user is None:
+            await send({'type': 'websocket.close', 'code': self.CLOSE_UNAUTHORIZED})
+            return
+        await send({'type': 'websocket.accept'})
+
+        try:
+            while True:
+                timeout = max(self.flush_interval - (time.monotonic() - self.last_flush), 0)
+                try:
+                    message = await asyncio.wait_for(receive(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    await self.flush()
+                    continue
+
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    error = await self.handle_tick(message)
+                    if error:
+                        await send({
+                            'type': 'websocket.send',
+                            'text': json.dumps({'error': error}, ensure_ascii=False)
+                        })
+                if time.monotonic() - self.last_flush >= self.flush_interval:
+                    await self.flush()
+        finally:
+            await self.flush()
+
+    async def handle_tick(self, message):
+        """合并一次进度心跳，格式错误时返回错误信息"""
+        try:
+            data = json.loads(message.get('text') or message.get('bytes') or '')
+            video_id = int(data['videoId'])
+            progress = int(float(data['progress']))
+            duration = int(float(data['duration']))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            # OverflowError：JSON 中的 1e999 解析为 inf，无法转换为整数
+            return '消息格式错误'
+
+        if video_id not in self.known_videos:
+            if not await filter_existing_videos([video_id]):
+                return '视频不存在'
+            self.known_videos.add(video_id)
+
+        entry = self.pending.get(video_id)
+        watched = watchmap.mark(entry[3] if entry else b'', duration)
+        if entry is not None:
+            progress = max(entry[0], progress)
+        self.pending[video_id] = (progress, duration, timezone.now(), watched)
+        return None
+
+    async def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        try:
+            await write_progress([
+                (self.user.id, video_id, progress, duration, played_at, watched)
+                for video_id, (progress, duration, played_at, watched) in pending.items()
+            ])
+        except Exception as e:
+            logger.error(f"播放进度写入失败: {str(e)}")
+            # 保留未写入的进度，下次刷新时重试
+            for video_id, entry in pending.items():
+                current = self.pending.get(video_id)
+                self.pending[video_id] = entry if current is None else (
+                    max(current[0], entry[0]), current[1], current[2], watchmap.merge(current[3], entry[3])
+                )
@@ -0,0 +1,79 @@
+"""
+用户收藏合辑ID集合的缓存，用于访问权限判断和收藏状态。
+
+集合放在共享缓存中（各进程一致），同一请求内再缓存在用户对象上，判断时只是集合查找。
+User.favorite_collections 的 m2m_changed（两侧的增删和清空，包括收藏/取消收藏接口与后台编辑）
+以及合辑、用户删除时，在事务提交后删除对应用户的缓存。
+"""
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Collection, User
+
+CACHE_ALIAS = 'shared'
+CACHE_KEY = 'favorite_ids:{}'
+# 兜底过期时间，覆盖读取与失效交错时写入旧数据的情况
+CACHE_TIMEOUT = 10 * 60
+
+
+def get_favorite_ids(user):
+    """用户收藏的合辑ID集合（frozenset），未登录时为空集合"""
+    if not user.is_authenticated:
+        return frozenset()
+    ids = getattr(user, '_favorite_ids', None)
+    if ids is None:
+        cache = caches[CACHE_ALIAS]
+        key = CACHE_KEY.format(user.pk)
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(user.favorite_collections.values_list('id', flat=True))
+            cache.set(key, ids, CACHE_TIMEOUT)
+        user._favorite_ids = ids
+    return ids
+
+
+def invalidate(user_ids):
+    caches[CACHE_ALIAS].delete_many([CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+def _invalidate_on_commit(user_ids):
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: invalidate(user_ids))
+
+
+@receiver(m2m_changed, sender=User.favorite_collections.through)
+def invalidate_on_favorites_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # 从用户一侧修改：instance 为用户
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _invalidate_on_commit([instance.pk])
+            if hasattr(instance, '_favorite_ids'):
+                del instance._favorite_ids
+        return
+
+    # 从合辑一侧修改：instance 为合辑，pk_set 为用户ID
+    if action == 'pre_clear':
+        instance._cleared_favorited_by = list(instance.favorited_by.values_list('id', flat=True))
+    elif action == 'post_clear':
+        _invalidate_on_commit(getattr(instance, '_cleared_favorited_by', []))
+    elif action in ('post_add', 'post_remove'):
+        _invalidate_on_commit(pk_set or ())
+
+
+@receiver(pre_delete, sender=Collection)
+def remember_favorited_by(sender, instance, **kwargs):
+    # 级联删除收藏关系时不会发送 m2m_changed
+    instance._favorited_by_ids = list(instance.favorited_by.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Collection)
+def invalidate_on_collection_deleted(sender, instance, **kwargs):
+    _invalidate_on_commit(getattr(instance, '_favorited_by_ids', []))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_on_user_deleted(sender, instance, **kwargs):
+    _invalidate_on_commit([instance.pk])
@@ -0,0 +1,117 @@
+"""
+作业判分：预先编译的答案表 + 单次遍历判分。
+
+答案表为 {题目ID: (题型, 分值, 正确选项集合, 全部选项)}，一次查询从题目生成，放在共享缓存中（各进程一致）；
+题目保存或删除时在事务提交后删除对应作业的答案表，下次判分时重新生成。
+"""
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Question
+
+CACHE_ALIAS = 'shared'
+CACHE_KEY = 'answer_key:{}'
+# 兜底过期时间，覆盖读取与失效交错时写入旧数据的情况
+CACHE_TIMEOUT = 10 * 60
+
+
+class UnknownQuestion(Exception):
+    """提交的题目不属于该作业"""
+
+    def __init__(self, question_id):
+        super().__init__(question_id)
+        self.question_id = question_id
+
+
+class InvalidAnswers(ValueError):
+    """作答格式错误：不是 [{"questionId", "answer"}] 列表，或同一题目出现多次"""
+
+
+def compile_answer_key(homework_id):
+    answer_key = {}
+    for question_id, question_type, score, options in Question.objects.filter(
+        homework_id=homework_id
+    ).values_list('id', 'type', 'score', 'options'):
+        options = options or []
+        correct = frozenset(option['text'] for option in options if option.get('isCorrect'))
+        answer_key[question_id] = (question_type, score, correct, tuple(option['text'] for option in options))
+    return answer_key
+
+
+def get_answer_key(homework_id):
+    cache = caches[CACHE_ALIAS]
+    key = CACHE_KEY.format(homework_id)
+    answer_key = cache.get(key)
+    if answer_key is None:
+        answer_key = compile_answer_key(homework_id)
+        cache.set(key, answer_key, CACHE_TIMEOUT)
+    return answer_key
+
+
+def is_correct(question_type, correct, answer):
+    try:
+        # 单选题
+        if question_type == 'single':
+            return answer in correct
+        # 多选题，与顺序无关；必须提交列表，字符串 "AB" 不能按字符拆成选项
+        if question_type == 'multi':
+            return isinstance(answer, (list, tuple)) and set(answer) == correct
+    except TypeError:
+        # 答案格式与题型不符（如单选题提交了列表）
+        pass
+    return False
+
+
+def mark(answer_key, answers, strict=True):
+    """
+    逐题判分，answers 为 [{"questionId", "answer"}]，返回 [(题目ID, 作答, 是否正确, 得分)]。
+    strict 为 True 时：格式错误或同一题目出现多次抛出 InvalidAnswers，题目不在答案表中抛出 UnknownQuestion；
+    否则跳过这些作答，每题只按第一次作答判分（重新判分时题目可能已删除）。
+    """
+    if not isinstance(answers, list):
+        if strict:
+            raise InvalidAnswers('作答格式错误')
+        return []
+    marks = []
+    seen = set()
+    for answer in answers:
+        if not isinstance(answer, dict):
+            if strict:
+                raise InvalidAnswers('作答格式错误')
+            continue
+        question_id = answer.get('questionId')
+        try:
+            question_id = int(question_id)
+            question_type, question_score, correct, _ = answer_key[question_id]
+        except (KeyError, TypeError, ValueError):
+            if strict:
+                raise UnknownQuestion(question_id)
+            continue
+        if question_id in seen:
+            if strict:
+                raise InvalidAnswers(f'题目 {question_id} 重复作答')
+            continue
+        seen.add(question_id)
+        user_answer = answer.get('answer')
+        right = is_correct(question_type, correct, user_answer)
+        marks.append((question_id, user_answer, right, question_score if right else 0))
+    return marks
+
+
+def grade(answer_key, answers, strict=True):
+    """按答案表计算总分，参数同 mark"""
+    return sum(earned for _, _, _, earned in mark(answer_key, answers, strict))
+
+
+def invalidate(homework_ids):
+    caches[CACHE_ALIAS].delete_many([CACHE_KEY.format(homework_id) for homework_id in homework_ids])
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def invalidate_on_question_change(sender, instance, raw=False, **kwargs):
+    # _previous_homework_id 由 versions.remember_previous_homework 在保存前记录
+    homework_ids = {instance.homework_id, getattr(instance, '_previous_homework_id', None)} - {None}
+    transaction.on_commit(lambda: invalidate(homework_ids))
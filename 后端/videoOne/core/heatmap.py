@@ -0,0 +1,165 @@
+"""
+视频观看热力图：每个分段有多少学员实际看过，以及流失最多的位置。
+
+每个分段的观看人数存放在 SegmentStat 计数行中，播放进度写入时在同一事务内把新增的观看分段
+用一条 INSERT ... ON DUPLICATE KEY UPDATE（SQLite 为 ON CONFLICT）累加上去，各进程共享且不会丢失增量；
+其他途径修改、删除播放记录时由信号按前后位图的差异增减计数。查询时只读取计数行。
+"""
+from collections import Counter
+
+import numpy as np
+from django.db import connections, router, transaction
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import item_stats, watchmap
+from .models import Category, Collection, PlaybackStat, SegmentStat, Video
+
+# 返回的流失点数量
+DROP_OFF_POINTS = 5
+
+
+def _unpack(bitmaps, segments):
+    """将位图列表解包为 (len(bitmaps), segments) 的 0/1 矩阵"""
+    width = (segments + 7) // 8
+    if not bitmaps or not width:
+        return np.zeros((len(bitmaps), segments), dtype=np.uint8)
+    packed = np.frombuffer(
+        b''.join(bytes(bitmap or b'')[:width].ljust(width, b'\0') for bitmap in bitmaps),
+        dtype=np.uint8
+    ).reshape(len(bitmaps), width)
+    return np.unpackbits(packed, axis=1, bitorder='little')[:, :segments]
+
+
+def _segments(bitmap):
+    """位图中置位的分段序号"""
+    bitmap = bytes(bitmap or b'')[:watchmap.MAX_SEGMENTS // 8]
+    if not bitmap:
+        return []
+    return np.flatnonzero(np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8), bitorder='little')).tolist()
+
+
+def get_heatmap(video):
+    """读取一个视频的分段观看人数"""
+    counts = dict(
+        SegmentStat.objects.filter(video=video, viewers__gt=0).values_list('segment', 'viewers')
+    )
+    segments = watchmap.segment_count(video.duration_seconds)
+    if not segments:
+        # 时长未知时以最后一个有人看过的分段为准
+        segments = max(counts, default=-1) + 1
+    data = np.zeros(segments, dtype=np.int64)
+    for segment, viewers in counts.items():
+        if segment < segments:
+            data[segment] = viewers
+    viewers = PlaybackStat.objects.filter(video=video).exclude(watched=b'').count()
+    return {'segments': segments, 'viewers': viewers, 'counts': data}
+
+
+def add_watched(changes, using=None):
+    """
+    把新增的观看分段累加到计数行上，应在写入播放记录的事务中调用。
+    changes: 可迭代的 (video_id, 写入前的位图, 写入后的位图)
+    """
+    added = Counter()
+    for video_id, old, new in changes:
+        for segment in _segments(watchmap.difference(new, old)):
+            added[video_id, segment] += 1
+    # 按键排序写入，并发事务以相同顺序加锁
+    item_stats.add_counts(SegmentStat, ('video', 'segment'), ('viewers',), [
+        (video_id, segment, count) for (video_id, segment), count in sorted(added.items())
+    ], using)
+
+
+def _remove_watched(video_id, bitmap, using=None):
+    """从计数行上减去位图中的分段；只更新已有的行，级联删除视频时不会插入新行"""
+    segments = _segments(bitmap)
+    if segments:
+        SegmentStat.objects.using(using).filter(video_id=video_id, segment__in=segments).update(
+            viewers=F('viewers') - 1
+        )
+
+
+def rebuild(video):
+    """按播放记录全量重算一个视频的分段观看人数，返回有人看过的分段数"""
+    bitmaps = [
+        bitmap for bitmap in PlaybackStat.objects.filter(video=video).values_list('watched', flat=True)
+        if bitmap
+    ]
+    segments = min(max((len(bitmap) for bitmap in bitmaps), default=0) * 8, watchmap.MAX_SEGMENTS)
+    counts = _unpack(bitmaps, segments).sum(axis=0, dtype=np.int64)
+    rows = [
+        SegmentStat(video=video, segment=segment, viewers=int(counts[segment]))
+        for segment in np.flatnonzero(counts).tolist()
+    ]
+    with transaction.atomic():
+        SegmentStat.objects.filter(video=video).delete()
+        SegmentStat.objects.bulk_create(rows, batch_size=item_stats.BATCH_SIZE)
+    return len(rows)
+
+
+@receiver(pre_save, sender=PlaybackStat)
+def remember_previous_watched(sender, instance, raw=False, update_fields=None, **kwargs):
+    """批量写入之外的途径保存播放记录时，记下保存前的位图以便增减计数"""
+    if raw or instance.pk is None or (update_fields is not None and 'watched' not in update_fields):
+        return
+    instance._previous_watched = PlaybackStat.objects.using(kwargs.get('using')).filter(
+        pk=instance.pk
+    ).values_list('watched', flat=True).first()
+
+
+@receiver(post_save, sender=PlaybackStat)
+def update_on_playback_saved(sender, instance, created=False, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    if created:
+        old = b''
+    elif hasattr(instance, '_previous_watched'):
+        old = instance.__dict__.pop('_previous_watched')
+    else:
+        return
+    new = bytes(instance.watched or b'')
+    old = bytes(old or b'')
+    if new == old:
+        return
+    connection = connections[using or router.db_for_write(SegmentStat)]
+    with transaction.atomic(using=connection.alias):
+        add_watched([(instance.video_id, old, new)], connection.alias)
+        _remove_watched(instance.video_id, watchmap.difference(old, new), connection.alias)
+
+
+@receiver(post_delete, sender=PlaybackStat)
+def update_on_playback_deleted(sender, instance, using=None, origin=None, **kwargs):
+    # 删除视频（或其所属分类、合辑）时计数行随视频级联删除，无需逐条减去
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model in (Collection, Category, Video):
+        return
+    _remove_watched(instance.video_id, instance.watched, using)
+
+
+def summarize(data):
+    """转换为接口返回格式：每段观看人数、留存比例和流失最多的分段"""
+    counts = data['counts']
+    viewers = data['viewers']
+    retention = counts / viewers if viewers else np.zeros(len(counts))
+
+    drop_offs = []
+    if len(counts) > 1:
+        drops = counts[:-1] - counts[1:]
+        for index in np.argsort(-drops, kind='stable')[:DROP_OFF_POINTS]:
+            if drops[index] <= 0:
+                break
+            drop_offs.append({
+                'segment': int(index) + 1,
+                'second': (int(index) + 1) * watchmap.SEGMENT_SECONDS,
+                'drop': int(drops[index]),
+            })
+
+    return {
+        'segment_seconds': watchmap.SEGMENT_SECONDS,
+        'viewers': viewers,
+        'counts': counts.tolist(),
+        'retention': np.round(retention, 4).tolist(),
+        'drop_offs': drop_offs,
+    }
@@ -0,0 +1,214 @@
+"""
+作业题目的作答分析：难度（答对率）、区分度和选项选择分布。
+
+每次提交后按题目累加计数（QuestionStat / OptionStat），与课程进度汇总一样用一条
+INSERT ... ON DUPLICATE KEY UPDATE（SQLite 为 ON CONFLICT）完成；查询时只读取计数行，与提交数量无关。
+提交时已有但未作答的题目按答错计入，提交后新增的题目不计入。题目或答案修改后重新判分时，按保存的作答重新统计（见 regrade.py）。
+"""
+import math
+from collections import Counter
+
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from . import grading
+from .models import Homework, OptionStat, Question, QuestionStat, Score
+
+OPTION_MAX_LENGTH = OptionStat._meta.get_field('option').max_length
+
+# 题目计数字段，顺序与 Tally.questions 中的列表一致
+COUNTERS = ('attempts', 'correct', 'rest_sum', 'rest_square_sum', 'correct_rest_sum')
+
+ADD_SQL = {
+    'mysql': 'INSERT INTO {table} ({columns}) VALUES {values} ON DUPLICATE KEY UPDATE {updates}',
+    'sqlite': 'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT ({keys}) DO UPDATE SET {updates}',
+}
+ADD_COLUMN_SQL = {
+    'mysql': '{column} = {column} + VALUES({column})',
+    'sqlite': '{column} = {column} + excluded.{column}',
+}
+
+BATCH_SIZE = 500
+
+
+def _selected(question_type, answer, options):
+    if question_type == 'single':
+        return [answer] if answer in options else []
+    if question_type == 'multi' and isinstance(answer, (list, tuple)):
+        return {choice for choice in answer if choice in options}
+    return []
+
+
+class Tally:
+    """一批提交的统计增量，可在工作进程中计算后合并"""
+
+    def __init__(self):
+        # 题目ID -> [作答次数, 答对次数, 其余得分之和, 其余得分平方和, 答对者其余得分之和]
+        self.questions = {}
+        # (题目ID, 选项) -> 选择次数
+        self.options = Counter()
+
+    def add(self, answer_key, marks, asked=None):
+        """计入一次提交，marks 为 grading.mark 的结果；asked 为提交时已有的题目ID，None 时为答案表中的全部题目"""
+        total = sum(earned for *_, earned in marks)
+        answered = {question_id: (answer, right, earned) for question_id, answer, right, earned in marks}
+        for question_id, (question_type, _, _, options) in answer_key.items():
+            if asked is not None and question_id not in asked:
+                continue
+            answer, right, earned = answered.get(question_id, (None, False, 0))
+            rest = total - earned
+            counters = self.questions.setdefault(question_id, [0] * len(COUNTERS))
+            counters[0] += 1
+            counters[2] += rest
+            counters[3] += rest * rest
+            if right:
+                counters[1] += 1
+                counters[4] += rest
+            for option in _selected(question_type, answer, options):
+                self.options[(question_id, str(option)[:OPTION_MAX_LENGTH])] += 1
+
+    def merge(self, other):
+        for question_id, counters in other.questions.items():
+            mine = self.questions.setdefault(question_id, [0] * len(COUNTERS))
+            for index, value in enumerate(counters):
+                mine[index] += value
+        self.options.update(other.options)
+
+
+def asked_questions(created, submitted_at):
+    """提交时已有的题目ID，created 为 {题目ID: 创建时间}，没有创建时间的早期题目视为已有"""
+    return {
+        question_id for question_id, created_at in created.items()
+        if created_at is None or created_at <= submitted_at
+    }
+
+
+def add_counts(model, keys, counters, rows, using=None):
+    """按唯一键累加计数：不存在时插入，存在时在原值上增加。rows 为 (键..., 计数...) 元组"""
+    if not rows:
+        return
+    connection = connections[using or router.db_for_write(model)]
+    template = ADD_SQL.get(connection.vendor)
+    opts = model._meta
+    if template is None:
+        # 其他数据库逐行累加
+        with transaction.atomic(using=connection.alias):
+            for row in rows:
+                lookup = {key: value for key, value in zip(keys, row)}
+                increments = {name: F(name) + value for name, value in zip(counters, row[len(keys):])}
+                manager = model.objects.using(connection.alias)
+                if not manager.filter(**lookup).update(**increments):
+                    manager.create(**lookup, **dict(zip(counters, row[len(keys):])))
+        return
+
+    qn = connection.ops.quote_name
+    key_columns = [qn(opts.get_field(key).column) for key in keys]
+    counter_columns = [qn(opts.get_field(name).column) for name in counters]
+    names = {
+        'table': qn(opts.db_table),
+        'columns': ', '.join(key_columns + counter_columns),
+        'keys': ', '.join(key_columns),
+        'updates': ', '.join(
+            ADD_COLUMN_SQL[connection.vendor].format(column=column) for column in counter_columns
+        ),
+    }
+    placeholder = '({})'.format(', '.join(['%s'] * (len(keys) + len(counters))))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            values = ', '.join([placeholder] * len(batch))
+            cursor.execute(template.format(values=values, **names), [value for row in batch for value in row])
+
+
+def record(answer_key, marks):
+    """累加一次提交的统计，应在保存成绩的事务中调用"""
+    tally = Tally()
+    tally.add(answer_key, marks)
+    add_counts(QuestionStat, ('question',), COUNTERS, [
+        (question_id, *counters) for question_id, counters in tally.questions.items()
+    ])
+    add_counts(OptionStat, ('question', 'option'), ('count',), [
+        (question_id, option, count) for (question_id, option), count in tally.options.items()
+    ])
+
+
+def rebuild(homework_id, tally, answer_key, created, last_id):
+    """
+    用重新统计的结果替换作业的全部统计。tally 为成绩ID不超过 last_id 的提交的统计，
+    answer_key、created 为统计时使用的答案表和题目创建时间。
+    """
+    with transaction.atomic():
+        # 重新判分期间提交作答时同样锁定作业（见 views.submit_answers），累加等到这里提交后再进行
+        list(Homework.objects.select_for_update().filter(id=homework_id).values_list('id'))
+        question_ids = set(Question.objects.filter(homework_id=homework_id).values_list('id', flat=True))
+        # 先删除：还在进行中的累加会持有这些行的锁，删除等待其提交
+        QuestionStat.objects.filter(question_id__in=question_ids).delete()
+        OptionStat.objects.filter(question_id__in=question_ids).delete()
+        # 分块判分之后才提交的成绩不在 tally 中，它们的累加已随上面的删除清除，在这里补上
+        combined = Tally()
+        combined.merge(tally)
+        for answers, submitted_at in Score.objects.filter(
+            homework_id=homework_id, id__gt=last_id, answers__isnull=False
+        ).values_list('answers', 'submitted_at'):
+            combined.add(
+                answer_key, grading.mark(answer_key, answers, strict=False), asked_questions(created, submitted_at)
+            )
+        QuestionStat.objects.bulk_create([
+            QuestionStat(question_id=question_id, **dict(zip(COUNTERS, counters)))
+            for question_id, counters in combined.questions.items() if question_id in question_ids
+        ], batch_size=BATCH_SIZE)
+        OptionStat.objects.bulk_create([
+            OptionStat(question_id=question_id, option=option, count=count)
+            for (question_id, option), count in combined.options.items() if question_id in question_ids
+        ], batch_size=BATCH_SIZE)
+
+
+def discrimination(stat):
+    """区分度：本题对错与其余得分的点二列相关系数，样本不足或其余得分没有差异时为 None"""
+    n, n1 = stat.attempts, stat.correct
+    n0 = n - n1
+    if n1 == 0 or n0 == 0:
+        return None
+    mean = stat.rest_sum / n
+    variance = stat.rest_square_sum / n - mean * mean
+    if variance <= 0:
+        return None
+    mean_correct = stat.correct_rest_sum / n1
+    mean_wrong = (stat.rest_sum - stat.correct_rest_sum) / n0
+    return (mean_correct - mean_wrong) / math.sqrt(variance) * math.sqrt(n1 * n0) / n
+
+
+def analyze(homework):
+    """作业各题的作答分析，两次查询"""
+    counts = {}
+    for question_id, option, count in OptionStat.objects.filter(question__homework=homework).values_list(
+        'question_id', 'option', 'count'
+    ):
+        counts[(question_id, option)] = count
+
+    results = []
+    for question in homework.questions.select_related('stat').order_by('id'):
+        stat = getattr(question, 'stat', None) or QuestionStat(question=question)
+        attempts = stat.attempts
+        index = discrimination(stat)
+        options = []
+        for option in question.options or []:
+            count = counts.get((question.id, str(option['text'])[:OPTION_MAX_LENGTH]), 0)
+            options.append({
+                'text': option['text'],
+                'isCorrect': bool(option.get('isCorrect')),
+                'count': count,
+                'ratio': round(count / attempts, 4) if attempts else None,
+            })
+        results.append({
+            'question_id': question.id,
+            'content': question.content,
+            'type': question.type,
+            'score': question.score,
+            'attempts': attempts,
+            'correct': stat.correct,
+            'difficulty': round(stat.correct / attempts, 4) if attempts else None,
+            'discrimination': round(index, 4) if index is not None else None,
+            'options': options,
+        })
+    return results
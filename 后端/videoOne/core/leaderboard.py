@@ -0,0 +1,311 @@
+"""
+排行榜：按合辑的课程进度、按作业的最高成绩。
+
+每个排行榜用可索引跳表保存 (−分数, 用户ID)，更新、求名次、按名次定位均为 O(log n)，
+取前 K / 后 K 名为 O(log n + K)。排行榜在进程内按需从数据库加载，
+本进程的写入即时更新，超过 TTL 后重新加载以合并其他进程的写入。
+进程内最多保留 MAX_BOARDS 个排行榜，超出时淘汰最久未访问的，过期的排行榜在下次访问或增量更新时丢弃。
+"""
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CourseProgress, Score, ScoreSummary
+
+# 排行榜重新加载的间隔（秒）
+LEADERBOARD_TTL = 60
+
+# 进程内保留的排行榜数量上限
+MAX_BOARDS = 200
+
+_MAX_LEVEL = 24
+_END = (float('inf'),)
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level
+
+
+_NIL = _Node(_END, 0)
+
+
+class RankedSet:
+    """有序集合（可索引跳表），元素为可比较的元组，下标从 0 开始"""
+
+    def __init__(self):
+        self.size = 0
+        self.head = _Node(None, _MAX_LEVEL)
+        self.head.next = [_NIL] * _MAX_LEVEL
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, key):
+        chain = [None] * _MAX_LEVEL
+        steps_at_level = [0] * _MAX_LEVEL
+        node = self.head
+        for level in reversed(range(_MAX_LEVEL)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = 1
+        while height < _MAX_LEVEL and random.random() < 0.5:
+            height += 1
+        new_node = _Node(key, height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, _MAX_LEVEL):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * _MAX_LEVEL
+        node = self.head
+        for level in reversed(range(_MAX_LEVEL)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), _MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def count_before(self, key):
+        """严格小于 key 的元素个数"""
+        position = 0
+        node = self.head
+        for level in reversed(range(_MAX_LEVEL)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def slice(self, start, count):
+        """从下标 start 开始取 count 个元素"""
+        if start < 0 or start >= self.size or count <= 0:
+            return []
+        node = self.head
+        remaining = start + 1
+        for level in reversed(range(_MAX_LEVEL)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        result = []
+        while node is not _NIL and len(result) < count:
+            result.append(node.key)
+            node = node.next[0]
+        return result
+
+
+class Leaderboard:
+    """用户 -> 分数 的排行榜，分数越高名次越靠前，同分时名次相同"""
+
+    def __init__(self, scores=None):
+        self._scores = {}
+        self._ranked = RankedSet()
+        self._lock = threading.Lock()
+        self.loaded_at = time.monotonic()
+        for member, score in (scores or {}).items():
+            self._scores[member] = score
+            self._ranked.insert((-score, member))
+
+    def __len__(self):
+        return len(self._scores)
+
+    def update(self, member, score):
+        with self._lock:
+            old = self._scores.get(member)
+            if old == score:
+                return
+            if old is not None:
+                self._ranked.remove((-old, member))
+            self._ranked.insert((-score, member))
+            self._scores[member] = score
+
+    def increment(self, member, delta):
+        with self._lock:
+            old = self._scores.get(member)
+            if old is not None:
+                self._ranked.remove((-old, member))
+            score = (old or 0) + delta
+            self._ranked.insert((-score, member))
+            self._scores[member] = score
+
+    def remove(self, member):
+        with self._lock:
+            old = self._scores.pop(member, None)
+            if old is not None:
+                self._ranked.remove((-old, member))
+
+    def score(self, member):
+        return self._scores.get(member)
+
+    def top(self, k):
+        """前 k 名，[(用户ID, 分数)]，分数从高到低"""
+        with self._lock:
+            return [(member, -negative) for negative, member in self._ranked.slice(0, k)]
+
+    def bottom(self, k):
+        """后 k 名，[(用户ID, 分数)]，分数从低到高"""
+        with self._lock:
+            size = len(self._ranked)
+            start = max(size - k, 0)
+            keys = self._ranked.slice(start, size - start)
+        return [(member, -negative) for negative, member in reversed(keys)]
+
+    def count_at_least(self, score):
+        """分数不低于 score 的人数"""
+        with self._lock:
+            return self._ranked.count_before((-score, float('inf')))
+
+    def rank(self, member):
+        """
+        用户的名次信息，不在榜上时返回 None。
+        rank 从 1 开始，percentile 为分数严格低于该用户的人数占比（%）
+        """
+        with self._lock:
+            score = self._scores.get(member)
+            if score is None:
+                return None
+            total = len(self._ranked)
+            higher = self._ranked.count_before((-score, float('-inf')))
+            not_lower = self._ranked.count_before((-score, float('inf')))
+        return {
+            'rank': higher + 1,
+            'total': total,
+            'score': score,
+            'percentile': round((total - not_lower) / total * 100, 2),
+        }
+
+
+# (类型, 对象ID) -> 排行榜，按最近访问排序
+_boards = OrderedDict()
+_boards_lock = threading.Lock()
+
+
+def _load(kind, object_id):
+    if kind == 'collection':
+        rows = CourseProgress.objects.filter(collection_id=object_id).values_list('user_id', 'progress_sum')
+    else:
+        rows = ScoreSummary.objects.filter(homework_id=object_id).values_list('user_id', 'best_score')
+    return Leaderboard(dict(rows))
+
+
+def _expired(board):
+    return time.monotonic() - board.loaded_at > LEADERBOARD_TTL
+
+
+def _get(kind, object_id):
+    key = (kind, object_id)
+    with _boards_lock:
+        board = _boards.get(key)
+        if board is not None:
+            _boards.move_to_end(key)
+    if board is None or _expired(board):
+        board = _load(kind, object_id)
+        with _boards_lock:
+            _boards[key] = board
+            _boards.move_to_end(key)
+            while len(_boards) > MAX_BOARDS:
+                _boards.popitem(last=False)
+    return board
+
+
+def _loaded(kind, object_id):
+    """已加载且未过期的排行榜，没有时返回 None（无需为增量更新加载）；过期的排行榜同时丢弃"""
+    key = (kind, object_id)
+    with _boards_lock:
+        board = _boards.get(key)
+        if board is not None and _expired(board):
+            del _boards[key]
+            return None
+    return board
+
+
+def course_leaderboard(collection_id):
+    """合辑的课程进度排行榜，分数为进度总和"""
+    return _get('collection', int(collection_id))
+
+
+def homework_leaderboard(homework_id):
+    """作业的成绩排行榜，分数为每个用户的最高成绩"""
+    return _get('homework', int(homework_id))
+
+
+def apply_course_deltas(totals):
+    """课程进度增量写入后同步到已加载的排行榜，totals: {(user_id, collection_id): 增量}"""
+    for (user_id, collection_id), delta in totals.items():
+        board = _loaded('collection', collection_id)
+        if board is not None:
+            board.increment(user_id, delta)
+
+
+def set_course_progress(sums, removed=()):
+    """课程进度重新汇总后同步到已加载的排行榜"""
+    for (user_id, collection_id), total in sums.items():
+        board = _loaded('collection', collection_id)
+        if board is not None:
+            board.update(user_id, total)
+    for user_id, collection_id in removed:
+        board = _loaded('collection', collection_id)
+        if board is not None:
+            board.remove(user_id)
+
+
+def _drop(kind, object_id):
+    with _boards_lock:
+        _boards.pop((kind, object_id), None)
+
+
+def drop_homework(homework_id):
+    """成绩被批量修改后丢弃本进程已加载的作业排行榜，下次访问时重新加载"""
+    _drop('homework', int(homework_id))
+
+
+@receiver(post_save, sender=Score)
+def update_on_score_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+
+    def apply():
+        board = _loaded('homework', instance.homework_id)
+        if board is None:
+            return
+        if not created:
+            # 修改已有成绩时最高分可能下降，下次访问时重新加载
+            _drop('homework', instance.homework_id)
+            return
+        best = board.score(instance.user_id)
+        if best is None or instance.score > best:
+            board.update(instance.user_id, instance.score)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=Score)
+def invalidate_on_score_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: _drop('homework', instance.homework_id))
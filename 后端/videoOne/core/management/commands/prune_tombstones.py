@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = '删除超过保留期限（CATALOG_SYNC.TOMBSTONE_DAYS）的目录删除记录'
+
+    def handle(self, *args, **options):
+        count = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f'已删除 {count} 条过期的删除记录'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.rollups import rebuild_course_progress
+
+
+class Command(BaseCommand):
+    help = '根据播放记录全量重建课程进度汇总（CourseProgress）'
+
+    def handle(self, *args, **options):
+        count = rebuild_course_progress()
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 条课程进度汇总'))
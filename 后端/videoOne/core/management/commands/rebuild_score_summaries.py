@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.rollups import rebuild_score_summaries
+
+
+class Command(BaseCommand):
+    help = '根据全部成绩重建成绩汇总（ScoreSummary）'
+
+    def handle(self, *args, **options):
+        count = rebuild_score_summaries()
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 条成绩汇总'))
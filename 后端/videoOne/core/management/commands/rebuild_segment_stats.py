@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core.heatmap import rebuild
+from core.models import Video
+
+
+class Command(BaseCommand):
+    help = '根据播放记录全量重建视频各分段的观看人数（SegmentStat）'
+
+    def handle(self, *args, **options):
+        count = sum(rebuild(video) for video in Video.objects.iterator())
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 条分段观看人数'))
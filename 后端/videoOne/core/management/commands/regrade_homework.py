@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.regrade import regrade_homework
+
+
+class Command(BaseCommand):
+    help = '按当前题目和答案重新计算作业的全部成绩'
+
+    def add_arguments(self, parser):
+        parser.add_argument('homework_ids', nargs='+', type=int)
+        parser.add_argument('--workers', type=int, default=None, help='判分工作进程数，默认按 settings.REGRADE')
+
+    def handle(self, *args, **options):
+        for homework_id in options['homework_ids']:
+            state = regrade_homework(homework_id, workers=options['workers'])
+            self.stdout.write(self.style.SUCCESS(
+                f"作业 {homework_id}：重新判分 {state['done']} 条，分数变化 {state['changed']} 条，"
+                f"无作答记录 {state['skipped']} 条"
+            ))
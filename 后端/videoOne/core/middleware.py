@@ -0,0 +1,171 @@
+"""
+查询性能分析中间件（默认关闭，见 settings.QUERY_PROFILE）。
+
+记录每个请求的 SQL 次数、数据库耗时、序列化耗时和接口名称，
+把 SQL 归一化为"查询形态"后统计重复次数，同一形态超过阈值即视为 N+1。
+结果写入日志，并保存在进程内供 /api/debug/query-profile/ 查看。
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_current_profile = contextvars.ContextVar('query_profile', default=None)
+
+_history = deque(maxlen=200)
+_history_lock = threading.Lock()
+
+_PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def query_shape(sql):
+    """SQL 归一化：去掉字面量，IN 列表不论长短视为同一形态"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _PLACEHOLDER_LIST.sub('%s...', sql)
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.shapes = Counter()
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.shapes[query_shape(sql)] += 1
+
+
+def _timed_data(data_property):
+    """包装序列化器的 data 属性，累计最外层序列化的耗时"""
+    def getter(serializer):
+        profile = _current_profile.get()
+        if profile is None:
+            return data_property.fget(serializer)
+        profile.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return data_property.fget(serializer)
+        finally:
+            profile.serializer_depth -= 1
+            if profile.serializer_depth == 0:
+                profile.serializer_time += time.perf_counter() - start
+    return property(getter)
+
+
+_serializers_patched = False
+
+
+def _patch_serializers():
+    global _serializers_patched
+    if _serializers_patched:
+        return
+    from rest_framework import serializers
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        serializer_class.data = _timed_data(serializer_class.data)
+    _serializers_patched = True
+
+
+class QueryProfileMiddleware:
+    def __init__(self, get_response):
+        config = getattr(settings, 'QUERY_PROFILE', {})
+        if not config.get('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = config.get('N_PLUS_ONE_THRESHOLD', 5)
+        global _history
+        _history = deque(maxlen=config.get('HISTORY_SIZE', 200))
+        _patch_serializers()
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile.record_query))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total_time = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        report = {
+            'endpoint': f"{request.method} {match.view_name if match else request.path}",
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'queries': profile.queries,
+            'db_ms': round(profile.db_time * 1000, 2),
+            'serializer_ms': round(profile.serializer_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2),
+            'n_plus_one': [
+                {'count': count, 'sql': shape}
+                for shape, count in profile.shapes.most_common() if count >= self.threshold
+            ],
+        }
+        with _history_lock:
+            _history.append(report)
+
+        log = logger.warning if report['n_plus_one'] else logger.info
+        log(
+            f"[query-profile] {report['endpoint']} status={report['status']} queries={report['queries']} "
+            f"db={report['db_ms']}ms serializer={report['serializer_ms']}ms total={report['total_ms']}ms "
+            f"n+1={len(report['n_plus_one'])}"
+        )
+        response['X-Query-Count'] = str(profile.queries)
+        return response
+
+
+def profile_report():
+    """最近请求的明细和按接口汇总的统计"""
+    with _history_lock:
+        recent = list(_history)
+
+    endpoints = {}
+    for report in recent:
+        stats = endpoints.setdefault(report['endpoint'], {
+            'requests': 0, 'queries': 0, 'max_queries': 0, 'db_ms': 0.0,
+            'serializer_ms': 0.0, 'total_ms': 0.0, 'n_plus_one_requests': 0,
+        })
+        stats['requests'] += 1
+        stats['queries'] += report['queries']
+        stats['max_queries'] = max(stats['max_queries'], report['queries'])
+        stats['db_ms'] += report['db_ms']
+        stats['serializer_ms'] += report['serializer_ms']
+        stats['total_ms'] += report['total_ms']
+        stats['n_plus_one_requests'] += bool(report['n_plus_one'])
+
+    summary = []
+    for endpoint, stats in endpoints.items():
+        count = stats.pop('requests')
+        summary.append({
+            'endpoint': endpoint,
+            'requests': count,
+            'avg_queries': round(stats['queries'] / count, 2),
+            'max_queries': stats['max_queries'],
+            'avg_db_ms': round(stats['db_ms'] / count, 2),
+            'avg_serializer_ms': round(stats['serializer_ms'] / count, 2),
+            'avg_total_ms': round(stats['total_ms'] / count, 2),
+            'n_plus_one_requests': stats['n_plus_one_requests'],
+        })
+    summary.sort(key=lambda item: item['avg_queries'], reverse=True)
+    return {'endpoints': summary, 'recent': recent}
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_playbackstat_question_score_remove_category_locked_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playbackstat',
+            name='watched',
+            field=models.BinaryField(blank=True, default=b'', verbose_name='观看分段位图'),
+        ),
+    ]
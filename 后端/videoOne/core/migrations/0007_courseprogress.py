@@ -0,0 +1,49 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def backfill_course_progress(apps, schema_editor):
+    """根据已有的播放记录生成课程进度汇总"""
+    PlaybackStat = apps.get_model('core', 'PlaybackStat')
+    CourseProgress = apps.get_model('core', 'CourseProgress')
+    rows = [
+        CourseProgress(
+            user_id=row['user_id'],
+            collection_id=row['video__category__collection_id'],
+            progress_sum=row['total']
+        )
+        for row in PlaybackStat.objects.values('user_id', 'video__category__collection_id')
+        .annotate(total=Sum('progress')).order_by()
+    ]
+    CourseProgress.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_playbackstat_watched'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('progress_sum', models.IntegerField(default=0, verbose_name='进度总和')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_progress', to='core.collection')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '课程进度汇总',
+                'verbose_name_plural': '课程进度汇总',
+                'indexes': [models.Index(fields=['collection', 'progress_sum'], name='core_course_collect_33dff4_idx')],
+                'unique_together': {('user', 'collection')},
+            },
+        ),
+        migrations.RunPython(backfill_course_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20, verbose_name='模型')),
+                ('object_id', models.BigIntegerField(verbose_name='对象ID')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='删除时间')),
+            ],
+            options={
+                'verbose_name': '删除记录',
+                'verbose_name_plural': '删除记录',
+            },
+        ),
+    ]
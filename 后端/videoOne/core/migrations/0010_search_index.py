@@ -0,0 +1,42 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='类型')),
+                ('object_id', models.BigIntegerField(verbose_name='对象ID')),
+                ('length', models.PositiveIntegerField(default=0, verbose_name='词数')),
+            ],
+            options={
+                'verbose_name': '搜索文档',
+                'verbose_name_plural': '搜索文档',
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=32, verbose_name='词')),
+                ('frequency', models.PositiveIntegerField(verbose_name='词频')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='core.searchdocument')),
+            ],
+            options={
+                'verbose_name': '搜索倒排记录',
+                'verbose_name_plural': '搜索倒排记录',
+                'unique_together': {('term', 'document')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='score',
+            name='answers',
+            field=models.JSONField(blank=True, null=True, verbose_name='作答'),
+        ),
+    ]
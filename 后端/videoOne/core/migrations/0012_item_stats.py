@@ -0,0 +1,44 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_score_answers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.IntegerField(default=0, verbose_name='作答次数')),
+                ('correct', models.IntegerField(default=0, verbose_name='答对次数')),
+                ('rest_sum', models.BigIntegerField(default=0, verbose_name='其余得分之和')),
+                ('rest_square_sum', models.BigIntegerField(default=0, verbose_name='其余得分平方和')),
+                ('correct_rest_sum', models.BigIntegerField(default=0, verbose_name='答对者其余得分之和')),
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stat', to='core.question')),
+            ],
+            options={
+                'verbose_name': '题目统计',
+                'verbose_name_plural': '题目统计',
+            },
+        ),
+        migrations.CreateModel(
+            name='OptionStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('option', models.CharField(max_length=255, verbose_name='选项')),
+                ('count', models.IntegerField(default=0, verbose_name='选择次数')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='option_stats', to='core.question')),
+            ],
+            options={
+                'verbose_name': '选项统计',
+                'verbose_name_plural': '选项统计',
+                'unique_together': {('question', 'option')},
+            },
+        ),
+    ]
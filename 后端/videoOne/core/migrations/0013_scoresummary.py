@@ -0,0 +1,57 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_score_summaries(apps, schema_editor):
+    """根据已有的成绩生成成绩汇总"""
+    Score = apps.get_model('core', 'Score')
+    ScoreSummary = apps.get_model('core', 'ScoreSummary')
+    summaries = {}
+    for user_id, homework_id, score, submitted_at in Score.objects.order_by('submitted_at', 'id').values_list(
+        'user_id', 'homework_id', 'score', 'submitted_at'
+    ).iterator():
+        summary = summaries.get((user_id, homework_id))
+        if summary is None:
+            summaries[(user_id, homework_id)] = ScoreSummary(
+                user_id=user_id, homework_id=homework_id, best_score=score, latest_score=score, attempts=1,
+                first_submitted_at=submitted_at, last_submitted_at=submitted_at
+            )
+            continue
+        summary.best_score = max(summary.best_score, score)
+        summary.latest_score = score
+        summary.attempts += 1
+        summary.last_submitted_at = submitted_at
+    ScoreSummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_item_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('best_score', models.IntegerField(verbose_name='最高分')),
+                ('latest_score', models.IntegerField(verbose_name='最近得分')),
+                ('attempts', models.IntegerField(verbose_name='提交次数')),
+                ('first_submitted_at', models.DateTimeField(verbose_name='首次提交时间')),
+                ('last_submitted_at', models.DateTimeField(verbose_name='最近提交时间')),
+                ('homework', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_summaries', to='core.homework')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': '成绩汇总',
+                'verbose_name_plural': '成绩汇总',
+                'indexes': [models.Index(fields=['homework', 'best_score'], name='core_scores_homewor_462f05_idx')],
+                'unique_together': {('user', 'homework')},
+            },
+        ),
+        migrations.RunPython(backfill_score_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import migrations
+
+# 类型 -> (模型名, [(字段, 权重)])，与 core.search.SOURCES 一致
+SOURCES = {
+    'collection': ('Collection', [('name', 2), ('description', 1)]),
+    'video': ('Video', [('title', 2), ('description', 1)]),
+    'homework': ('Homework', [('title', 2), ('description', 1)]),
+    'material': ('Material', [('title', 2), ('description', 1)]),
+    'question': ('Question', [('content', 2), ('options', 1)]),
+}
+
+BATCH_SIZE = 1000
+
+# 切词规则为迁移编写时 core.search.tokenize 的副本，之后修改切词不影响本迁移
+MAX_TERM_LENGTH = 32
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_CJK_RE = re.compile(f'[{_CJK}]')
+_RUN_RE = re.compile(f'[{_CJK}]+|[a-z0-9]+')
+
+
+def tokenize(text):
+    """切词：中文连续片段切成相邻二元组（单字片段保留单字），英文数字按单词"""
+    tokens = []
+    for run in _RUN_RE.findall(unicodedata.normalize('NFKC', text or '').lower()):
+        if _CJK_RE.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:MAX_TERM_LENGTH])
+    return tokens
+
+
+def _text(obj, field):
+    value = getattr(obj, field)
+    if field == 'options':
+        return ' '.join(str(option.get('text', '')) for option in value or [] if isinstance(option, dict))
+    return value
+
+
+def backfill_search_index(apps, schema_editor):
+    """为迁移前已有的数据建立搜索索引，之后由信号增量维护"""
+    SearchDocument = apps.get_model('core', 'SearchDocument')
+    SearchPosting = apps.get_model('core', 'SearchPosting')
+    for kind, (model_name, fields) in SOURCES.items():
+        model = apps.get_model('core', model_name)
+        indexed = set(SearchDocument.objects.filter(kind=kind).values_list('object_id', flat=True))
+        objects = [obj for obj in model.objects.order_by('pk').iterator() if obj.pk not in indexed]
+        for start in range(0, len(objects), BATCH_SIZE):
+            batch = objects[start:start + BATCH_SIZE]
+            counts = []
+            for obj in batch:
+                count = Counter()
+                for field, weight in fields:
+                    for token in tokenize(_text(obj, field)):
+                        count[token] += weight
+                counts.append(count)
+            SearchDocument.objects.bulk_create([
+                SearchDocument(kind=kind, object_id=obj.pk, length=sum(count.values()))
+                for obj, count in zip(batch, counts)
+            ])
+            ids = dict(SearchDocument.objects.filter(
+                kind=kind, object_id__in=[obj.pk for obj in batch]
+            ).values_list('object_id', 'id'))
+            SearchPosting.objects.bulk_create(
+                [
+                    SearchPosting(term=term, document_id=ids[obj.pk], frequency=frequency)
+                    for obj, count in zip(batch, counts)
+                    for term, frequency in count.items()
+                ],
+                batch_size=BATCH_SIZE,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_scoresummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
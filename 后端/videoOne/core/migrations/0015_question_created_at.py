@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_backfill_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True, verbose_name='创建时间'),
+        ),
+    ]
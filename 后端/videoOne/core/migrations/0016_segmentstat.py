@@ -0,0 +1,56 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:37
+
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# 与 core.watchmap.MAX_SEGMENTS 一致
+MAX_SEGMENTS = 8 * 4096
+
+BATCH_SIZE = 500
+
+
+def backfill_segment_stats(apps, schema_editor):
+    """按已有播放记录的观看位图统计各分段的观看人数，之后随播放进度写入增量累加"""
+    PlaybackStat = apps.get_model('core', 'PlaybackStat')
+    SegmentStat = apps.get_model('core', 'SegmentStat')
+    counts = Counter()
+    for video_id, watched in PlaybackStat.objects.values_list('video_id', 'watched').iterator():
+        value = int.from_bytes(bytes(watched or b'')[:MAX_SEGMENTS // 8], 'little')
+        while value:
+            low = value & -value
+            counts[video_id, low.bit_length() - 1] += 1
+            value ^= low
+    SegmentStat.objects.bulk_create(
+        [
+            SegmentStat(video_id=video_id, segment=segment, viewers=viewers)
+            for (video_id, segment), viewers in sorted(counts.items())
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_question_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.PositiveIntegerField(verbose_name='分段序号')),
+                ('viewers', models.IntegerField(default=0, verbose_name='观看人数')),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segment_stats', to='core.video')),
+            ],
+            options={
+                'verbose_name': '分段观看人数',
+                'verbose_name_plural': '分段观看人数',
+                'unique_together': {('video', 'segment')},
+            },
+        ),
+        migrations.RunPython(backfill_segment_stats, migrations.RunPython.noop),
+    ]
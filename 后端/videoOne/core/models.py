@@ -8,6 +8,8 @@ import os
 import logging
 from django.conf import settings
 
+from . import watchmap
+
 logger = logging.getLogger(__name__)
 
 
@@ -48,6 +50,7 @@ class Collection(models.Model):
         null=True,
         help_text='上传合辑封面图'
     )
+    updated_at = models.DateTimeField('更新时间', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = '合辑'
@@ -58,6 +61,7 @@ class Category(models.Model):
     name = models.CharField('分类名称', max_length=100)
     collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='categories')
     progress = models.PositiveSmallIntegerField('进度', default=0)
+    updated_at = models.DateTimeField('更新时间', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = '分类'
@@ -78,6 +82,7 @@ class Video(models.Model):
         null=True,
         help_text='上传视频缩略图'
     )
+    updated_at = models.DateTimeField('更新时间', auto_now=True, db_index=True)
 
     def save(self, *args, **kwargs):
         # 先保存模型，确保文件写入存储
@@ -124,6 +129,7 @@ class Homework(models.Model):
     description = models.TextField('描述', blank=True)
     deadline = models.DateTimeField('截止时间')
     related_questions = models.ManyToManyField('Question', related_name='related_homeworks', blank=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = '作业'
@@ -136,6 +142,7 @@ class Material(models.Model):
     description = models.TextField('描述', blank=True)
     url = models.CharField('资料地址', max_length=200)
     date = models.DateTimeField('日期', auto_now_add=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = '学习资料'
@@ -148,6 +155,9 @@ class Question(models.Model):
     content = models.TextField()
     options = models.JSONField()
     score = models.IntegerField()
+    # 早期的题目没有记录，视为早于全部提交
+    created_at = models.DateTimeField('创建时间', auto_now_add=True, null=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = '题目'
@@ -158,6 +168,8 @@ class Score(models.Model):
     homework = models.ForeignKey(Homework, on_delete=models.CASCADE, related_name='scores')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='scores')
     score = models.IntegerField()
+    # 提交的作答 [{"questionId", "answer"}]，用于修改答案后重新判分；早期的成绩没有记录
+    answers = models.JSONField('作答', null=True, blank=True)
     submitted_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -171,6 +183,12 @@ class PlaybackStat(models.Model):
     progress = models.IntegerField()
     duration = models.IntegerField()
     last_played_at = models.DateTimeField()
+    watched = models.BinaryField('观看分段位图', default=b'', blank=True)
+
+    @property
+    def completion(self):
+        """按实际观看分段计算的完成度（0~1），拖动进度条跳过的部分不计入"""
+        return watchmap.completion(self.watched, self.video.duration_seconds)
 
     class Meta:
         verbose_name = '播放记录'
@@ -178,11 +196,142 @@ class PlaybackStat(models.Model):
         unique_together = ('user', 'video')
 
 
+class CourseProgress(models.Model):
+    """按 (用户, 合辑) 汇总的播放进度，随播放进度写入增量维护"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='course_progress')
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='user_progress')
+    progress_sum = models.IntegerField('进度总和', default=0)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '课程进度汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ('user', 'collection')
+        indexes = [
+            models.Index(fields=['collection', 'progress_sum']),
+        ]
+
+
+class SegmentStat(models.Model):
+    """视频每个分段的实际观看人数，随播放进度写入增量累加（见 heatmap.py）"""
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='segment_stats')
+    segment = models.PositiveIntegerField('分段序号')
+    viewers = models.IntegerField('观看人数', default=0)
+
+    class Meta:
+        verbose_name = '分段观看人数'
+        verbose_name_plural = verbose_name
+        unique_together = ('video', 'segment')
+
+
+class ScoreSummary(models.Model):
+    """按 (用户, 作业) 汇总的成绩：最高分、最近一次得分、提交次数和首末提交时间，随提交维护"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='score_summaries')
+    homework = models.ForeignKey(Homework, on_delete=models.CASCADE, related_name='score_summaries')
+    best_score = models.IntegerField('最高分')
+    latest_score = models.IntegerField('最近得分')
+    attempts = models.IntegerField('提交次数')
+    first_submitted_at = models.DateTimeField('首次提交时间')
+    last_submitted_at = models.DateTimeField('最近提交时间')
+
+    class Meta:
+        verbose_name = '成绩汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ('user', 'homework')
+        indexes = [
+            models.Index(fields=['homework', 'best_score']),
+        ]
+
+
+class QuestionStat(models.Model):
+    """
+    题目的作答统计，随每次提交增量累加。
+    rest 为该次提交除本题以外的得分，用于计算区分度（本题对错与其余得分的点二列相关）
+    """
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, related_name='stat')
+    attempts = models.IntegerField('作答次数', default=0)
+    correct = models.IntegerField('答对次数', default=0)
+    rest_sum = models.BigIntegerField('其余得分之和', default=0)
+    rest_square_sum = models.BigIntegerField('其余得分平方和', default=0)
+    correct_rest_sum = models.BigIntegerField('答对者其余得分之和', default=0)
+
+    class Meta:
+        verbose_name = '题目统计'
+        verbose_name_plural = verbose_name
+
+
+class OptionStat(models.Model):
+    """题目各选项被选择的次数"""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='option_stats')
+    option = models.CharField('选项', max_length=255)
+    count = models.IntegerField('选择次数', default=0)
+
+    class Meta:
+        verbose_name = '选项统计'
+        verbose_name_plural = verbose_name
+        unique_together = ('question', 'option')
+
+
+class Tombstone(models.Model):
+    """已删除的目录对象，供增量同步接口告知客户端删除"""
+    model = models.CharField('模型', max_length=20)
+    object_id = models.BigIntegerField('对象ID')
+    deleted_at = models.DateTimeField('删除时间', auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = '删除记录'
+        verbose_name_plural = verbose_name
+
+
+def record_deletion(instance):
+    Tombstone.objects.create(model=instance._meta.model_name, object_id=instance.pk)
+
+
+class SearchDocument(models.Model):
+    """搜索索引中的文档，对应一个合辑、视频、作业、资料或题目"""
+    kind = models.CharField('类型', max_length=20)
+    object_id = models.BigIntegerField('对象ID')
+    length = models.PositiveIntegerField('词数', default=0)
+
+    class Meta:
+        verbose_name = '搜索文档'
+        verbose_name_plural = verbose_name
+        unique_together = ('kind', 'object_id')
+
+
+class SearchPosting(models.Model):
+    """倒排索引：词 -> 文档及词频"""
+    term = models.CharField('词', max_length=32)
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='postings')
+    frequency = models.PositiveIntegerField('词频')
+
+    class Meta:
+        verbose_name = '搜索倒排记录'
+        verbose_name_plural = verbose_name
+        # 以 term 开头的唯一索引同时用于按词查找和单字前缀查找
+        unique_together = ('term', 'document')
+
+
+class CatalogVersion(models.Model):
+    """
+    内容版本戳，用于 ETag / Last-Modified。
+    scope 为 catalog（全部目录）、collection:<id>、category:<id> 或 homework:<id>，范围内的内容变化时更换 version
+    """
+    scope = models.CharField('范围', max_length=50, unique=True)
+    version = models.CharField('版本', max_length=32)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '内容版本'
+        verbose_name_plural = verbose_name
+
+
 @receiver(post_delete, sender=Collection)
 def delete_collection_thumbnail(sender, instance, **kwargs):
     """
     删除 Collection 记录时，同步删除对应的缩略图文件。
     """
+    record_deletion(instance)
     if instance.thumbnail:  # 检查是否存在缩略图
         try:
             if os.path.isfile(instance.thumbnail.path):  # 检查文件是否存在
@@ -193,6 +342,8 @@ def delete_collection_thumbnail(sender, instance, **kwargs):
 
 @receiver(post_delete, sender=Video)
 def delete_video_files(sender, instance, **kwargs):
+    record_deletion(instance)
+
     # 删除视频文件
     if instance.url:
         try:
@@ -212,6 +363,7 @@ def delete_video_files(sender, instance, **kwargs):
 
 @receiver(post_delete, sender=Material)
 def delete_material_file(sender, instance, **kwargs):
+    record_deletion(instance)
     if instance.url:
         try:
             file_path = os.path.join(settings.MEDIA_ROOT, instance.url)
@@ -219,3 +371,9 @@ def delete_material_file(sender, instance, **kwargs):
                 os.remove(file_path)
         except Exception as e:
             print(f"Error deleting file: {e}")
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Homework)
+def record_catalog_deletion(sender, instance, **kwargs):
+    record_deletion(instance)
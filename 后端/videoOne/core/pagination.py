@@ -0,0 +1,34 @@
+"""
+游标（keyset）分页。
+
+按自增主键倒序排列，下一页用 WHERE id < 上一页最后一条的 id 定位，不使用 OFFSET，
+翻到多深的位置查询代价都只与页大小有关。
+成绩、播放记录等随用户和提交增长的列表总是分页（KeysetPagination），每页最多 max_page_size 条；
+目录类列表为兼容现有前端，只有传入 cursor 或 page_size 参数时才分页（OptionalKeysetPagination）。
+"""
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(CursorPagination):
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class OptionalKeysetPagination(KeysetPagination):
+    """未传分页参数时返回完整列表"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+def paginated_response(request, queryset, serializer_class, **kwargs):
+    """自定义接口使用的分页，返回 {next, previous, results}"""
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(serializer_class(page, many=True, **kwargs).data)
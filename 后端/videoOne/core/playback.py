@@ -0,0 +1,357 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, router, transaction
+from django.utils import timezone
+
+from . import heatmap, rollups, watchmap
+from .models import PlaybackStat, Video
+
+logger = logging.getLogger(__name__)
+
+
+# 插入或更新：进度取 max，观看位图取已合并的新值；续播位置和最后播放时间只在本次播放时间不早于已有记录时更新，
+# 迟到的离线记录不会覆盖更新的续播位置。MySQL 按书写顺序赋值，duration 必须在 last_played_at 之前
+UPSERT_SQL = {
+    'mysql': (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON DUPLICATE KEY UPDATE '
+        '{progress} = GREATEST({progress}, VALUES({progress})), '
+        '{duration} = IF(VALUES({played_at}) >= {played_at}, VALUES({duration}), {duration}), '
+        '{played_at} = GREATEST({played_at}, VALUES({played_at})), '
+        '{watched} = VALUES({watched})'
+    ),
+    'sqlite': (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON CONFLICT ({user}, {video}) DO UPDATE SET '
+        '{progress} = MAX({progress}, excluded.{progress}), '
+        '{duration} = CASE WHEN excluded.{played_at} >= {played_at} THEN excluded.{duration} ELSE {duration} END, '
+        '{played_at} = MAX({played_at}, excluded.{played_at}), '
+        '{watched} = excluded.{watched}'
+    ),
+}
+
+# 只插入不存在的记录，已存在（其他事务刚插入）的跳过，按影响行数判断实际插入了哪些
+INSERT_NEW_SQL = {
+    'mysql': 'INSERT IGNORE INTO {table} ({columns}) VALUES {values}',
+    'sqlite': 'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT ({user}, {video}) DO NOTHING',
+}
+
+UPSERT_BATCH_SIZE = 500
+
+# 批量同步接口单次允许的最大记录数
+MAX_SYNC_RECORDS = 1000
+
+
+def _coalesce(records, played_at):
+    """
+    合并同一 (user_id, video_id) 的多条记录，进度取最大值，观看位图按位或，其余取最后一条。
+    每条记录的续播位置（duration 秒）所在分段计为已观看。
+    """
+    merged = {}
+    for record in records:
+        user_id, video_id, progress, duration = record[:4]
+        at = record[4] if len(record) > 4 and record[4] else played_at
+        watched = watchmap.mark(record[5] if len(record) > 5 else b'', duration)
+        key = (user_id, video_id)
+        entry = merged.get(key)
+        if entry is not None:
+            progress = max(entry[0], progress)
+            watched = watchmap.merge(entry[3], watched)
+        merged[key] = (progress, duration, at, watched)
+    return merged
+
+
+def _lock_stored(merged, using):
+    """
+    读取（并锁定）已有记录的进度和观看位图，把已有位图合并进新位图。
+    返回 {(user_id, video_id): (写入前的进度, 写入前的位图)}
+    """
+    stored = {
+        (user_id, video_id): (progress, bytes(watched or b''))
+        for user_id, video_id, progress, watched in PlaybackStat.objects.using(using).select_for_update().filter(
+            user_id__in={user_id for user_id, _ in merged},
+            video_id__in={video_id for _, video_id in merged}
+        ).values_list('user_id', 'video_id', 'progress', 'watched')
+    }
+    for key, (progress, duration, at, watched) in merged.items():
+        if key in stored:
+            merged[key] = (progress, duration, at, watchmap.merge(stored[key][1], watched))
+    return stored
+
+
+def _apply_derived(merged, stored, using=None):
+    """
+    根据写入前后的差异更新派生数据：
+    课程进度汇总和视频热力图的分段观看人数都在同一事务内累加。
+    """
+    deltas = {}
+    changes = []
+    for key, entry in merged.items():
+        old_progress, old_watched = stored.get(key, (None, b''))
+        if old_progress is None:
+            # 新建的记录即使进度为 0 也要计入课程参与人数
+            deltas[key] = int(entry[0])
+        elif int(entry[0]) > old_progress:
+            deltas[key] = int(entry[0]) - old_progress
+        changes.append((key[1], old_watched, watchmap.merge(old_watched, entry[3])))
+
+    rollups.add_course_progress(deltas, using)
+    heatmap.add_watched(changes, using)
+
+
+def _values(count):
+    return ', '.join(['(%s, %s, %s, %s, %s, %s)'] * count)
+
+
+def _params(connection, items):
+    params = []
+    for (user_id, video_id), (progress, duration, at, watched) in items:
+        params.extend([
+            user_id,
+            video_id,
+            int(progress),
+            int(duration),
+            connection.ops.adapt_datetimefield_value(at),
+            watched,
+        ])
+    return params
+
+
+def _insert_new(connection, cursor, names, items):
+    """
+    插入 _lock_stored 中不存在的记录，返回实际插入的键。
+    行锁锁不住还不存在的记录，并发的首次写入可能已插入同一记录：整批都插入时一条语句完成，
+    否则回滚该批后逐条插入，找出被抢先插入的键
+    """
+    template = INSERT_NEW_SQL[connection.vendor]
+    inserted = set()
+    for start in range(0, len(items), UPSERT_BATCH_SIZE):
+        batch = items[start:start + UPSERT_BATCH_SIZE]
+        savepoint = transaction.savepoint(using=connection.alias)
+        cursor.execute(template.format(values=_values(len(batch)), **names), _params(connection, batch))
+        if cursor.rowcount == len(batch):
+            transaction.savepoint_commit(savepoint, using=connection.alias)
+            inserted.update(key for key, _ in batch)
+            continue
+        transaction.savepoint_rollback(savepoint, using=connection.alias)
+        for item in batch:
+            cursor.execute(template.format(values=_values(1), **names), _params(connection, [item]))
+            if cursor.rowcount:
+                inserted.add(item[0])
+    return inserted
+
+
+def upsert_progress(user_id, video_id, progress, duration, played_at=None):
+    """写入单条播放进度，见 upsert_progress_many"""
+    upsert_progress_many([(user_id, video_id, progress, duration)], played_at)
+
+
+def upsert_progress_many(records, played_at=None):
+    """
+    批量写入播放进度，每批一条插入或更新语句（首次写入的记录先单独插入）。
+    records: 可迭代的 (user_id, video_id, progress, duration[, last_played_at[, watched]])
+    进度只增不减，时长（即续播位置）与最后播放时间取播放时间最新的一条，观看位图与已有位图按位或。
+    位图无法在 SQL 中跨数据库按位或，因此同一事务内先锁定读取已有位图再写入。
+    """
+    merged = _coalesce(records, played_at or timezone.now())
+    if not merged:
+        return
+
+    connection = connections[router.db_for_write(PlaybackStat)]
+    template = UPSERT_SQL.get(connection.vendor)
+    if template is None:
+        # 其他数据库退回到先查询再批量更新的方式
+        _write_progress_batch(merged)
+        return
+
+    opts = PlaybackStat._meta
+    qn = connection.ops.quote_name
+    names = {
+        'table': qn(opts.db_table),
+        'user': qn(opts.get_field('user').column),
+        'video': qn(opts.get_field('video').column),
+        'progress': qn(opts.get_field('progress').column),
+        'duration': qn(opts.get_field('duration').column),
+        'played_at': qn(opts.get_field('last_played_at').column),
+        'watched': qn(opts.get_field('watched').column),
+    }
+    names['columns'] = ', '.join(
+        names[name] for name in ('user', 'video', 'progress', 'duration', 'played_at', 'watched')
+    )
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        stored = _lock_stored(merged, connection.alias)
+        inserted = _insert_new(connection, cursor, names, [item for item in merged.items() if item[0] not in stored])
+        conflicted = {key: entry for key, entry in merged.items() if key not in stored and key not in inserted}
+        if conflicted:
+            # 被并发的首次写入抢先插入的记录此时已存在，锁定读取后按已有记录更新，增量只计入一次
+            stored.update(_lock_stored(conflicted, connection.alias))
+            merged.update(conflicted)
+        items = [item for item in merged.items() if item[0] not in inserted]
+        for start in range(0, len(items), UPSERT_BATCH_SIZE):
+            batch = items[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(template.format(values=_values(len(batch)), **names), _params(connection, batch))
+        _apply_derived(merged, stored, connection.alias)
+
+
+def _write_progress_batch(entries):
+    """
+    先查询再批量写入播放进度，用于不支持单条 upsert 的数据库。
+    entries: {(user_id, video_id): (progress, duration, last_played_at, watched)}
+    """
+    user_ids = {user_id for user_id, _ in entries}
+    video_ids = {video_id for _, video_id in entries}
+
+    with transaction.atomic():
+        existing = {
+            (stat.user_id, stat.video_id): stat
+            for stat in PlaybackStat.objects.select_for_update().filter(
+                user_id__in=user_ids, video_id__in=video_ids
+            )
+        }
+
+        for key, (progress, duration, played_at, watched) in entries.items():
+            if key in existing:
+                continue
+            try:
+                with transaction.atomic():
+                    PlaybackStat.objects.bulk_create([PlaybackStat(
+                        user_id=key[0],
+                        video_id=key[1],
+                        progress=progress,
+                        duration=duration,
+                        last_played_at=played_at,
+                        watched=watched
+                    )])
+            except IntegrityError:
+                # 并发的首次写入抢先插入了同一记录，锁定读取后按已有记录更新
+                existing[key] = PlaybackStat.objects.select_for_update().get(user_id=key[0], video_id=key[1])
+
+        stored = {key: (stat.progress, bytes(stat.watched or b'')) for key, stat in existing.items()}
+
+        to_update = []
+        for key, (progress, duration, played_at, watched) in entries.items():
+            stat = existing.get(key)
+            if stat is None:
+                continue
+            stat.progress = max(stat.progress, progress)
+            if played_at >= stat.last_played_at:
+                stat.duration = duration
+                stat.last_played_at = played_at
+            stat.watched = watchmap.merge(stat.watched, watched)
+            to_update.append(stat)
+
+        if to_update:
+            PlaybackStat.objects.bulk_update(to_update, ['progress', 'duration', 'last_played_at', 'watched'])
+        _apply_derived(entries, stored)
+
+
+class PlaybackBuffer:
+    """
+    播放心跳写缓冲（write-behind）。
+    按 (user_id, video_id) 合并心跳，只保留最大进度、最新续播位置和期间观看过的分段，
+    达到键数量阈值或刷新间隔时批量写入数据库，
+    数据库写入量只与在线观看人数相关，与心跳频率无关。
+    """
+
+    def __init__(self, flush_interval=5, max_keys=500):
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def add(self, user_id, video_id, progress, duration):
+        key = (user_id, video_id)
+        now = timezone.now()
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = (progress, duration, now, watchmap.mark(b'', duration))
+            else:
+                self._pending[key] = (max(entry[0], progress), duration, now, watchmap.mark(entry[3], duration))
+            due = (len(self._pending) >= self.max_keys
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+            self._ensure_timer()
+        if due:
+            self.flush()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """将缓冲中的心跳写入数据库，返回写入的记录数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        try:
+            # 过滤掉不存在的视频，避免外键错误导致整批写入失败
+            valid_videos = set(Video.objects.filter(
+                id__in={video_id for _, video_id in pending}
+            ).values_list('id', flat=True))
+            pending = {key: value for key, value in pending.items() if key[1] in valid_videos}
+            upsert_progress_many(
+                (user_id, video_id, progress, duration, played_at, watched)
+                for (user_id, video_id), (progress, duration, played_at, watched) in pending.items()
+            )
+        except Exception as e:
+            logger.error(f"播放进度批量写入失败: {str(e)}")
+            self._requeue(pending)
+            return 0
+        return len(pending)
+
+    def _requeue(self, entries):
+        # 写入失败的记录放回缓冲，与期间新到的心跳合并
+        with self._lock:
+            for key, (progress, duration, played_at, watched) in entries.items():
+                entry = self._pending.get(key)
+                if entry is None:
+                    self._pending[key] = (progress, duration, played_at, watched)
+                else:
+                    self._pending[key] = (max(entry[0], progress), entry[1], entry[2],
+                                          watchmap.merge(entry[3], watched))
+
+    def _ensure_timer(self):
+        # 没有新心跳时也要按间隔刷新，由后台线程兜底
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Thread(target=self._run_timer, name='playback-buffer', daemon=True)
+        self._timer.start()
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self.pending_count():
+                close_old_connections()
+                self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_playback_buffer():
+    """获取进程内的心跳缓冲；未在 settings.PLAYBACK_BUFFER 中启用时返回 None"""
+    global _buffer
+    config = getattr(settings, 'PLAYBACK_BUFFER', {})
+    if not config.get('ENABLED'):
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = PlaybackBuffer(
+                    flush_interval=config.get('FLUSH_INTERVAL', 5),
+                    max_keys=config.get('MAX_KEYS', 500)
+                )
+                # 进程退出前写入剩余心跳
+                atexit.register(_buffer.flush)
+    return _buffer
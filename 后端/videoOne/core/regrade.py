@@ -0,0 +1,188 @@
+"""
+作业重新判分：题目或正确答案修改后，按保存的作答（Score.answers）重新计算该作业的全部成绩和题目统计。
+
+任务在后台线程中运行，不阻塞请求；成绩按 CHUNK_SIZE 分块，数量较多时分给多个工作进程判分，
+各块判分后只批量更新分数有变化的记录。进度写入共享缓存，可通过 progress() 查询。
+同一作业同时只运行一个任务，运行期间再次触发时在当前任务结束后重新运行一次。
+早于保存作答功能的成绩没有作答记录，无法重新判分，计入 skipped。
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+
+from . import grading, item_stats, leaderboard, rollups
+from .models import Question, Score
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'shared'
+PROGRESS_KEY = 'regrade_progress:{}'
+LOCK_KEY = 'regrade_lock:{}'
+PENDING_KEY = 'regrade_pending:{}'
+# 进度保留时间，锁的过期时间兜底运行中断的任务
+PROGRESS_TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 60 * 60
+
+
+def _config():
+    return {'WORKERS': None, 'CHUNK_SIZE': 1000, 'PARALLEL_THRESHOLD': 5000, **getattr(settings, 'REGRADE', {})}
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def progress(homework_id):
+    """最近一次重新判分的进度，没有时返回 None"""
+    return _cache().get(PROGRESS_KEY.format(homework_id))
+
+
+def running(homework_id):
+    """是否有等待或正在运行的重新判分，此时提交作答需与题目统计的重建互斥（见 item_stats.rebuild）"""
+    state = progress(homework_id)
+    return state is not None and state.get('status') in ('pending', 'running')
+
+
+def _set_progress(homework_id, **values):
+    _cache().set(PROGRESS_KEY.format(homework_id), values, PROGRESS_TIMEOUT)
+
+
+def grade_chunk(answer_key, created, rows):
+    """
+    工作进程中执行：created 为 {题目ID: 创建时间}，rows 为 [(成绩ID, 原分数, 作答, 提交时间)]，
+    返回 (分数有变化的 [(成绩ID, 新分数)], 这些提交的题目统计 item_stats.Tally)
+    """
+    changed = []
+    tally = item_stats.Tally()
+    for score_id, old_score, answers, submitted_at in rows:
+        marks = grading.mark(answer_key, answers, strict=False)
+        tally.add(answer_key, marks, item_stats.asked_questions(created, submitted_at))
+        new_score = sum(earned for *_, earned in marks)
+        if new_score != old_score:
+            changed.append((score_id, new_score))
+    return changed, tally
+
+
+def _chunks(homework_id, chunk_size):
+    # 按主键分段读取，避免一次加载全部作答
+    last_id = 0
+    while True:
+        rows = list(
+            Score.objects.filter(homework_id=homework_id, id__gt=last_id, answers__isnull=False)
+            .order_by('id').values_list('id', 'score', 'answers', 'submitted_at')[:chunk_size]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def _save(changed):
+    Score.objects.bulk_update([Score(id=score_id, score=score) for score_id, score in changed], ['score'])
+
+
+def regrade_homework(homework_id, workers=None):
+    """重新判分并返回进度信息；workers 为 None 时按 settings.REGRADE 决定是否使用多进程"""
+    config = _config()
+    chunk_size = config['CHUNK_SIZE']
+    answer_key = grading.compile_answer_key(homework_id)
+    created = dict(Question.objects.filter(homework_id=homework_id).values_list('id', 'created_at'))
+    submissions = Score.objects.filter(homework_id=homework_id)
+    total = submissions.filter(answers__isnull=False).count()
+    state = {
+        'status': 'running', 'total': total, 'done': 0, 'changed': 0,
+        'skipped': submissions.filter(answers__isnull=True).count(),
+        'started_at': timezone.now().isoformat(), 'finished_at': None,
+    }
+    _set_progress(homework_id, **state)
+
+    tally = item_stats.Tally()
+    # 已判分的最大成绩ID，之后提交的成绩在重建题目统计时补上
+    last_id = 0
+
+    def record(rows, result):
+        nonlocal last_id
+        changed, chunk_tally = result
+        tally.merge(chunk_tally)
+        last_id = max(last_id, rows[-1][0])
+        if changed:
+            _save(changed)
+        state['done'] += len(rows)
+        state['changed'] += len(changed)
+        _set_progress(homework_id, **state)
+
+    if workers is None:
+        workers = (config['WORKERS'] or os.cpu_count() or 1) if total >= config['PARALLEL_THRESHOLD'] else 1
+    if workers <= 1:
+        for rows in _chunks(homework_id, chunk_size):
+            record(rows, grade_chunk(answer_key, created, rows))
+    else:
+        # 工作进程只做判分，不访问数据库；spawn 方式启动，避免在多线程进程中 fork
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+        ) as executor:
+            pending = []
+            for rows in _chunks(homework_id, chunk_size):
+                pending.append((rows, executor.submit(grade_chunk, answer_key, created, rows)))
+                # 最多同时提交两倍进程数的块，控制内存占用
+                if len(pending) >= 2 * workers:
+                    rows, future = pending.pop(0)
+                    record(rows, future.result())
+            for rows, future in pending:
+                record(rows, future.result())
+
+    # 成绩汇总和题目统计按新的分数重新计算
+    rollups.rebuild_score_summaries(homework_id)
+    item_stats.rebuild(homework_id, tally, answer_key, created, last_id)
+    state.update(status='done', finished_at=timezone.now().isoformat())
+    _set_progress(homework_id, **state)
+    leaderboard.drop_homework(homework_id)
+    return state
+
+
+def _run(homework_id):
+    cache = _cache()
+    lock_key = LOCK_KEY.format(homework_id)
+    pending_key = PENDING_KEY.format(homework_id)
+    # 先写入 pending 再取锁，持锁的任务先释放锁再检查 pending：两者交错时，要么本线程取得锁，
+    # 要么持锁的任务结束后看到 pending 重新运行，触发不会丢失。
+    # 共享缓存为 Redis，add 即 SET NX，多个进程同时取锁只有一个成功
+    cache.set(pending_key, True, LOCK_TIMEOUT)
+    try:
+        while cache.get(pending_key) and cache.add(lock_key, True, LOCK_TIMEOUT):
+            try:
+                cache.delete(pending_key)
+                close_old_connections()
+                try:
+                    regrade_homework(homework_id)
+                except Exception as e:
+                    logger.error(f"作业 {homework_id} 重新判分失败: {str(e)}")
+                    state = progress(homework_id) or {}
+                    state.update(status='failed', error=str(e), finished_at=timezone.now().isoformat())
+                    _set_progress(homework_id, **state)
+            finally:
+                cache.delete(lock_key)
+    finally:
+        # 线程结束，关闭本线程的数据库连接
+        connections.close_all()
+
+
+def start(homework_id):
+    """在事务提交后启动后台重新判分"""
+    state = progress(homework_id)
+    if state is None or state.get('status') != 'running':
+        _set_progress(homework_id, status='pending')
+
+    def run():
+        threading.Thread(target=_run, args=(homework_id,), name=f'regrade-{homework_id}', daemon=True).start()
+
+    transaction.on_commit(run)
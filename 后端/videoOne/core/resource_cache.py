@@ -0,0 +1,152 @@
+"""
+分类资源和合辑详情的响应缓存（settings.CACHES['resources']）。
+
+这些数据只在教师编辑内容时变化：Video / Homework / Material / Category / Collection 保存或删除后，
+在事务提交时精确删除受影响的分类资源，并更换受影响合辑的详情缓存代号（旧代号的条目不再被读取，由缓存自行淘汰）；
+同时在事务内更换对应的内容版本戳（见 versions.py）。
+默认配置是进程内缓存，信号只能清除本进程的条目，其他进程依靠缓存的过期时间（TIMEOUT）读到修改。
+"""
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import versions
+from .models import Category, Collection, Homework, Material, Video
+from .serializers import HomeworkSerializer, MaterialSerializer, VideoSerializer
+
+CACHE_ALIAS = 'resources'
+
+CATEGORY_KEY = 'category_resources:{}'
+# 合辑详情中的文件地址带有请求的域名，按 (合辑, 代号, 域名) 缓存
+COLLECTION_KEY = 'collection_detail:{}:{}:{}'
+GENERATION_KEY = 'collection_detail_gen:{}'
+
+# 资源所属的上级对象字段
+PARENT_FIELDS = {
+    Video: 'category_id',
+    Homework: 'category_id',
+    Material: 'category_id',
+    Category: 'collection_id',
+}
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def category_resources(category_id):
+    """
+    分类下的视频、作业和资料，返回 (合辑ID, 资源)；分类不存在时返回 (None, None)。
+    """
+    cache = _cache()
+    key = CATEGORY_KEY.format(category_id)
+    cached = cache.get(key)
+    if cached is None:
+        category = Category.objects.prefetch_related(
+            'videos', 'homeworks', 'homeworks__related_questions', 'materials'
+        ).filter(
+            id=category_id
+        ).first()
+        if category is None:
+            return None, None
+        cached = (category.collection_id, {
+            'videos': VideoSerializer(category.videos.all(), many=True).data,
+            'homeworks': HomeworkSerializer(category.homeworks.all(), many=True).data,
+            'materials': MaterialSerializer(category.materials.all(), many=True).data
+        })
+        cache.set(key, cached)
+    return cached
+
+
+def collection_detail(collection_id, request, build):
+    """读取合辑详情缓存，没有时调用 build() 生成，build 返回 None 表示合辑不存在（不缓存）"""
+    cache = _cache()
+    generation = cache.get(GENERATION_KEY.format(collection_id))
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set(GENERATION_KEY.format(collection_id), generation)
+    key = COLLECTION_KEY.format(collection_id, generation, request.get_host())
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        if data is not None:
+            cache.set(key, data)
+    return data
+
+
+def invalidate(category_ids=(), collection_ids=()):
+    cache = _cache()
+    cache.delete_many([CATEGORY_KEY.format(category_id) for category_id in category_ids])
+    cache.delete_many([GENERATION_KEY.format(collection_id) for collection_id in collection_ids])
+
+
+def _changed(category_ids=(), collection_ids=()):
+    versions.content_changed(category_ids, collection_ids)
+    transaction.on_commit(lambda: invalidate(category_ids, collection_ids))
+
+
+def _affected(sender, instance):
+    """受影响的 (分类ID集合, 合辑ID集合)，包括修改前所属的上级"""
+    parents = {getattr(instance, PARENT_FIELDS[sender]), getattr(instance, '_previous_parent_id', None)} - {None}
+    if sender is Category:
+        return {instance.id}, parents
+    collection_ids = set(Category.objects.filter(id__in=parents).values_list('collection_id', flat=True))
+    return parents, collection_ids
+
+
+@receiver(pre_save, sender=Video)
+@receiver(pre_save, sender=Homework)
+@receiver(pre_save, sender=Material)
+@receiver(pre_save, sender=Category)
+def remember_previous_parent(sender, instance, raw=False, **kwargs):
+    # 记录修改前的所属分类/合辑，移动资源时新旧两处的缓存都要删除
+    if raw or instance.pk is None:
+        return
+    instance._previous_parent_id = sender.objects.filter(pk=instance.pk).values_list(
+        PARENT_FIELDS[sender], flat=True
+    ).first()
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Homework)
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Homework)
+@receiver(post_delete, sender=Material)
+@receiver(post_delete, sender=Category)
+def invalidate_on_resource_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _changed(*_affected(sender, instance))
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_on_collection_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _changed(collection_ids=[instance.id])
+
+
+@receiver(m2m_changed, sender=Homework.related_questions.through)
+def invalidate_on_related_questions_change(sender, instance, action, reverse, pk_set, **kwargs):
+    # 作业数据包含 related_questions，关联变化时同样失效
+    if action == 'pre_clear' and reverse:
+        # 从题目一侧清空时，清空后就查不到原来关联的作业了
+        instance._cleared_homework_ids = list(instance.related_homeworks.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        homework_ids = getattr(instance, '_cleared_homework_ids', []) if action == 'post_clear' else pk_set
+        category_ids = set(
+            Homework.objects.filter(id__in=homework_ids or ()).values_list('category_id', flat=True)
+        )
+    else:
+        category_ids = {instance.category_id}
+    collection_ids = set(Category.objects.filter(id__in=category_ids).values_list('collection_id', flat=True))
+    _changed(category_ids, collection_ids)
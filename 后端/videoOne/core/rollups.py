@@ -0,0 +1,321 @@
+"""
+课程进度汇总（CourseProgress）和成绩汇总（ScoreSummary）的维护。
+
+播放进度批量写入时按增量累加到 (用户, 合辑) 汇总行，只需一条语句；
+其他途径（接口增删改、后台编辑、级联删除）修改 PlaybackStat 时由信号在事务提交后重新汇总受影响的 (用户, 合辑)。
+新增成绩时同样用一条语句更新 (用户, 作业) 的成绩汇总；修改、删除成绩时重新汇总，重新判分后按作业重建。
+"""
+import threading
+from functools import reduce
+from operator import or_
+
+from django.db import connections, router, transaction
+from django.db.models import Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import leaderboard
+from .models import CourseProgress, PlaybackStat, Score, ScoreSummary, Video
+
+# 累加进度总和：不存在时插入，存在时在原值上增加
+ADD_SQL = {
+    'mysql': (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON DUPLICATE KEY UPDATE '
+        '{progress_sum} = {progress_sum} + VALUES({progress_sum}), '
+        '{updated_at} = VALUES({updated_at})'
+    ),
+    'sqlite': (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON CONFLICT ({user}, {collection}) DO UPDATE SET '
+        '{progress_sum} = {progress_sum} + excluded.{progress_sum}, '
+        '{updated_at} = excluded.{updated_at}'
+    ),
+}
+
+# 新增一次成绩：不存在时插入，存在时更新最高分、最近得分（按提交时间）、次数和首末时间。
+# MySQL 按书写顺序赋值，latest_score 必须在 last_submitted_at 之前
+SUBMIT_SQL = {
+    'mysql': (
+        'INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s, 1, %s, %s) '
+        'ON DUPLICATE KEY UPDATE '
+        '{latest} = IF(VALUES({last}) >= {last}, VALUES({latest}), {latest}), '
+        '{best} = GREATEST({best}, VALUES({best})), '
+        '{attempts} = {attempts} + 1, '
+        '{first} = LEAST({first}, VALUES({first})), '
+        '{last} = GREATEST({last}, VALUES({last}))'
+    ),
+    'sqlite': (
+        'INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s, 1, %s, %s) '
+        'ON CONFLICT ({user}, {homework}) DO UPDATE SET '
+        '{latest} = CASE WHEN excluded.{last} >= {last} THEN excluded.{latest} ELSE {latest} END, '
+        '{best} = MAX({best}, excluded.{best}), '
+        '{attempts} = {attempts} + 1, '
+        '{first} = MIN({first}, excluded.{first}), '
+        '{last} = MAX({last}, excluded.{last})'
+    ),
+}
+
+BATCH_SIZE = 500
+
+
+def add_course_progress(deltas, using=None):
+    """
+    把播放进度的增量累加到课程进度汇总。
+    deltas: {(user_id, video_id): 进度增量}，增量为 0 的键也会创建汇总行
+    """
+    if not deltas:
+        return
+
+    video_collections = dict(
+        Video.objects.using(using).filter(id__in={video_id for _, video_id in deltas})
+        .values_list('id', 'category__collection_id')
+    )
+    totals = {}
+    for (user_id, video_id), delta in deltas.items():
+        collection_id = video_collections.get(video_id)
+        if collection_id is None:
+            continue
+        key = (user_id, collection_id)
+        totals[key] = totals.get(key, 0) + delta
+    if not totals:
+        return
+
+    connection = connections[using or router.db_for_write(CourseProgress)]
+    template = ADD_SQL.get(connection.vendor)
+    if template is None:
+        # 其他数据库按受影响的 (用户, 合辑) 重新汇总
+        refresh_course_progress(totals, using)
+        return
+
+    opts = CourseProgress._meta
+    qn = connection.ops.quote_name
+    names = {
+        'table': qn(opts.db_table),
+        'user': qn(opts.get_field('user').column),
+        'collection': qn(opts.get_field('collection').column),
+        'progress_sum': qn(opts.get_field('progress_sum').column),
+        'updated_at': qn(opts.get_field('updated_at').column),
+    }
+    names['columns'] = ', '.join(names[name] for name in ('user', 'collection', 'progress_sum', 'updated_at'))
+
+    transaction.on_commit(lambda: leaderboard.apply_course_deltas(totals), using=connection.alias)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    items = list(totals.items())
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for start in range(0, len(items), BATCH_SIZE):
+            batch = items[start:start + BATCH_SIZE]
+            params = []
+            for (user_id, collection_id), delta in batch:
+                params.extend([user_id, collection_id, delta, now])
+            values = ', '.join(['(%s, %s, %s, %s)'] * len(batch))
+            cursor.execute(template.format(values=values, **names), params)
+
+
+def refresh_course_progress(pairs, using=None):
+    """按 PlaybackStat 重新汇总指定的 (user_id, collection_id)，没有播放记录的删除汇总行"""
+    pairs = set(pairs)
+    if not pairs:
+        return
+
+    condition = reduce(or_, (
+        Q(user_id=user_id, video__category__collection_id=collection_id) for user_id, collection_id in pairs
+    ))
+    sums = {
+        (row['user_id'], row['video__category__collection_id']): row['total']
+        for row in PlaybackStat.objects.using(using).filter(condition)
+        .values('user_id', 'video__category__collection_id')
+        .annotate(total=Sum('progress'))
+    }
+
+    connection = connections[using or router.db_for_write(CourseProgress)]
+    with transaction.atomic(using=connection.alias):
+        if sums:
+            CourseProgress.objects.using(connection.alias).bulk_create(
+                [
+                    CourseProgress(user_id=user_id, collection_id=collection_id, progress_sum=total)
+                    for (user_id, collection_id), total in sums.items()
+                ],
+                update_conflicts=True,
+                # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定冲突字段
+                unique_fields=(
+                    ['user', 'collection'] if connection.features.supports_update_conflicts_with_target else None
+                ),
+                update_fields=['progress_sum', 'updated_at'],
+            )
+        missing = pairs - sums.keys()
+        transaction.on_commit(lambda: leaderboard.set_course_progress(sums, missing), using=connection.alias)
+        if missing:
+            CourseProgress.objects.using(connection.alias).filter(reduce(or_, (
+                Q(user_id=user_id, collection_id=collection_id) for user_id, collection_id in missing
+            ))).delete()
+
+
+def rebuild_course_progress():
+    """全量重建课程进度汇总，返回汇总行数"""
+    rows = [
+        CourseProgress(
+            user_id=row['user_id'],
+            collection_id=row['video__category__collection_id'],
+            progress_sum=row['total']
+        )
+        for row in PlaybackStat.objects.values('user_id', 'video__category__collection_id')
+        .annotate(total=Sum('progress')).order_by()
+    ]
+    with transaction.atomic():
+        CourseProgress.objects.all().delete()
+        CourseProgress.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+# 当前线程中等待汇总的 (用户, 合辑) 和视频所属合辑的缓存
+_changed = threading.local()
+
+
+def _changed_progress():
+    if not hasattr(_changed, 'pairs'):
+        _changed.pairs, _changed.collections = set(), {}
+    return _changed
+
+
+def _refresh_changed_progress():
+    changed = _changed_progress()
+    pairs, changed.pairs, changed.collections = changed.pairs, set(), {}
+    refresh_course_progress(pairs)
+
+
+@receiver(post_save, sender=PlaybackStat)
+@receiver(post_delete, sender=PlaybackStat)
+def refresh_on_playback_change(sender, instance, raw=False, **kwargs):
+    """
+    批量写入之外的途径修改播放记录时，事务提交后重新汇总该用户在该合辑的进度。
+    同一事务内的多次修改（如删除视频时级联删除播放记录）合并为一次汇总。
+    """
+    if raw:
+        return
+    changed = _changed_progress()
+    if instance.video_id not in changed.collections:
+        changed.collections[instance.video_id] = Video.objects.filter(id=instance.video_id).values_list(
+            'category__collection_id', flat=True
+        ).first()
+    collection_id = changed.collections[instance.video_id]
+    if collection_id is None:
+        return
+    changed.pairs.add((instance.user_id, collection_id))
+    # 每次修改都注册回调，第一个回调汇总全部，其余为空操作；事务回滚时已记录的键在下次提交时汇总
+    transaction.on_commit(_refresh_changed_progress)
+
+
+def add_score_summary(score, using=None):
+    """新增成绩后更新成绩汇总"""
+    connection = connections[using or router.db_for_write(ScoreSummary)]
+    template = SUBMIT_SQL.get(connection.vendor)
+    if template is None:
+        # 其他数据库重新汇总
+        refresh_score_summaries([(score.user_id, score.homework_id)], using)
+        return
+
+    opts = ScoreSummary._meta
+    qn = connection.ops.quote_name
+    names = {
+        'table': qn(opts.db_table),
+        'user': qn(opts.get_field('user').column),
+        'homework': qn(opts.get_field('homework').column),
+        'best': qn(opts.get_field('best_score').column),
+        'latest': qn(opts.get_field('latest_score').column),
+        'attempts': qn(opts.get_field('attempts').column),
+        'first': qn(opts.get_field('first_submitted_at').column),
+        'last': qn(opts.get_field('last_submitted_at').column),
+    }
+    names['columns'] = ', '.join(
+        names[name] for name in ('user', 'homework', 'best', 'latest', 'attempts', 'first', 'last')
+    )
+    submitted_at = connection.ops.adapt_datetimefield_value(score.submitted_at)
+    with connection.cursor() as cursor:
+        cursor.execute(template.format(**names), [
+            score.user_id, score.homework_id, score.score, score.score, submitted_at, submitted_at
+        ])
+
+
+def _summarize(rows):
+    """rows 为按提交时间排序的 (user_id, homework_id, 分数, 提交时间)，返回 {(user_id, homework_id): ScoreSummary}"""
+    summaries = {}
+    for user_id, homework_id, score, submitted_at in rows:
+        summary = summaries.get((user_id, homework_id))
+        if summary is None:
+            summaries[(user_id, homework_id)] = ScoreSummary(
+                user_id=user_id, homework_id=homework_id, best_score=score, latest_score=score, attempts=1,
+                first_submitted_at=submitted_at, last_submitted_at=submitted_at
+            )
+            continue
+        summary.best_score = max(summary.best_score, score)
+        summary.latest_score = score
+        summary.attempts += 1
+        summary.last_submitted_at = submitted_at
+    return summaries
+
+
+def _score_rows(queryset):
+    return queryset.order_by('submitted_at', 'id').values_list('user_id', 'homework_id', 'score', 'submitted_at')
+
+
+def refresh_score_summaries(pairs, using=None):
+    """按 Score 重新汇总指定的 (user_id, homework_id)，没有成绩的删除汇总行"""
+    pairs = set(pairs)
+    if not pairs:
+        return
+
+    condition = reduce(or_, (Q(user_id=user_id, homework_id=homework_id) for user_id, homework_id in pairs))
+    connection = connections[using or router.db_for_write(ScoreSummary)]
+    with transaction.atomic(using=connection.alias):
+        # 先锁定汇总行再读取成绩，见 rebuild_score_summaries
+        list(ScoreSummary.objects.using(connection.alias).filter(condition).select_for_update().values_list('id'))
+        summaries = _summarize(_score_rows(Score.objects.using(connection.alias).filter(condition)))
+        if summaries:
+            ScoreSummary.objects.using(connection.alias).bulk_create(
+                summaries.values(),
+                update_conflicts=True,
+                # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定冲突字段
+                unique_fields=(
+                    ['user', 'homework'] if connection.features.supports_update_conflicts_with_target else None
+                ),
+                update_fields=['best_score', 'latest_score', 'attempts', 'first_submitted_at', 'last_submitted_at'],
+            )
+        missing = pairs - summaries.keys()
+        if missing:
+            ScoreSummary.objects.using(connection.alias).filter(reduce(or_, (
+                Q(user_id=user_id, homework_id=homework_id) for user_id, homework_id in missing
+            ))).delete()
+
+
+def rebuild_score_summaries(homework_id=None):
+    """重建成绩汇总（homework_id 为 None 时重建全部），返回汇总行数"""
+    scores = Score.objects.all()
+    summaries = ScoreSummary.objects.all()
+    if homework_id is not None:
+        scores = scores.filter(homework_id=homework_id)
+        summaries = summaries.filter(homework_id=homework_id)
+    with transaction.atomic():
+        # 先锁定汇总行再读取成绩：并发提交对汇总行的累加（add_score_summary）会等待本事务提交后
+        # 在重建结果上进行，已提交的成绩都包含在下面的读取中，不会丢失或重复计入
+        list(summaries.select_for_update().values_list('id'))
+        rows = _summarize(_score_rows(scores).iterator())
+        summaries.delete()
+        ScoreSummary.objects.bulk_create(rows.values(), batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+@receiver(post_save, sender=Score)
+def update_summary_on_score_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        add_score_summary(instance)
+    else:
+        refresh_score_summaries([(instance.user_id, instance.homework_id)])
+
+
+@receiver(post_delete, sender=Score)
+def refresh_summary_on_score_deleted(sender, instance, **kwargs):
+    refresh_score_summaries([(instance.user_id, instance.homework_id)])
@@ -0,0 +1,16 @@
+from .consumers import PlaybackProgressConsumer
+
+# WebSocket 路由：路径 -> 连接处理类（每条连接创建一个实例）
+websocket_routes = {
+    '/ws/playback/': PlaybackProgressConsumer,
+}
+
+
+async def websocket_application(scope, receive, send):
+    consumer_class = websocket_routes.get(scope['path'])
+    if consumer_class is None:
+        # 未知路径直接拒绝握手
+        await receive()
+        await send({'type': 'websocket.close'})
+        return
+    await consumer_class()(scope, receive, send)
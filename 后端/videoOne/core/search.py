@@ -0,0 +1,275 @@
+"""
+站内全文检索：数据库中的倒排索引 + BM25 排序。
+
+索引范围为合辑、视频、作业、资料的标题和描述，以及题目内容和选项。
+中文按相邻两字切分（二元组），英文和数字按单词切分；标题中的词按两倍词频计入。
+模型保存/删除时通过信号增量更新索引，rebuild_search_index 命令全量重建。
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Avg, Case, Count, ExpressionWrapper, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Collection, Homework, Material, Question, SearchDocument, SearchPosting, Video
+
+MAX_TERM_LENGTH = 32
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+# 单字查询展开的前缀词数量上限
+MAX_PREFIX_TERMS = 50
+
+# 查询长度（字符）和查询词数量（含单字展开的前缀词）上限，超出部分忽略
+MAX_QUERY_LENGTH = 100
+MAX_QUERY_TERMS = 50
+
+BATCH_SIZE = 1000
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_CJK_RE = re.compile(f'[{_CJK}]')
+_RUN_RE = re.compile(f'[{_CJK}]+|[a-z0-9]+')
+
+
+def _runs(text):
+    return _RUN_RE.findall(unicodedata.normalize('NFKC', text or '').lower())
+
+
+def tokenize(text):
+    """切词：中文连续片段切成相邻二元组（单字片段保留单字），英文数字按单词"""
+    tokens = []
+    for run in _runs(text):
+        if _CJK_RE.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:MAX_TERM_LENGTH])
+    return tokens
+
+
+def _question_options(question):
+    return ' '.join(
+        str(option.get('text', '')) for option in question.options or [] if isinstance(option, dict)
+    )
+
+
+# 类型 -> (模型, 取 (文本, 权重) 列表的函数, 搜索结果中返回的字段, 作为标题的字段)
+SOURCES = {
+    'collection': (
+        Collection,
+        lambda obj: [(obj.name, 2), (obj.description, 1)],
+        ('id', 'name', 'description', 'thumbnail'),
+        'name',
+    ),
+    'video': (
+        Video,
+        lambda obj: [(obj.title, 2), (obj.description, 1)],
+        ('id', 'title', 'description', 'thumbnail', 'category_id'),
+        'title',
+    ),
+    'homework': (
+        Homework,
+        lambda obj: [(obj.title, 2), (obj.description, 1)],
+        ('id', 'title', 'description', 'category_id'),
+        'title',
+    ),
+    'material': (
+        Material,
+        lambda obj: [(obj.title, 2), (obj.description, 1)],
+        ('id', 'title', 'description', 'url', 'category_id'),
+        'title',
+    ),
+    'question': (
+        Question,
+        lambda obj: [(obj.content, 2), (_question_options(obj), 1)],
+        ('id', 'content', 'homework_id'),
+        'content',
+    ),
+}
+
+_KINDS = {model: kind for kind, (model, *_) in SOURCES.items()}
+
+
+def _term_counts(kind, obj):
+    counts = Counter()
+    for text, weight in SOURCES[kind][1](obj):
+        for token in tokenize(text):
+            counts[token] += weight
+    return counts
+
+
+def index_object(kind, obj):
+    """重建单个对象的索引"""
+    counts = _term_counts(kind, obj)
+    with transaction.atomic():
+        document, _ = SearchDocument.objects.update_or_create(
+            kind=kind, object_id=obj.pk, defaults={'length': sum(counts.values())}
+        )
+        document.postings.all().delete()
+        SearchPosting.objects.bulk_create(
+            [SearchPosting(term=term, document=document, frequency=count) for term, count in counts.items()],
+            batch_size=BATCH_SIZE,
+        )
+
+
+def remove_object(kind, object_id):
+    SearchDocument.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def _bulk_index(kind, objects):
+    """批量写入对象的文档和索引词，调用前需已删除这些对象的旧文档，返回文档数量"""
+    counts = [_term_counts(kind, obj) for obj in objects]
+    documents = SearchDocument.objects.bulk_create(
+        [
+            SearchDocument(kind=kind, object_id=obj.pk, length=sum(count.values()))
+            for obj, count in zip(objects, counts)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    if documents and documents[0].pk is None:
+        # 不返回自增主键的数据库重新读取
+        ids = dict(SearchDocument.objects.filter(
+            kind=kind, object_id__in=[obj.pk for obj in objects]
+        ).values_list('object_id', 'id'))
+        for document in documents:
+            document.pk = ids[document.object_id]
+    SearchPosting.objects.bulk_create(
+        (
+            SearchPosting(term=term, document=document, frequency=frequency)
+            for document, count in zip(documents, counts)
+            for term, frequency in count.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    return len(documents)
+
+
+def index_objects(kind, objects):
+    """批量重建多个对象的索引（用于不发送信号的 bulk_create / bulk_update 之后）"""
+    objects = list(objects)
+    if not objects:
+        return
+    with transaction.atomic():
+        SearchDocument.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objects]).delete()
+        _bulk_index(kind, objects)
+
+
+def rebuild_index():
+    """全量重建索引，返回文档数量"""
+    total = 0
+    with transaction.atomic():
+        SearchPosting.objects.all().delete()
+        SearchDocument.objects.all().delete()
+        for kind, (model, *_) in SOURCES.items():
+            total += _bulk_index(kind, list(model.objects.order_by('pk')))
+    return total
+
+
+def _query_terms(query):
+    """查询切词；单个汉字没有对应的二元组，展开为以该字开头的索引词。最多取 MAX_QUERY_TERMS 个"""
+    terms = {}
+    for run in _runs(query[:MAX_QUERY_LENGTH]):
+        if _CJK_RE.match(run) and len(run) == 1:
+            terms[run] = None
+            room = MAX_QUERY_TERMS - len(terms)
+            if room > 0:
+                terms.update(dict.fromkeys(
+                    SearchPosting.objects.filter(term__startswith=run).values_list('term', flat=True)
+                    .order_by().distinct()[:min(room, MAX_PREFIX_TERMS)]
+                ))
+        else:
+            terms.update(dict.fromkeys(tokenize(run)))
+        if len(terms) >= MAX_QUERY_TERMS:
+            break
+    return list(terms)[:MAX_QUERY_TERMS]
+
+
+def search(query, kind=None, offset=0, limit=20):
+    """
+    BM25 排序的搜索，kind 为 None 时搜索全部类型。
+    返回 (命中总数, [{"type", "id", "title", "score", ...}])
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return 0, []
+
+    documents = SearchDocument.objects.all()
+    postings = SearchPosting.objects.filter(term__in=terms)
+    if kind is not None:
+        documents = documents.filter(kind=kind)
+        postings = postings.filter(document__kind=kind)
+    stats = documents.aggregate(count=Count('id'), average=Avg('length'))
+    total_documents, average_length = stats['count'], stats['average'] or 1
+    document_frequency = dict(postings.values('term').annotate(count=Count('id')).values_list('term', 'count'))
+
+    # 在数据库中按 BM25 汇总并排序，只取当前页，不把全部命中的索引词读入内存
+    idf = Case(
+        *(
+            When(term=term, then=Value(math.log(1 + (total_documents - df + 0.5) / (df + 0.5))))
+            for term, df in document_frequency.items()
+        ),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    frequency = Cast('frequency', FloatField())
+    length = Cast('document__length', FloatField())
+    bm25 = ExpressionWrapper(
+        idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B) + K1 * B / average_length * length),
+        output_field=FloatField(),
+    )
+    total = postings.values('document_id').distinct().count()
+    page = []
+    locations = {}
+    for document_id, document_kind, object_id, score in postings.values(
+        'document_id', 'document__kind', 'document__object_id'
+    ).annotate(score=Sum(bm25)).order_by('-score', 'document_id').values_list(
+        'document_id', 'document__kind', 'document__object_id', 'score'
+    )[offset:offset + limit]:
+        page.append((document_id, score))
+        locations[document_id] = (document_kind, object_id)
+
+    # 只读取当前页对象的字段，每种类型一次查询
+    by_kind = {}
+    for document_id, _ in page:
+        document_kind, object_id = locations[document_id]
+        by_kind.setdefault(document_kind, []).append(object_id)
+    rows = {}
+    for document_kind, object_ids in by_kind.items():
+        model, _, fields, _ = SOURCES[document_kind]
+        for row in model.objects.filter(pk__in=object_ids).values(*fields):
+            rows[(document_kind, row['id'])] = row
+
+    results = []
+    for document_id, score in page:
+        row = rows.get(locations[document_id])
+        if row is None:
+            continue
+        document_kind = locations[document_id][0]
+        results.append({
+            'type': document_kind,
+            'title': row[SOURCES[document_kind][3]],
+            'score': round(score, 4),
+            **row,
+        })
+    return total, results
+
+
+@receiver(post_save)
+def index_on_save(sender, instance, raw=False, **kwargs):
+    kind = _KINDS.get(sender)
+    if kind is None or raw:
+        return
+    index_object(kind, instance)
+
+
+@receiver(post_delete)
+def remove_on_delete(sender, instance, **kwargs):
+    kind = _KINDS.get(sender)
+    if kind is not None:
+        remove_object(kind, instance.pk)
@@ -1,8 +1,105 @@
 from rest_framework import serializers
-from .models import User, Collection, Category, Video, Homework, Question, Material, PlaybackStat, Score
+from .favorites import get_favorite_ids
+from .models import (
+    User, Collection, Category, Video, Homework, Question, Material, PlaybackStat, Score, ScoreSummary
+)
 from django.conf import settings
 
 
+def _split_param(value):
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+def _with_related_questions(lookups):
+    # HomeworkSerializer 输出 related_questions，预取作业时一并预取，避免每个作业一次查询
+    return [
+        *lookups,
+        *(f'{lookup}__related_questions' for lookup in lookups if lookup.split('__')[-1] == 'homeworks'),
+    ]
+
+
+class DynamicFieldsMixin:
+    """
+    按需返回字段：?fields=id,name 只返回列出的字段，?expand=categories.videos 展开嵌套关系（点号表示下一层）。
+    ?compact=1 等同于 fields=Meta.compact_fields。
+    都不传时返回完整数据；传入任一参数后，Meta.expandable_fields 中未展开的嵌套关系既不查询也不序列化。
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._only_fields = kwargs.pop('only_fields', None)
+        self._expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def field_options(cls, request):
+        """从请求参数解析 (fields, expand)，未传时为 None"""
+        if request is None:
+            return None, None
+        params = request.query_params
+        fields = _split_param(params['fields']) if 'fields' in params else None
+        if fields is None and params.get('compact') in ('1', 'true') and hasattr(cls.Meta, 'compact_fields'):
+            fields = set(cls.Meta.compact_fields)
+        expand = _split_param(params['expand']) if 'expand' in params else None
+        if fields is not None and expand is None:
+            expand = set()
+        return fields, expand
+
+    @classmethod
+    def expanded_lookups(cls, fields, expand):
+        """需要预取的关联查询路径，只包含实际展开的关系；fields 和 expand 都为 None 时返回 None（全部展开）"""
+        if fields is None and expand is None:
+            return None
+        paths = set(expand or ()) | {name for name in fields or () if name in cls._expandable()}
+        lookups = set()
+        for path in paths:
+            serializer_class, parts = cls, []
+            for name in path.split('.'):
+                if name not in serializer_class._expandable():
+                    break
+                parts.append(name)
+                nested = serializer_class._declared_fields[name]
+                serializer_class = getattr(nested, 'child', nested).__class__
+            if parts:
+                lookups.add('__'.join(parts))
+        return sorted(lookups)
+
+    @classmethod
+    def _expandable(cls):
+        return getattr(cls.Meta, 'expandable_fields', ())
+
+    def _is_root(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only_fields, expand = self._only_fields, self._expand
+        if only_fields is None and expand is None and self._is_root():
+            only_fields, expand = self.field_options(self.context.get('request'))
+        if only_fields is None and expand is None:
+            return fields
+
+        expand = expand or set()
+        expanded = {path.split('.', 1)[0] for path in expand}
+        if only_fields is not None:
+            expanded |= only_fields & set(self._expandable())
+        for name in list(fields):
+            if name in self._expandable():
+                keep = name in expanded
+            else:
+                keep = only_fields is None or name in only_fields
+            if not keep:
+                fields.pop(name)
+                continue
+            if name in self._expandable():
+                nested = getattr(fields[name], 'child', fields[name])
+                if isinstance(nested, DynamicFieldsMixin):
+                    nested._expand = {
+                        path.split('.', 1)[1] for path in expand if path.startswith(name + '.')
+                    }
+        return fields
+
+
 # 用户序列化器
 class UserSerializer(serializers.ModelSerializer):
     favorite_collections = serializers.PrimaryKeyRelatedField(many=True, queryset=Collection.objects.all(),
@@ -15,7 +112,7 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 # 视频序列化器
-class VideoSerializer(serializers.ModelSerializer):
+class VideoSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Video
         fields = '__all__'
@@ -53,7 +150,7 @@ class MaterialSerializer(serializers.ModelSerializer):
 
 
 # 分类序列化器
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     videos = VideoSerializer(many=True, read_only=True, required=False)
     homeworks = HomeworkSerializer(many=True, read_only=True, required=False)
     materials = MaterialSerializer(many=True, read_only=True, required=False)
@@ -61,10 +158,18 @@ class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'progress', 'collection', 'videos', 'homeworks', 'materials']
+        expandable_fields = ('videos', 'homeworks', 'materials')
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, lookups=None):
+        """预取嵌套资源，lookups 为 None 时预取全部"""
+        if lookups is None:
+            lookups = cls.Meta.expandable_fields
+        return queryset.prefetch_related(*_with_related_questions(lookups))
 
 
 # 合集序列化器
-class CollectionSerializer(serializers.ModelSerializer):
+class CollectionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     categories = CategorySerializer(many=True, read_only=True)
     is_favorited = serializers.SerializerMethodField()
 
@@ -74,17 +179,31 @@ class CollectionSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'thumbnail': {'required': False},
         }
+        expandable_fields = ('categories',)
+        # 首页列表（?compact=1）只需要的字段
+        compact_fields = ('id', 'name', 'description', 'thumbnail', 'creator', 'created_at', 'is_favorited')
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, lookups=None):
+        """预取嵌套的分类和资源，列表的查询次数与合辑数量无关；lookups 为 None 时预取全部"""
+        if lookups is None:
+            lookups = ('categories__videos', 'categories__homeworks', 'categories__materials')
+        return queryset.prefetch_related(*_with_related_questions(lookups))
 
     def get_is_favorited(self, obj):
+        # 当前用户收藏的合辑ID集合来自缓存，列表中的各合辑共用
         request = self.context.get('request')
-        return request and request.user in obj.favorited_by.all()
+        user = getattr(request, 'user', None)
+        return user is not None and obj.id in get_favorite_ids(user)
 
 
 # 播放记录序列化器
 class PlaybackStatSerializer(serializers.ModelSerializer):
+    completion = serializers.FloatField(read_only=True)
+
     class Meta:
         model = PlaybackStat
-        fields = '__all__'
+        exclude = ('watched',)
         read_only_fields = ('user', 'last_played_at')
 
 
@@ -92,10 +211,21 @@ class PlaybackStatSerializer(serializers.ModelSerializer):
 class ScoreSerializer(serializers.ModelSerializer):
     class Meta:
         model = Score
-        fields = '__all__'
+        # 作答只用于重新判分，不在成绩列表中返回
+        exclude = ('answers',)
         read_only_fields = ('submitted_at',)
 
 
+class ScoreSummarySerializer(serializers.ModelSerializer):
+    # 与 ScoreSerializer 相同的字段名：score 为最高分，submitted_at 为最近提交时间
+    score = serializers.IntegerField(source='best_score', read_only=True)
+    submitted_at = serializers.DateTimeField(source='last_submitted_at', read_only=True)
+
+    class Meta:
+        model = ScoreSummary
+        fields = '__all__'
+
+
 class FavoriteCourseStatsSerializer(serializers.Serializer):
     playback_stats = PlaybackStatSerializer(many=True)
     videos = VideoSerializer(many=True)
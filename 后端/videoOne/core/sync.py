@@ -0,0 +1,132 @@
+"""
+目录增量同步：返回某个游标之后新增/修改/删除的合辑、分类、视频、作业和资料。
+
+新增和修改按各模型的 (updated_at, id) 查找，删除按 Tombstone 的 (deleted_at, id) 查找。
+游标记录每一类对象和每一类删除各自读到的位置，同一时间戳的记录超过单次数量时也能逐批推进。
+读完的类别下一次往回留出 SYNC_OVERLAP，避免漏掉提交较晚的事务，因此客户端需要幂等地应用变更。
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Category, Collection, Homework, Material, Tombstone, Video
+from .serializers import (
+    CategorySerializer, CollectionSerializer, DynamicFieldsMixin, HomeworkSerializer, MaterialSerializer,
+    VideoSerializer
+)
+
+# (返回的键, 模型, 序列化器)
+SOURCES = [
+    ('collections', Collection, CollectionSerializer),
+    ('categories', Category, CategorySerializer),
+    ('videos', Video, VideoSerializer),
+    ('homeworks', Homework, HomeworkSerializer),
+    ('materials', Material, MaterialSerializer),
+]
+
+# 下一次游标往回留出的时间，覆盖写入时间早于提交时间的事务
+SYNC_OVERLAP = timedelta(seconds=5)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# 游标中的位置数量：每类对象的修改和删除各一个
+_POSITIONS = 2 * len(SOURCES)
+
+
+class CursorExpired(Exception):
+    """游标早于删除记录的保留期限，客户端需要重新全量同步"""
+
+
+def _micros(moment):
+    delta = moment - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def encode_cursor(positions):
+    """positions 为 [(时间, ID)]，依次是各类对象的修改位置和删除位置"""
+    return ','.join(f'{_micros(moment)}:{object_id}' for moment, object_id in positions)
+
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时抛出 ValueError"""
+    parts = cursor.split(',')
+    if len(parts) != _POSITIONS:
+        raise ValueError(cursor)
+    positions = []
+    for part in parts:
+        micros, object_id = part.split(':')
+        positions.append((_EPOCH + timedelta(microseconds=int(micros)), int(object_id)))
+    return positions
+
+
+def _config():
+    return {'MAX_CHANGES': 1000, 'TOMBSTONE_DAYS': 30, **getattr(settings, 'CATALOG_SYNC', {})}
+
+
+def _page(queryset, field, position, until, limit):
+    """
+    按 (field, id) 读取 position 之后、until 之前的一批记录。
+    返回 (记录, 下一次的位置, 是否还有更多)
+    """
+    queryset = queryset.filter(**{f'{field}__lte': until})
+    if position is not None:
+        moment, object_id = position
+        queryset = queryset.filter(Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'id__gt': object_id}))
+    rows = list(queryset.order_by(field, 'id')[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, (getattr(last, field), last.id), True
+    # 已读完，下一次从 until 往回留出重叠时间开始
+    next_position = (until - SYNC_OVERLAP, 0)
+    if position is not None:
+        next_position = max(next_position, position)
+    return rows, next_position, False
+
+
+def catalog_changes(since, context):
+    """
+    since 为 decode_cursor 的结果，为 None 时返回全部内容（不含删除）。
+    返回 {"cursor", "has_more", "collections", ..., "deleted": {"collections": [id], ...}}
+    """
+    config = _config()
+    limit = config['MAX_CHANGES']
+    if since is not None and min(moment for moment, _ in since) < timezone.now() - timedelta(
+        days=config['TOMBSTONE_DAYS']
+    ):
+        raise CursorExpired
+
+    until = timezone.now()
+    result = {'deleted': {}, 'has_more': False}
+    changed_positions, deleted_positions = [], []
+    for index, (key, model, serializer_class) in enumerate(SOURCES):
+        rows, position, more = _page(
+            model.objects.all(), 'updated_at', since[index] if since else None, until, limit
+        )
+        result['has_more'] |= more
+        changed_positions.append(position)
+        # 嵌套关系由各自的条目单独同步，不展开
+        options = {'expand': set()} if issubclass(serializer_class, DynamicFieldsMixin) else {}
+        result[key] = serializer_class(rows, many=True, context=context, **options).data
+
+        tombstones = Tombstone.objects.filter(model=model._meta.model_name)
+        if since is None:
+            # 全量同步不返回删除，删除位置从当前时间开始
+            rows, position, more = [], (until - SYNC_OVERLAP, 0), False
+        else:
+            rows, position, more = _page(tombstones, 'deleted_at', since[len(SOURCES) + index], until, limit)
+        result['has_more'] |= more
+        deleted_positions.append(position)
+        result['deleted'][key] = [tombstone.object_id for tombstone in rows]
+
+    result['cursor'] = encode_cursor(changed_positions + deleted_positions)
+    return result
+
+
+def prune_tombstones():
+    """删除超过保留期限的删除记录，返回删除的数量"""
+    cutoff = timezone.now() - timedelta(days=_config()['TOMBSTONE_DAYS'])
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
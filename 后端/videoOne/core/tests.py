@@ -1,3 +1,805 @@
+import json
+import random
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import (
+    authentication, autocomplete, grading, heatmap, item_stats, leaderboard, playback, regrade, rollups, search, sync,
+    watchmap,
+)
+from .models import (
+    CatalogVersion, Category, Collection, CourseProgress, Homework, OptionStat, PlaybackStat, Question, QuestionStat,
+    Score, ScoreSummary, SegmentStat, User, Video,
+)
+from .routing import websocket_application
+
+
+class PlaybackProgressConsumerTests(TestCase):
+    """播放进度 WebSocket 通道：直接按 ASGI 协议收发消息"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='viewer', password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.video = Video.objects.create(title='视频', category=category, url='videos/test.mp4')
+
+    def communicator(self, query_string=b''):
+        return ApplicationCommunicator(websocket_application, {
+            'type': 'websocket',
+            'path': '/ws/playback/',
+            'query_string': query_string,
+        })
+
+    async def connect(self, query_string):
+        communicator = self.communicator(query_string)
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator, await communicator.receive_output(timeout=5)
+
+    async def send_tick(self, communicator, text):
+        await communicator.send_input({'type': 'websocket.receive', 'text': text})
+
+    async def disconnect(self, communicator):
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+
+    async def test_connect_without_token(self):
+        communicator, message = await self.connect(b'')
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 4001})
+        await communicator.wait(timeout=5)
+
+    async def test_connect_with_invalid_token(self):
+        communicator, message = await self.connect(b'token=invalid')
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 4001})
+        await communicator.wait(timeout=5)
+
+    async def test_connect_with_token(self):
+        communicator, message = await self.connect(f'token={self.token.key}'.encode())
+        self.assertEqual(message, {'type': 'websocket.accept'})
+        await self.disconnect(communicator)
+
+    async def test_tick_is_written_on_disconnect(self):
+        communicator, _ = await self.connect(f'token={self.token.key}'.encode())
+        await self.send_tick(communicator, json.dumps({'videoId': self.video.id, 'progress': 20, 'duration': 30}))
+        await self.send_tick(communicator, json.dumps({'videoId': self.video.id, 'progress': 35.2, 'duration': 42}))
+        await self.disconnect(communicator)
+
+        stat = await PlaybackStat.objects.aget(user=self.user, video=self.video)
+        self.assertEqual((stat.progress, stat.duration), (35, 42))
+
+    async def test_bad_ticks(self):
+        communicator, _ = await self.connect(f'token={self.token.key}'.encode())
+        for text, error in [
+            ('not json', '消息格式错误'),
+            (json.dumps({'videoId': self.video.id}), '消息格式错误'),
+            (json.dumps({'videoId': 'x', 'progress': 1, 'duration': 1}), '消息格式错误'),
+            # 1e999 解析为 inf
+            (f'{{"videoId": {self.video.id}, "progress": 1e999, "duration": 1}}', '消息格式错误'),
+            (json.dumps({'videoId': self.video.id + 1000, 'progress': 1, 'duration': 1}), '视频不存在'),
+        ]:
+            await self.send_tick(communicator, text)
+            message = await communicator.receive_output(timeout=5)
+            self.assertEqual(message['type'], 'websocket.send')
+            self.assertEqual(json.loads(message['text']), {'error': error})
+
+        # 错误消息不会断开连接，之后的正常心跳照常写入
+        await self.send_tick(communicator, json.dumps({'videoId': self.video.id, 'progress': 5, 'duration': 6}))
+        await self.disconnect(communicator)
+        self.assertTrue(await PlaybackStat.objects.filter(user=self.user, video=self.video).aexists())
+
+
+class PlaybackBufferTests(TestCase):
+    """心跳写缓冲：按 (用户, 视频) 合并，达到阈值时批量写入，失败时放回缓冲"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='viewer', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.videos = [
+            Video.objects.create(title=f'视频{i}', category=category, url='videos/test.mp4') for i in range(2)
+        ]
+
+    def setUp(self):
+        # 不启动后台刷新线程，由测试控制写入时机
+        patcher = mock.patch.object(playback.PlaybackBuffer, '_ensure_timer')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = playback.PlaybackBuffer(flush_interval=3600, max_keys=2)
+
+    def test_ticks_are_coalesced_until_the_key_threshold(self):
+        first, second = self.videos
+        self.buffer.add(self.user.id, first.id, 30, 30)
+        self.buffer.add(self.user.id, first.id, 20, 20)
+        self.assertEqual(self.buffer.pending_count(), 1)
+        self.assertFalse(PlaybackStat.objects.exists())
+
+        self.buffer.add(self.user.id, second.id, 5, 5)
+        self.assertEqual(self.buffer.pending_count(), 0)
+        stat = PlaybackStat.objects.get(user=self.user, video=first)
+        self.assertEqual((stat.progress, stat.duration), (30, 20))
+        self.assertEqual(watchmap.popcount(stat.watched), 2)
+
+    def test_failed_flush_is_requeued(self):
+        self.buffer.add(self.user.id, self.videos[0].id, 30, 30)
+        with mock.patch.object(playback, 'upsert_progress_many', side_effect=RuntimeError):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.add(self.user.id, self.videos[0].id, 10, 10)
+        self.assertEqual(self.buffer.flush(), 1)
+        stat = PlaybackStat.objects.get(user=self.user, video=self.videos[0])
+        self.assertEqual(stat.progress, 30)
+        self.assertEqual(watchmap.popcount(stat.watched), 2)
+
+
+class TokenCacheTests(TestCase):
+    """Token 认证缓存：命中时不查询数据库，撤销标记让其他进程的缓存条目作废"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='viewer', password='password')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        authentication.get_token_cache().clear()
+        caches['shared'].delete(authentication.REVOKED_KEY.format(self.user.pk))
+
+    def test_cache_hit_does_not_query(self):
+        authentication.resolve_token(self.token.key)
+        with self.assertNumQueries(0):
+            user, token = authentication.resolve_token(self.token.key)
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.token.key))
+
+    def test_deactivated_user_is_revoked(self):
+        authentication.resolve_token(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        user, _ = authentication.resolve_token(self.token.key)
+        self.assertFalse(user.is_active)
+
+    def test_deleted_token_is_revoked(self):
+        authentication.resolve_token(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.get(key=self.token.key).delete()
+        self.assertIsNone(authentication.resolve_token(self.token.key))
+
+    def test_marker_from_other_process(self):
+        authentication.resolve_token(self.token.key)
+        # 其他进程撤销：只写入共享缓存中的标记，本进程的缓存条目仍在
+        caches['shared'].set(authentication.REVOKED_KEY.format(self.user.pk), time.time() + 1, 300)
+        with self.assertNumQueries(1):
+            authentication.resolve_token(self.token.key)
+
+
+class PlaybackUpsertTests(TestCase):
+    """播放进度写入与课程进度汇总"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='viewer', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        cls.collection = collection
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.video = Video.objects.create(title='视频', category=category, url='videos/test.mp4')
+
+    def progress_sum(self):
+        return CourseProgress.objects.get(user=self.user, collection=self.collection).progress_sum
+
+    def test_first_insert_raced_by_another_transaction_is_counted_once(self):
+        playback.upsert_progress(self.user.id, self.video.id, 30, 10)
+        self.assertEqual(self.progress_sum(), 30)
+
+        # 模拟并发的首次写入：锁定读取时记录还不存在，插入时已被其他事务插入
+        lock_stored = playback._lock_stored
+        calls = []
+
+        def lock_stored_before_insert(merged, using):
+            calls.append(merged)
+            return {} if len(calls) == 1 else lock_stored(merged, using)
+
+        with mock.patch.object(playback, '_lock_stored', lock_stored_before_insert):
+            playback.upsert_progress(self.user.id, self.video.id, 50, 20)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.progress_sum(), 50)
+        stat = PlaybackStat.objects.get(user=self.user, video=self.video)
+        self.assertEqual((stat.progress, stat.duration), (50, 20))
+
+    def check_max_semantics(self):
+        start = timezone.now()
+        playback.upsert_progress_many([(self.user.id, self.video.id, 30, 10, start)])
+        # 进度只增不减，续播位置跟随最新的播放
+        playback.upsert_progress_many([(self.user.id, self.video.id, 20, 15, start + timedelta(seconds=10))])
+        # 迟到的离线记录不覆盖更新的续播位置
+        playback.upsert_progress_many([(self.user.id, self.video.id, 25, 5, start - timedelta(seconds=10))])
+        stat = PlaybackStat.objects.get(user=self.user, video=self.video)
+        self.assertEqual((stat.progress, stat.duration, stat.last_played_at), (30, 15, start + timedelta(seconds=10)))
+
+        # 同一批内的多条记录先合并
+        later = start + timedelta(seconds=20)
+        playback.upsert_progress_many([
+            (self.user.id, self.video.id, 40, 1, later),
+            (self.user.id, self.video.id, 35, 2, later + timedelta(seconds=1)),
+        ])
+        stat.refresh_from_db()
+        self.assertEqual((stat.progress, stat.duration), (40, 2))
+        # 每条记录的续播位置（10、15、5、1、2 秒）所在分段都计为已观看
+        self.assertEqual(watchmap.popcount(stat.watched), 4)
+        self.assertEqual(self.progress_sum(), 40)
+
+    def test_upsert_keeps_max_progress(self):
+        self.check_max_semantics()
+
+    def test_fallback_keeps_max_progress(self):
+        # 不支持单条 upsert 的数据库走先查询再批量写入的路径
+        with mock.patch.dict(playback.UPSERT_SQL, clear=True):
+            self.check_max_semantics()
+
+
+class WatchmapTests(TestCase):
+    """观看分段位图"""
+
+    def test_mark_merge_and_count(self):
+        bitmap = watchmap.mark(b'', 0, 12)
+        self.assertEqual(bitmap, bytes([0b111]))
+        # 第 9 段（45 秒）跨入第二个字节
+        merged = watchmap.merge(bitmap, watchmap.mark(b'', 45))
+        self.assertEqual(merged, bytes([0b111, 0b10]))
+        self.assertEqual(watchmap.popcount(merged), 4)
+        self.assertEqual(watchmap.difference(merged, bitmap), bytes([0, 0b10]))
+        self.assertEqual(watchmap.difference(bitmap, merged), b'')
+        # 越界和负数的位置忽略
+        self.assertEqual(watchmap.mark(b'', -1), b'')
+        self.assertEqual(watchmap.mark(b'', 10 ** 9), b'')
+
+    def test_seeking_to_the_end_is_not_completion(self):
+        self.assertEqual(watchmap.completion(watchmap.mark(b'', 0, 59), 60), 1.0)
+        self.assertAlmostEqual(watchmap.completion(watchmap.mark(watchmap.mark(b'', 0, 4), 59), 60), 2 / 12)
+        # 超出时长的分段不计入
+        self.assertEqual(watchmap.completion(watchmap.mark(b'', 0, 600), 60), 1.0)
+        self.assertEqual(watchmap.completion(b'\xff', 0), 0.0)
+
+
+class HeatmapTests(TestCase):
+    """视频分段观看人数的增量累加"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = User.objects.create_user(username='first', password='password')
+        cls.second = User.objects.create_user(username='second', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.first)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.video = Video.objects.create(title='视频', category=category, url='videos/test.mp4', duration='00:30')
+
+    def counts(self):
+        return heatmap.get_heatmap(self.video)['counts'].tolist()
+
+    def watch(self, user, start, end):
+        bitmap = watchmap.mark(b'', start, end)
+        playback.upsert_progress_many([(user.id, self.video.id, end, end, timezone.now(), bitmap)])
+
+    def test_merges_watched_segments_of_each_viewer(self):
+        self.watch(self.first, 0, 12)
+        self.watch(self.second, 5, 9)
+        # 重复观看已看过的分段不重复计数
+        self.watch(self.first, 0, 7)
+        self.watch(self.first, 20, 22)
+        self.assertEqual(self.counts(), [1, 2, 1, 0, 1, 0])
+        self.assertEqual(heatmap.get_heatmap(self.video)['viewers'], 2)
+
+        summary = heatmap.summarize(heatmap.get_heatmap(self.video))
+        self.assertEqual(summary['drop_offs'][0], {'segment': 2, 'second': 10, 'drop': 1})
+
+        heatmap.rebuild(self.video)
+        self.assertEqual(self.counts(), [1, 2, 1, 0, 1, 0])
+
+    def test_edits_and_deletions_outside_the_batch_write_update_counts(self):
+        self.watch(self.first, 0, 12)
+        self.watch(self.second, 0, 4)
+        stat = PlaybackStat.objects.get(user=self.first, video=self.video)
+        stat.watched = watchmap.mark(b'', 10, 14)
+        stat.save()
+        self.assertEqual(self.counts(), [1, 0, 1, 0, 0, 0])
+
+        PlaybackStat.objects.get(user=self.second, video=self.video).delete()
+        self.assertEqual(self.counts(), [0, 0, 1, 0, 0, 0])
+        self.assertEqual(heatmap.get_heatmap(self.video)['viewers'], 1)
+
+    def test_cascade_deletions(self):
+        self.watch(self.first, 0, 12)
+        self.watch(self.second, 0, 4)
+        self.second.delete()
+        self.assertEqual(self.counts(), [1, 1, 1, 0, 0, 0])
+
+        # 删除视频时计数行随之删除，不逐条更新
+        with CaptureQueriesContext(connection) as queries:
+            self.video.delete()
+        self.assertFalse(any('UPDATE' in query['sql'] and 'segmentstat' in query['sql'] for query in queries))
+        self.assertFalse(SegmentStat.objects.exists())
+
+
+class LeaderboardTests(TestCase):
+    """排行榜的跳表与进程内缓存"""
+
+    def test_ranked_set_matches_sorted_list(self):
+        rng = random.Random(0)
+        ranked = leaderboard.RankedSet()
+        expected = []
+        for _ in range(500):
+            key = (rng.randrange(50), rng.randrange(1000))
+            if key in expected and rng.random() < 0.5:
+                ranked.remove(key)
+                expected.remove(key)
+            elif key not in expected:
+                ranked.insert(key)
+                expected.append(key)
+            expected.sort()
+        self.assertEqual(len(ranked), len(expected))
+        self.assertEqual(ranked.slice(0, len(expected)), expected)
+        self.assertEqual(ranked.slice(10, 5), expected[10:15])
+        self.assertEqual(ranked.count_before((25, -1)), sum(1 for key in expected if key < (25, -1)))
+        with self.assertRaises(KeyError):
+            ranked.remove((100, 0))
+
+    def test_rank_top_and_bottom(self):
+        board = leaderboard.Leaderboard({1: 10, 2: 30, 3: 20, 4: 30})
+        board.increment(1, 5)
+        board.update(3, 5)
+        board.remove(5)
+        self.assertEqual(board.top(3), [(2, 30), (4, 30), (1, 15)])
+        self.assertEqual(board.bottom(2), [(3, 5), (1, 15)])
+        # 同分名次相同
+        self.assertEqual(board.rank(4), {'rank': 1, 'total': 4, 'score': 30, 'percentile': 50.0})
+        self.assertEqual(board.rank(3), {'rank': 4, 'total': 4, 'score': 5, 'percentile': 0.0})
+        self.assertIsNone(board.rank(5))
+        self.assertEqual(board.count_at_least(15), 3)
+
+    def test_loaded_boards_are_bounded(self):
+        with mock.patch.object(leaderboard, 'MAX_BOARDS', 3), \
+                mock.patch.object(leaderboard, '_boards', OrderedDict()) as boards:
+            for homework_id in range(1, 5):
+                leaderboard.homework_leaderboard(homework_id)
+            leaderboard.homework_leaderboard(2)
+            leaderboard.homework_leaderboard(5)
+            self.assertEqual(list(boards), [('homework', 4), ('homework', 2), ('homework', 5)])
+
+            boards[('homework', 4)].loaded_at -= leaderboard.LEADERBOARD_TTL + 1
+            self.assertIsNone(leaderboard._loaded('homework', 4))
+            self.assertNotIn(('homework', 4), boards)
+
+
+class SearchTests(TestCase):
+    """全文检索的切词、排序和查询上限"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='teacher', password='password')
+        cls.titled = Collection.objects.create(name='机器学习入门', description='基础课程', creator=user)
+        cls.described = Collection.objects.create(name='数据分析', description='会用到机器学习', creator=user)
+        Collection.objects.create(name='高等数学', description='微积分', creator=user)
+
+    def test_title_matches_rank_first(self):
+        response = APIClient().get('/api/search/search/', {'q': '机器学习'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 2)
+        self.assertEqual([result['id'] for result in response.data['results']], [self.titled.id, self.described.id])
+
+        # 单字展开为以该字开头的索引词
+        total, _ = search.search('微')
+        self.assertEqual(total, 1)
+
+    def test_query_is_capped(self):
+        response = APIClient().get('/api/search/search/', {'q': 'x' * (search.MAX_QUERY_LENGTH + 1)})
+        self.assertEqual(response.status_code, 400)
+
+        # 100 个不同汉字切出 99 个二元组
+        text = ''.join(chr(0x4e00 + i) for i in range(search.MAX_QUERY_LENGTH))
+        self.assertEqual(len(search._query_terms(text)), search.MAX_QUERY_TERMS)
+        self.assertLessEqual(len(search._query_terms('机 器 学 习 数 据 高 等 微 积 分 ' * 10)), search.MAX_QUERY_TERMS)
+
+
+class CatalogSyncTests(TestCase):
+    """目录增量同步的游标和删除记录"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='teacher', password='password')
+        collection = Collection.objects.create(name='合辑', creator=user)
+        cls.category = Category.objects.create(name='分类', collection=collection)
+        cls.videos = [
+            Video.objects.create(title=f'视频{i}', category=cls.category, url='videos/test.mp4') for i in range(3)
+        ]
+
+    def changes(self, since=None):
+        response = APIClient().get('/api/catalog/changes/', {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_through_changes_and_deletions(self):
+        full = self.changes()
+        self.assertEqual({video['id'] for video in full['videos']}, {video.id for video in self.videos})
+        self.assertFalse(full['has_more'])
+
+        added = Video.objects.create(title='新视频', category=self.category, url='videos/test.mp4')
+        removed = self.videos[0].id
+        self.videos[0].delete()
+        with self.settings(CATALOG_SYNC={'MAX_CHANGES': 1}):
+            seen, deleted, cursor = set(), set(), full['cursor']
+            while True:
+                changes = self.changes(cursor)
+                seen.update(video['id'] for video in changes['videos'])
+                deleted.update(changes['deleted']['videos'])
+                cursor = changes['cursor']
+                if not changes['has_more']:
+                    break
+        self.assertIn(added.id, seen)
+        self.assertEqual(deleted, {removed})
+
+    def test_rejects_malformed_and_expired_cursors(self):
+        cursor = self.changes()['cursor']
+        # 只有一个时间戳的旧格式游标不再接受
+        for since in ['12345', cursor + ',0:0', 'a:b', cursor.replace(':', '')]:
+            response = APIClient().get('/api/catalog/changes/', {'since': since})
+            self.assertEqual(response.status_code, 400, since)
+
+        expired = sync.encode_cursor([(timezone.now() - timedelta(days=31), 0)] * len(cursor.split(',')))
+        self.assertEqual(APIClient().get('/api/catalog/changes/', {'since': expired}).status_code, 410)
+
+
+class PaginationTests(TestCase):
+    """成绩和播放记录列表默认分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='student', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.homework = Homework.objects.create(title='作业', category=category, deadline=timezone.now())
+        now = timezone.now()
+        Score.objects.bulk_create([
+            Score(user=cls.user, homework=cls.homework, score=i, submitted_at=now) for i in range(60)
+        ])
+        for i in range(3):
+            video = Video.objects.create(title=f'视频{i}', category=category, url='videos/test.mp4')
+            playback.upsert_progress(cls.user.id, video.id, 10, 10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_scores_are_paginated_by_default(self):
+        response = self.client.get(f'/api/homeworks/{self.homework.id}/scores/')
+        self.assertEqual(len(response.data['results']), 50)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get('/api/score/', {'page_size': 10000})
+        self.assertEqual(len(response.data['results']), 60)
+        response = self.client.get('/api/score/', {'page_size': 5})
+        self.assertEqual([row['score'] for row in response.data['results']], [59, 58, 57, 56, 55])
+
+    def test_playback_stats_are_paginated_and_catalog_lists_are_not(self):
+        for url in ['/api/playback-stats/', '/api/playback-stats/get_playback_stats/']:
+            response = self.client.get(url)
+            self.assertEqual(len(response.data['results']), 3)
+        self.assertIsInstance(self.client.get('/api/videos/').data, list)
+
+
+class SaveQuestionsTests(TestCase):
+    """保存题目：与已有题目比较后批量新建、更新和删除"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='teacher', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.homework = Homework.objects.create(title='作业', category=category, deadline=timezone.now())
+        cls.other = Homework.objects.create(title='其他作业', category=category, deadline=timezone.now())
+        options = [{'text': 'A', 'isCorrect': True}, {'text': 'B'}]
+        cls.first = Question.objects.create(homework=cls.homework, type='single', content='一', score=5, options=options)
+        cls.second = Question.objects.create(homework=cls.homework, type='single', content='二', score=5, options=options)
+        cls.foreign = Question.objects.create(homework=cls.other, type='single', content='外', score=5, options=options)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def save(self, questions):
+        return self.client.post(
+            f'/api/homeworks/{self.homework.id}/save_questions/', {'questions': questions}, format='json'
+        )
+
+    def question(self, content, **extra):
+        return {'content': content, 'type': 'single', 'score': 5, 'options': [{'text': 'A', 'isCorrect': True}], **extra}
+
+    def test_diff_creates_updates_and_deletes(self):
+        response = self.save([self.question('新题'), self.question('一（改）', id=self.first.id)])
+        self.assertEqual(response.status_code, 200)
+        ids = [question['id'] for question in response.data['questions']]
+        self.assertEqual(ids[1], self.first.id)
+        self.assertEqual(
+            list(self.homework.questions.order_by('id').values_list('id', 'content')),
+            [(self.first.id, '一（改）'), (ids[0], '新题')],
+        )
+
+    def test_query_count_does_not_grow_with_questions(self):
+        counts = []
+        for size in (2, 40):
+            with CaptureQueriesContext(connection) as queries:
+                self.save([self.question(f'题{i}') for i in range(size)])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_foreign_question_rolls_back(self):
+        response = self.save([self.question('新题'), self.question('外', id=self.foreign.id)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            set(self.homework.questions.values_list('id', flat=True)), {self.first.id, self.second.id}
+        )
+        self.assertEqual(Question.objects.get(id=self.foreign.id).homework_id, self.other.id)
+
+
+class ScoreSummaryTests(TestCase):
+    """成绩汇总：提交时一条语句累加，修改、删除时重新汇总"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='student', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.homework = Homework.objects.create(title='作业', category=category, deadline=timezone.now())
+
+    def summary(self):
+        summary = ScoreSummary.objects.get(user=self.user, homework=self.homework)
+        return (
+            summary.best_score, summary.latest_score, summary.attempts,
+            summary.first_submitted_at, summary.last_submitted_at,
+        )
+
+    def test_submissions_keep_best_and_latest(self):
+        start = timezone.now()
+        for score, offset in [(60, 10), (80, 20), (70, 0)]:
+            # 最后一条是提交时间更早、写入较晚的成绩，不改变最近得分
+            rollups.add_score_summary(Score(
+                user=self.user, homework=self.homework, score=score, submitted_at=start + timedelta(seconds=offset)
+            ))
+        self.assertEqual(self.summary(), (80, 80, 3, start, start + timedelta(seconds=20)))
+
+    def test_edits_and_deletions_refresh_the_summary(self):
+        first = Score.objects.create(user=self.user, homework=self.homework, score=90)
+        second = Score.objects.create(user=self.user, homework=self.homework, score=50)
+        self.assertEqual(self.summary()[:3], (90, 50, 2))
+
+        first.score = 40
+        first.save()
+        self.assertEqual(self.summary()[:3], (50, 50, 2))
+        second.delete()
+        self.assertEqual(self.summary()[:3], (40, 40, 1))
+
+        incremental = self.summary()
+        rollups.rebuild_score_summaries(self.homework.id)
+        self.assertEqual(self.summary(), incremental)
+
+        first.delete()
+        self.assertFalse(ScoreSummary.objects.exists())
+
+
+class GradingTests(TestCase):
+    """提交作答与判分"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='student', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.homework = Homework.objects.create(title='作业', category=category, deadline=timezone.now())
+        cls.single = Question.objects.create(
+            homework=cls.homework, type='single', content='单选', score=5,
+            options=[{'text': 'A', 'isCorrect': True}, {'text': 'B', 'isCorrect': False}],
+        )
+        cls.multi = Question.objects.create(
+            homework=cls.homework, type='multi', content='多选', score=10,
+            options=[{'text': 'A', 'isCorrect': True}, {'text': 'B', 'isCorrect': True}, {'text': 'C'}],
+        )
+
+    def setUp(self):
+        grading.invalidate([self.homework.id])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, answers):
+        return self.client.post(f'/api/homeworks/{self.homework.id}/submit_answers/', {'answers': answers}, format='json')
+
+    def test_scores_each_question(self):
+        response = self.submit([
+            {'questionId': self.single.id, 'answer': 'A'},
+            {'questionId': str(self.multi.id), 'answer': ['B', 'A']},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'score': 15})
+
+    def test_multi_requires_a_list(self):
+        response = self.submit([{'questionId': self.multi.id, 'answer': 'AB'}])
+        self.assertEqual(response.data, {'score': 0})
+
+    def test_duplicate_question_is_rejected(self):
+        response = self.submit([{'questionId': self.single.id, 'answer': 'A'}] * 10)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Score.objects.exists())
+        self.assertFalse(ScoreSummary.objects.exists())
+
+    def test_malformed_answers_are_rejected(self):
+        for answers in (['A'], [None], 'A', {'questionId': self.single.id}):
+            with self.subTest(answers=answers):
+                self.assertEqual(self.submit(answers).status_code, 400)
+        self.assertFalse(Score.objects.exists())
+
+    def test_unknown_question(self):
+        response = self.submit([{'questionId': self.multi.id + 100, 'answer': 'A'}])
+        self.assertEqual(response.status_code, 404)
+
+    def test_lenient_marking_scores_duplicates_once(self):
+        answer_key = grading.compile_answer_key(self.homework.id)
+        answers = [{'questionId': self.single.id, 'answer': 'A'}] * 3 + ['A', {'questionId': 0}]
+        self.assertEqual(grading.grade(answer_key, answers, strict=False), 5)
+
+
+class ConditionalGetTests(TestCase):
+    """目录接口的 ETag / Last-Modified"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='viewer', password='password')
+        cls.collection = Collection.objects.create(name='合辑', creator=cls.user)
+        cls.category = Category.objects.create(name='分类', collection=cls.collection)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_not_modified_until_content_changes(self):
+        url = f'/api/categories/{self.category.id}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.category.name = '新分类'
+        self.category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], '新分类')
+
+    def test_favorite_toggle_changes_etag_and_omits_last_modified(self):
+        url = f'/api/collections/{self.collection.id}/'
+        response = self.client.get(url)
+        self.assertFalse(response.data['is_favorited'])
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{url}favorite/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+
+class AutocompleteTests(TestCase):
+    """搜索提示索引：本进程的修改增量应用，其他进程的修改触发重建"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='teacher', password='password')
+
+    def setUp(self):
+        autocomplete._index = None
+        autocomplete._index_version = None
+        self.addCleanup(setattr, autocomplete, '_index', None)
+
+    def titles(self, prefix):
+        return [item['title'] for item in autocomplete.suggest(prefix)]
+
+    def create(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Collection.objects.create(name=name, creator=self.user)
+
+    def test_local_change_is_applied_without_rebuild(self):
+        self.create('数据分析')
+        self.assertEqual(self.titles('数据'), ['数据分析'])
+        with mock.patch.object(autocomplete, '_build', wraps=autocomplete._build) as build:
+            self.create('数据挖掘')
+            autocomplete._checked_at = 0
+            self.assertEqual(self.titles('数据'), ['数据分析', '数据挖掘'])
+        build.assert_not_called()
+
+    def test_change_from_other_process_is_not_marked_seen(self):
+        self.create('数据分析')
+        self.assertEqual(self.titles('数据'), ['数据分析'])
+        # 其他进程：新增合辑并更换版本戳，本进程没有收到信号
+        Collection.objects.bulk_create([Collection(name='数据结构', creator=self.user)])
+        CatalogVersion.objects.filter(scope='catalog').update(version='other-process')
+        # 随后本进程的修改不能把其他进程的修改记为已应用
+        self.create('数据挖掘')
+        self.assertEqual(self.titles('数据'), ['数据分析', '数据挖掘', '数据结构'])
+
+
+class RegradeTests(TestCase):
+    """修改答案后重新判分：成绩、成绩汇总和题目统计"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='student', password='password')
+        collection = Collection.objects.create(name='合辑', creator=cls.user)
+        category = Category.objects.create(name='分类', collection=collection)
+        cls.homework = Homework.objects.create(title='作业', category=category, deadline=timezone.now())
+        cls.question = Question.objects.create(
+            homework=cls.homework, type='single', content='单选', score=5,
+            options=[{'text': 'A', 'isCorrect': True}, {'text': 'B', 'isCorrect': False}],
+        )
+        cls.other = Question.objects.create(
+            homework=cls.homework, type='single', content='单选二', score=3,
+            options=[{'text': 'A', 'isCorrect': True}, {'text': 'B', 'isCorrect': False}],
+        )
+
+    def setUp(self):
+        grading.invalidate([self.homework.id])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, *choices):
+        response = self.client.post(f'/api/homeworks/{self.homework.id}/submit_answers/', {'answers': [
+            {'questionId': self.question.id, 'answer': choices[0]},
+            {'questionId': self.other.id, 'answer': choices[1]},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def stats(self):
+        return (
+            sorted(QuestionStat.objects.values_list('question_id', *item_stats.COUNTERS)),
+            sorted(OptionStat.objects.values_list('question_id', 'option', 'count')),
+        )
+
+    def test_regrade_after_answer_change(self):
+        self.submit('A', 'A')
+        self.submit('B', 'A')
+        self.question.options = [{'text': 'A', 'isCorrect': False}, {'text': 'B', 'isCorrect': True}]
+        self.question.save()
+
+        state = regrade.regrade_homework(self.homework.id, workers=1)
+        self.assertEqual((state['done'], state['changed']), (2, 2))
+        self.assertEqual(sorted(Score.objects.values_list('score', flat=True)), [3, 8])
+        summary = ScoreSummary.objects.get(user=self.user, homework=self.homework)
+        self.assertEqual((summary.best_score, summary.latest_score, summary.attempts), (8, 8, 2))
+        stat = QuestionStat.objects.get(question=self.question)
+        self.assertEqual((stat.attempts, stat.correct), (2, 1))
+
+    def test_rebuild_keeps_submissions_after_the_last_chunk(self):
+        self.submit('A', 'A')
+        self.submit('B', 'A')
+        answer_key = grading.compile_answer_key(self.homework.id)
+        created = dict(Question.objects.values_list('id', 'created_at'))
+        rows = list(Score.objects.order_by('id').values_list('id', 'score', 'answers', 'submitted_at'))
+        _, tally = regrade.grade_chunk(answer_key, created, rows)
 
-# Create your tests here.
+        # 分块判分结束后、重建前提交的作答：已累加到统计中，但不在 tally 里
+        self.submit('A', 'B')
+        expected = self.stats()
+        item_stats.rebuild(self.homework.id, tally, answer_key, created, rows[-1][0])
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(QuestionStat.objects.get(question=self.question).attempts, 3)
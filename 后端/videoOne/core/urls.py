@@ -4,7 +4,8 @@ from .views import (
     AuthViewSet, UserViewSet, CollectionViewSet, PlaybackStatViewSet,
     HomeworkViewSet, VideoViewSet, CategoryViewSet, SearchViewSet, hello,
     HomeworkDetailViewSet, UserCenterViewSet, UploadViewSet, MaterialViewSet,ScoreViewSet,
-    analyze_course_stats,get_course_scores,get_favorite_course_stats
+    analyze_course_stats,get_course_scores,get_favorite_course_stats,get_course_leaderboard,
+    query_profile_report, get_catalog_changes
 )
 
 router = DefaultRouter()
@@ -29,6 +30,9 @@ urlpatterns = [
     path('upload/', UploadViewSet.as_view({'post': 'upload'}), name='upload'),
     path('analyze_course_stats/<int:course_id>/', analyze_course_stats, name='analyze_course_stats'),
     path('course-scores/<int:course_id>/', get_course_scores, name='course-scores'),
+    path('course-leaderboard/<int:course_id>/', get_course_leaderboard, name='course-leaderboard'),
     path('favorite-course-stats/', get_favorite_course_stats, name='favorite-course-stats'),
+    path('catalog/changes/', get_catalog_changes, name='catalog-changes'),
+    path('debug/query-profile/', query_profile_report, name='query-profile'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,136 @@
+"""
+内容版本戳与条件请求（ETag / Last-Modified）。
+
+内容变化时在同一事务内更换受影响范围的版本戳（CatalogVersion），
+目录类接口先用一次查询读出版本戳计算 ETag，客户端缓存仍有效时直接返回 304，不查询也不序列化内容。
+"""
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import CatalogVersion, Question
+
+CATALOG = 'catalog'
+
+# 本进程写入的目录版本戳 -> 写入前的版本戳，保留最近 LOCAL_BUMPS 个，见 changed_locally
+LOCAL_BUMPS = 1000
+_local_bumps = OrderedDict()
+_local_bumps_lock = threading.Lock()
+
+
+def collection_scope(collection_id):
+    return f'collection:{collection_id}'
+
+
+def category_scope(category_id):
+    return f'category:{category_id}'
+
+
+def homework_scope(homework_id):
+    return f'homework:{homework_id}'
+
+
+def bump(*scopes):
+    """更换指定范围和全部目录（catalog）的版本戳"""
+    scopes = set(scopes) | {CATALOG}
+    version = uuid.uuid4().hex
+    connection = connections[router.db_for_write(CatalogVersion)]
+    with transaction.atomic(using=connection.alias):
+        # 锁定目录版本戳再更换，记下的写入前版本与本次写入之间不会有其他进程的修改
+        previous = CatalogVersion.objects.using(connection.alias).select_for_update().filter(
+            scope=CATALOG
+        ).values_list('version', flat=True).first()
+        CatalogVersion.objects.using(connection.alias).bulk_create(
+            [CatalogVersion(scope=scope, version=version) for scope in sorted(scopes)],
+            update_conflicts=True,
+            # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定冲突字段
+            unique_fields=['scope'] if connection.features.supports_update_conflicts_with_target else None,
+            update_fields=['version', 'updated_at'],
+        )
+    with _local_bumps_lock:
+        _local_bumps[version] = previous
+        while len(_local_bumps) > LOCAL_BUMPS:
+            _local_bumps.popitem(last=False)
+
+
+def changed_locally(since, current):
+    """目录版本戳从 since 变为 current 的每一次更换是否都由本进程写入"""
+    with _local_bumps_lock:
+        while current != since:
+            if current not in _local_bumps:
+                return False
+            current = _local_bumps[current]
+    return True
+
+
+def content_changed(category_ids=(), collection_ids=()):
+    bump(
+        *(category_scope(category_id) for category_id in category_ids),
+        *(collection_scope(collection_id) for collection_id in collection_ids),
+    )
+
+
+def conditional(get_scopes):
+    """
+    为 GET 接口加上 ETag / Last-Modified，客户端的 If-None-Match / If-Modified-Since 仍有效时返回 304。
+    get_scopes(view, request, *args, **kwargs) 返回 (版本范围列表, 额外参与 ETag 的值)，
+    额外的值用于区分因人而异的内容（如收藏状态）；有额外的值时不返回 Last-Modified，
+    因为修改时间只来自版本戳，收藏等个人状态变化后只带 If-Modified-Since 的请求会误得到 304。
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return method(self, request, *args, **kwargs)
+
+            scopes, extra = get_scopes(self, request, *args, **kwargs)
+            stamps = dict(
+                (scope, (version, updated_at)) for scope, version, updated_at in
+                CatalogVersion.objects.filter(scope__in=scopes).values_list('scope', 'version', 'updated_at')
+            )
+            digest = hashlib.md5(repr((
+                [stamps.get(scope, ('', None))[0] for scope in scopes], extra, request.get_full_path()
+            )).encode()).hexdigest()
+            etag = f'"{digest}"'
+            modified = [updated_at for _, updated_at in stamps.values()] if extra is None else []
+            last_modified = int(max(modified).timestamp()) if modified else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            # 内容可能因人而异，只允许浏览器缓存，每次使用前重新验证
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+@receiver(pre_save, sender=Question)
+def remember_previous_homework(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._previous_homework_id = Question.objects.filter(pk=instance.pk).values_list(
+        'homework_id', flat=True
+    ).first()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def bump_on_question_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    homework_ids = {instance.homework_id, getattr(instance, '_previous_homework_id', None)} - {None}
+    bump(*(homework_scope(homework_id) for homework_id in homework_ids))
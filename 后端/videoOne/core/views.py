@@ -1,20 +1,38 @@
 import mimetypes
 import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
 from urllib.parse import quote
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db import transaction
 from django.http import FileResponse
 from django.utils import timezone
 from rest_framework import viewsets, permissions, status
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from .serializers import *
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from . import autocomplete, grading, heatmap, item_stats, regrade
+from . import search as search_index
+from .favorites import get_favorite_ids
+from .leaderboard import course_leaderboard, homework_leaderboard
+from .middleware import profile_report
+from .pagination import KeysetPagination, paginated_response
+from .resource_cache import category_resources, collection_detail
+from .sync import CursorExpired, catalog_changes, decode_cursor
+from .versions import CATALOG, bump, category_scope, collection_scope, conditional, homework_scope
 from .models import PlaybackStat, Collection
-from django.db.models import Sum, Count
+from .playback import MAX_SYNC_RECORDS, get_playback_buffer, upsert_progress, upsert_progress_many
+from django.db.models import Sum, Count, FilteredRelation, Q
+
+
+def favorite_ids(request):
+    # 当前用户收藏的合辑ID，参与 ETag 计算（列表中的收藏状态因人而异）
+    return sorted(get_favorite_ids(request.user))
 
 
 class IsCreatorOrAdmin(permissions.BasePermission):
@@ -82,9 +100,51 @@ class CollectionViewSet(viewsets.ModelViewSet):
     queryset = Collection.objects.all()
     permission_classes = [IsCreatorOrAdmin]
 
+    def get_queryset(self):
+        # 其他操作只用到合辑本身，不预取嵌套资源
+        if self.action not in ('list', 'retrieve'):
+            return super().get_queryset()
+        return self.eager_load(super().get_queryset())
+
+    def eager_load(self, queryset):
+        # 只预取本次请求展开的嵌套关系（?fields= / ?expand=）
+        lookups = CollectionSerializer.expanded_lookups(*CollectionSerializer.field_options(self.request))
+        return CollectionSerializer.setup_eager_loading(queryset, lookups)
+
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
+    @conditional(lambda view, request, *args, **kwargs: ([CATALOG], favorite_ids(request)))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional(lambda view, request, *args, **kwargs: ([collection_scope(kwargs['pk'])], favorite_ids(request)))
+    def retrieve(self, request, *args, **kwargs):
+        # 按需字段的请求不走缓存
+        if CollectionSerializer.field_options(request) != (None, None):
+            return super().retrieve(request, *args, **kwargs)
+
+        try:
+            pk = int(kwargs['pk'])
+        except ValueError:
+            return Response({'error': '合辑不存在'}, status=status.HTTP_404_NOT_FOUND)
+
+        def build():
+            collection = self.get_queryset().filter(pk=pk).first()
+            if collection is None:
+                return None
+            data = self.get_serializer(collection).data
+            data['is_favorited'] = False
+            return data
+
+        data = collection_detail(pk, request, build)
+        if data is None:
+            return Response({'error': '合辑不存在'}, status=status.HTTP_404_NOT_FOUND)
+        # 收藏状态因人而异，不放入缓存
+        user = request.user
+        is_favorited = pk in get_favorite_ids(user)
+        return Response({**data, 'is_favorited': is_favorited})
+
     def update(self, request, *args, **kwargs):
         print('Request data:', request.data)
         print('Uploaded files:', request.FILES)
@@ -98,22 +158,25 @@ class CollectionViewSet(viewsets.ModelViewSet):
         serializer.save()  # 保存更新后的数据
 
     @action(detail=True, methods=['get'])
+    @conditional(lambda view, request, pk=None: (
+        [category_scope(request.query_params.get('categoryId'))],
+        (request.user.is_authenticated and request.user.is_staff, favorite_ids(request)),
+    ))
     def get_category_resources(self, request, pk=None):
         collection = self.get_object()
         category_id = request.query_params.get('categoryId')
         if not category_id:
             return Response({'error': 'categoryId is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not (request.user.is_staff or collection.id in request.user.favorite_collections.values_list('id',
-                                                                                                        flat=True)):
+        if not (request.user.is_staff or collection.id in get_favorite_ids(request.user)):
             return Response({'error': '无权限访问该分类'}, status=status.HTTP_403_FORBIDDEN)
 
-        category = Category.objects.get(id=category_id, collection=collection)
-        resources = {
-            'videos': VideoSerializer(category.videos.all(), many=True).data,
-            'homeworks': HomeworkSerializer(category.homeworks.all(), many=True).data,
-            'materials': MaterialSerializer(category.materials.all(), many=True).data
-        }
+        try:
+            owner_id, resources = category_resources(int(category_id))
+        except ValueError:
+            return Response({'error': 'categoryId 格式错误'}, status=status.HTTP_400_BAD_REQUEST)
+        if owner_id != collection.id:
+            return Response({'error': '分类不存在'}, status=status.HTTP_404_NOT_FOUND)
         return Response(resources)
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
@@ -132,7 +195,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
     def favorites(self, request):
         if not request.user.is_authenticated:
             return Response({'error': '用户未登录'}, status=status.HTTP_401_UNAUTHORIZED)
-        favorite_collections = request.user.favorite_collections.all()
+        favorite_collections = self.eager_load(request.user.favorite_collections.all())
         serializer = self.get_serializer(favorite_collections, many=True)
         return Response(serializer.data)
 
@@ -143,7 +206,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
         # 获取当前用户
         user = request.user
         # 过滤出当前用户创建的合辑
-        created_collections = Collection.objects.filter(creator=user)
+        created_collections = self.eager_load(Collection.objects.filter(creator=user))
         # 序列化合辑数据
         serializer = self.get_serializer(created_collections, many=True)
         # 返回响应
@@ -161,33 +224,60 @@ class CollectionViewSet(viewsets.ModelViewSet):
         }
         """
         collection = self.get_object()
-        user = request.user
+        if not request.user.is_authenticated:
+            return Response({'error': '用户未登录'}, status=status.HTTP_401_UNAUTHORIZED)
+        stats = collection_video_stats(request.user, [collection.id])[collection.id]
+        return Response(stats)
 
-        # 获取该课程的所有视频
-        videos = Video.objects.filter(category__collection=collection)
-        total_videos = videos.count()
+    @action(detail=False, methods=['get'])
+    def video_stats_batch(self, request):
+        """
+        批量获取多个课程的视频统计数据，查询次数与课程数量无关
+        参数: ids=1,2,3
+        返回: [{"id": 课程ID, "total", "completed", "in_progress", "not_started"}]
+        """
+        if not request.user.is_authenticated:
+            return Response({'error': '用户未登录'}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            collection_ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip()]
+        except ValueError:
+            return Response({'error': 'ids 格式错误'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(collection_ids) > MAX_BATCH_IDS:
+            return Response({'error': f'单次最多查询 {MAX_BATCH_IDS} 个课程'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 获取用户在该课程的播放记录
-        playback_stats = PlaybackStat.objects.filter(
-            user=user,
-            video__in=videos
-        )
+        stats = collection_video_stats(request.user, collection_ids)
+        return Response([{'id': collection_id, **stats[collection_id]} for collection_id in collection_ids])
 
-        # 统计已完成视频数(进度>=100)
-        completed = playback_stats.filter(progress__gte=100).count()
 
-        # 统计进行中视频数(进度>0但<100)
-        in_progress = playback_stats.filter(progress__gt=0, progress__lt=100).count()
+# 批量统计接口单次允许查询的最大课程数
+MAX_BATCH_IDS = 200
 
-        # 统计未开始视频数(进度=0)
-        not_started = total_videos - completed - in_progress
 
-        return Response({
-            "total": total_videos,
-            "completed": completed,
-            "in_progress": in_progress,
-            "not_started": not_started
-        })
+def collection_video_stats(user, collection_ids):
+    """
+    一条 SQL 统计用户在多个课程中的视频完成情况。
+    只关联该用户自己的播放记录（LEFT JOIN ... ON user_id = 当前用户），按课程分组条件计数。
+    返回: {课程ID: {"total", "completed", "in_progress", "not_started"}}
+    """
+    rows = Video.objects.filter(category__collection_id__in=collection_ids).annotate(
+        my_stat=FilteredRelation('playback_stats', condition=Q(playback_stats__user=user))
+    ).values('category__collection_id').annotate(
+        total=Count('id'),
+        completed=Count('my_stat', filter=Q(my_stat__progress__gte=100)),
+        in_progress=Count('my_stat', filter=Q(my_stat__progress__gt=0, my_stat__progress__lt=100)),
+    ).order_by()
+
+    stats = {collection_id: {'total': 0, 'completed': 0, 'in_progress': 0, 'not_started': 0}
+             for collection_id in collection_ids}
+    for row in rows:
+        stats[row['category__collection_id']] = {
+            'total': row['total'],
+            'completed': row['completed'],
+            'in_progress': row['in_progress'],
+            # 未开始视频数(进度=0 或没有播放记录)
+            'not_started': row['total'] - row['completed'] - row['in_progress'],
+        }
+    return stats
 
 
 class QuestionViewSet(viewsets.ModelViewSet):
@@ -198,22 +288,24 @@ class QuestionViewSet(viewsets.ModelViewSet):
 class ScoreViewSet(viewsets.ModelViewSet):
     serializer_class = ScoreSerializer
     queryset = Score.objects.all()
+    pagination_class = KeysetPagination
 
     @action(detail=False, methods=['get'])
     def get_course_scores(self, request):
         course_id = request.query_params.get('course_id')
         if not course_id:
             return Response({'error': 'course_id is required'}, status=status.HTTP_400_BAD_REQUEST)
-        scores = Score.objects.filter(homework__category__collection_id=course_id)
-        serializer = self.get_serializer(scores, many=True)
-        return Response(serializer.data)
+        # 每个学生每个作业一行（最高分），读取成绩汇总而不是全部提交记录
+        summaries = ScoreSummary.objects.filter(homework__category__collection_id=course_id)
+        return paginated_response(request, summaries, ScoreSummarySerializer, context=self.get_serializer_context())
 
 
 class PlaybackStatViewSet(viewsets.ModelViewSet):
     serializer_class = PlaybackStatSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        return PlaybackStat.objects.filter(user=self.request.user)
+        return PlaybackStat.objects.filter(user=self.request.user).select_related('video')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -221,38 +313,94 @@ class PlaybackStatViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def update_progress(self, request):
         user = request.user
+        if not user.is_authenticated:
+            return Response({'error': '用户未登录'}, status=status.HTTP_401_UNAUTHORIZED)
         video_id = request.data.get('videoId')
         progress = request.data.get('progress')
         duration = request.data.get('duration')
         try:
-            playback, created = PlaybackStat.objects.get_or_create(
-                user=user,
-                video_id=video_id,
-                defaults={
-                    'progress': progress,
-                    'duration': duration,
-                    'last_played_at': timezone.now()
-                }
-            )
-            if not created and float(progress) > float(playback.progress):
-                playback.progress = progress
-                playback.duration = duration
-                playback.last_played_at = timezone.now()
-                playback.save()
-            elif not created:
-                playback.duration = duration
-                playback.last_played_at = timezone.now()
-                playback.save()
-            return Response({'success': True, 'created': created})
+            # 启用写缓冲时只合并心跳，由缓冲批量落库
+            buffer = get_playback_buffer()
+            if buffer is not None:
+                buffer.add(user.id, int(video_id), int(float(progress)), int(float(duration)))
+                return Response({'success': True, 'buffered': True})
+
+            # 单条语句完成插入或更新，进度只增不减
+            upsert_progress(user.id, int(video_id), int(float(progress)), int(float(duration)))
+            return Response({'success': True})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['post'])
+    def sync_progress(self, request):
+        """
+        批量同步播放进度（播放列表会话、离线缓存后补传）
+        请求: {"records": [{"videoId", "progress", "duration", "lastPlayedAt"(可选, 毫秒时间戳)}]}
+        返回: {"results": [{"index", "videoId", "success", "error"(失败时)}]}
+        """
+        user = request.user
+        if not user.is_authenticated:
+            return Response({'error': '用户未登录'}, status=status.HTTP_401_UNAUTHORIZED)
+        records = request.data.get('records')
+        if not isinstance(records, list):
+            return Response({'error': 'records is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(records) > MAX_SYNC_RECORDS:
+            return Response({'error': f'单次最多同步 {MAX_SYNC_RECORDS} 条记录'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        results = []
+        parsed = []
+        for index, record in enumerate(records):
+            video_id = record.get('videoId') if isinstance(record, dict) else None
+            results.append({'index': index, 'videoId': video_id, 'success': False})
+            try:
+                played_at = now
+                if record.get('lastPlayedAt'):
+                    # 客户端时间不可信，不允许晚于服务器当前时间
+                    played_at = min(
+                        datetime.fromtimestamp(float(record['lastPlayedAt']) / 1000, tz=dt_timezone.utc), now
+                    )
+                parsed.append((index, int(video_id), int(float(record['progress'])),
+                               int(float(record['duration'])), played_at))
+            except (AttributeError, KeyError, TypeError, ValueError, OverflowError, OSError):
+                results[index]['error'] = '记录格式错误'
+
+        existing_videos = set(Video.objects.filter(
+            id__in={item[1] for item in parsed}
+        ).values_list('id', flat=True))
+
+        valid = []
+        for index, video_id, progress, duration, played_at in parsed:
+            if video_id not in existing_videos:
+                results[index]['error'] = '视频不存在'
+                continue
+            valid.append((index, video_id, progress, duration, played_at))
+
+        try:
+            # 按播放时间排序，同一视频以最后播放的记录作为续播位置
+            valid.sort(key=lambda item: item[4])
+            with transaction.atomic():
+                upsert_progress_many(
+                    (user.id, video_id, progress, duration, played_at)
+                    for _, video_id, progress, duration, played_at in valid
+                )
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        for item in valid:
+            results[item[0]]['success'] = True
+        return Response({'results': results})
+
     @action(detail=False, methods=['get'])
     def get_playback_stats(self, request):
         try:
-            playback_stats = self.get_queryset()
-            serializer = self.get_serializer(playback_stats, many=True)
-            return Response(serializer.data)
+            return paginated_response(
+                request, self.get_queryset(), self.get_serializer_class(), context=self.get_serializer_context()
+            )
+        except NotFound:
+            # 无效的分页游标
+            raise
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -337,6 +485,24 @@ class VideoViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def heatmap(self, request, pk=None):
+        """
+        视频观看热力图（仅课程创建者和管理员可见）
+        返回: {
+            "segment_seconds": 每段秒数,
+            "viewers": 观看人数,
+            "counts": 每段观看人数,
+            "retention": 每段留存比例,
+            "drop_offs": 流失最多的分段
+        }
+        """
+        video = self.get_object()
+        collection = video.category.collection
+        if not (request.user.is_staff or collection.creator_id == request.user.id):
+            return Response({'error': '无权限查看该视频的统计数据'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(heatmap.summarize(heatmap.get_heatmap(video)))
+
     @action(detail=True, methods=['get'])
     def get_video_detail(self, request, pk=None):
         video = self.get_object()
@@ -377,41 +543,83 @@ class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def get_queryset(self):
+        lookups = CategorySerializer.expanded_lookups(*CategorySerializer.field_options(self.request))
+        return CategorySerializer.setup_eager_loading(super().get_queryset(), lookups)
+
+    @conditional(lambda view, request, *args, **kwargs: ([CATALOG], None))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional(lambda view, request, *args, **kwargs: ([category_scope(kwargs['pk'])], None))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def cached_resources(self, pk):
+        # 分类资源走缓存，内容未修改时不查询数据库
+        try:
+            _, resources = category_resources(int(pk))
+        except ValueError:
+            resources = None
+        if resources is None:
+            return Response({'error': '分类不存在'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(resources)
+
     @action(detail=True, methods=['get'])
+    @conditional(lambda view, request, pk=None: ([category_scope(pk)], None))
     def get_category_resources(self, request, pk=None):
-        category = self.get_object()
-        resources = {
-            'videos': VideoSerializer(category.videos.all(), many=True).data,
-            'homeworks': HomeworkSerializer(category.homeworks.all(), many=True).data,
-            'materials': MaterialSerializer(category.materials.all(), many=True).data
-        }
-        return Response(resources)
+        return self.cached_resources(pk)
 
     @action(detail=True, methods=['get'])
+    @conditional(lambda view, request, pk=None: ([category_scope(pk)], None))
     def resources(self, request, pk=None):
-        category = self.get_object()
-        resources = {
-            'videos': VideoSerializer(category.videos.all(), many=True).data,
-            'homeworks': HomeworkSerializer(category.homeworks.all(), many=True).data,
-            'materials': MaterialSerializer(category.materials.all(), many=True).data
-        }
-        return Response(resources)
+        return self.cached_resources(pk)
 
 
 class SearchViewSet(viewsets.GenericViewSet):
+    # 搜索结果每页数量
+    PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 50
+
     @action(detail=False, methods=['get'])
     def search(self, request):
+        """
+        全文搜索合辑、视频、作业、资料和题目，按相关度排序
+        参数: q=关键词, type=collection|video|homework|material|question（可选）, page, page_size
+        返回: {"total", "page", "page_size", "results": [{"type", "id", "title", "score", ...}]}
+        """
         query = request.query_params.get('q', '')
-        collections = Collection.objects.filter(name__icontains=query)
-        videos = Video.objects.filter(title__icontains=query)
-        homeworks = Homework.objects.filter(title__icontains=query)
-
-        results = {
-            'collections': CollectionSerializer(collections, many=True).data,
-            'videos': VideoSerializer(videos, many=True).data,
-            'homeworks': HomeworkSerializer(homeworks, many=True).data,
-        }
-        return Response(results)
+        if len(query) > search_index.MAX_QUERY_LENGTH:
+            return Response(
+                {'error': f'关键词不能超过 {search_index.MAX_QUERY_LENGTH} 个字符'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        kind = request.query_params.get('type') or None
+        if kind is not None and kind not in search_index.SOURCES:
+            return Response({'error': 'type 参数错误'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', self.PAGE_SIZE)), 1), self.MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'error': '分页参数错误'}, status=status.HTTP_400_BAD_REQUEST)
+
+        total, results = search_index.search(query, kind, (page - 1) * page_size, page_size)
+        for result in results:
+            if result.get('thumbnail'):
+                result['thumbnail'] = request.build_absolute_uri(settings.MEDIA_URL + result['thumbnail'])
+        return Response({'total': total, 'page': page, 'page_size': page_size, 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        搜索框输入提示（合辑名称、视频标题、作业标题）
+        参数: q=已输入的内容, limit=数量（默认 10，最多 20）
+        返回: [{"type", "id", "title"}]
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 20)
+        except ValueError:
+            return Response({'error': 'limit 参数错误'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(autocomplete.suggest(request.query_params.get('q', ''), limit))
 
 
 class HomeworkDetailViewSet(viewsets.ModelViewSet):
@@ -452,6 +660,7 @@ class HomeworkViewSet(viewsets.ModelViewSet):
     parser_classes = [JSONParser, MultiPartParser, FormParser]
 
     @action(detail=True, methods=['get'])
+    @conditional(lambda view, request, pk=None: ([homework_scope(pk)], None))
     def questions(self, request, pk=None):
         homework = self.get_object()
         questions = homework.questions.all()
@@ -461,22 +670,64 @@ class HomeworkViewSet(viewsets.ModelViewSet):
     # HomeworkViewSet 中的 save_questions 方法
     @action(detail=True, methods=['post'])
     def save_questions(self, request, pk=None):
+        """
+        保存作业的全部题目：与已有题目比较，带 id 的更新（内容未变的跳过），没有 id 的新建，
+        未提交的已有题目删除；在一个事务内完成。id 不属于该作业时整体失败。
+        返回: {"status", "questions": 保存后的题目（按提交顺序，含新建题目的 id）}
+        """
         try:
             homework = self.get_object()
             # 直接获取已解析的JSON数据
             questions = request.data.get('questions', [])
-            for question_data in questions:
-                question, created = Question.objects.update_or_create(
-                    id=question_data.get('id'),
-                    defaults={
-                        'content': question_data.get('content'),
-                        'type': question_data.get('type'),
-                        'options': question_data.get('options'),
-                        'homework': homework,
-                        'score': question_data.get('score')
-                    }
-                )
-            return Response({'status': '题目保存成功'})
+            fields = ('content', 'type', 'options', 'score')
+            with transaction.atomic():
+                existing = {question.id: question for question in homework.questions.all()}
+                to_create, to_update, kept, saved = [], [], set(), []
+                for question_data in questions:
+                    values = {field: question_data.get(field) for field in fields}
+                    question_id = question_data.get('id')
+                    if question_id is None:
+                        question = Question(homework=homework, **values)
+                        to_create.append(question)
+                        saved.append(question)
+                        continue
+                    try:
+                        question = existing[int(question_id)]
+                    except (KeyError, TypeError, ValueError):
+                        raise ValueError(f'题目 {question_id} 不属于该作业')
+                    kept.add(question.id)
+                    saved.append(question)
+                    if any(getattr(question, field) != value for field, value in values.items()):
+                        for field, value in values.items():
+                            setattr(question, field, value)
+                        to_update.append(question)
+                removed = existing.keys() - kept
+
+                if to_create:
+                    Question.objects.bulk_create(to_create)
+                    if to_create[0].pk is None:
+                        # 不返回自增主键的数据库按插入顺序重新读取
+                        created = homework.questions.exclude(id__in=list(existing)).order_by('id')
+                        for question, row in zip(to_create, created):
+                            question.pk = row.pk
+                            question.updated_at = row.updated_at
+                if to_update:
+                    now = timezone.now()
+                    for question in to_update:
+                        question.updated_at = now
+                    Question.objects.bulk_update(to_update, [*fields, 'updated_at'])
+                if removed:
+                    Question.objects.filter(id__in=removed).delete()
+
+                if to_create or to_update or removed:
+                    # 批量写入不发送信号，手动更新版本戳、搜索索引和答案表
+                    bump(homework_scope(homework.id))
+                    search_index.index_objects('question', to_create + to_update)
+                    transaction.on_commit(lambda: grading.invalidate([homework.id]))
+                # 正确答案或分值可能已修改，后台重新计算已有成绩
+                if (to_update or removed) and homework.scores.exists():
+                    regrade.start(homework.id)
+            return Response({'status': '题目保存成功', 'questions': QuestionSerializer(saved, many=True).data})
         except Exception as e:
             return Response({'status': '题目保存失败', 'error': str(e)}, status=400)
 
@@ -484,42 +735,74 @@ class HomeworkViewSet(viewsets.ModelViewSet):
     def submit_answers(self, request, pk=None):
         homework = self.get_object()
         answers = request.data.get('answers', [])
-        score = 0
-
-        for answer in answers:
-            question_id = answer.get('questionId')
-            user_answer = answer.get('answer')
-            try:
-                question = Question.objects.get(id=question_id, homework=homework)
-
-                correct_answers = [option['text'] for option in question.options if option['isCorrect']]
+        answer_key = grading.get_answer_key(homework.id)
+        try:
+            marks = grading.mark(answer_key, answers)
+        except grading.InvalidAnswers as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except grading.UnknownQuestion as e:
+            return Response({'error': f'Question with id {e.question_id} does not exist'},
+                            status=status.HTTP_404_NOT_FOUND)
+        score = sum(earned for *_, earned in marks)
+
+        with transaction.atomic():
+            if regrade.running(homework.id):
+                # 重新判分会重建题目统计，期间与重建互斥，避免累加被清除或重复计入
+                list(Homework.objects.select_for_update().filter(id=homework.id).values_list('id'))
+            Score.objects.create(homework=homework, user=request.user, score=score, answers=answers)
+            item_stats.record(answer_key, marks)
+        return Response({'score': score})
 
-                # 单选题
-                if question.type == 'single':
-                    if user_answer in correct_answers:
-                        score += question.score
+    def _can_manage(self, request, homework):
+        return request.user.is_staff or homework.category.collection.creator_id == request.user.id
 
-                # 多选题
-                elif question.type == 'multi':
-                    # 将正确答案和用户答案都转换为集合，确保顺序不影响比较
-                    correct_answers_set = set(correct_answers)
-                    user_answers_set = set(user_answer)
-                    if correct_answers_set == user_answers_set:
-                        score += question.score
+    @action(detail=True, methods=['post'])
+    def regrade(self, request, pk=None):
+        """按当前题目和答案重新计算该作业的全部成绩（后台运行，进度见 regrade_status）"""
+        homework = self.get_object()
+        if not self._can_manage(request, homework):
+            return Response({'error': '无权限重新判分'}, status=status.HTTP_403_FORBIDDEN)
+        regrade.start(homework.id)
+        return Response(regrade.progress(homework.id), status=status.HTTP_202_ACCEPTED)
 
-            except Question.DoesNotExist:
-                return Response({'error': f'Question with id {question_id} does not exist'},
-                                status=status.HTTP_404_NOT_FOUND)
+    @action(detail=True, methods=['get'])
+    def item_analysis(self, request, pk=None):
+        """
+        作业各题的作答分析
+        返回: [{"question_id", "content", "type", "score", "attempts", "correct",
+                "difficulty": 答对率, "discrimination": 区分度（-1~1）,
+                "options": [{"text", "isCorrect", "count", "ratio"}]}]
+        """
+        homework = self.get_object()
+        if not self._can_manage(request, homework):
+            return Response({'error': '无权限查看作答分析'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(item_stats.analyze(homework))
 
-        Score.objects.create(homework=homework, user=request.user, score=score)
-        return Response({'score': score})
+    @action(detail=True, methods=['get'])
+    def regrade_status(self, request, pk=None):
+        """
+        重新判分进度
+        返回: {"status": pending/running/done/failed, "total", "done", "changed", "skipped", "started_at", "finished_at"}
+        """
+        homework = self.get_object()
+        if not self._can_manage(request, homework):
+            return Response({'error': '无权限查看判分进度'}, status=status.HTTP_403_FORBIDDEN)
+        state = regrade.progress(homework.id)
+        if state is None:
+            return Response({'error': '没有重新判分记录'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(state)
 
     @action(detail=True, methods=['get'])
     def scores(self, request, pk=None):
         homework = self.get_object()
         scores = Score.objects.filter(homework=homework)
-        serializer = ScoreSerializer(scores, many=True)
-        return Response(serializer.data)
+        return paginated_response(request, scores, ScoreSerializer)
+
+    @action(detail=True, methods=['get'])
+    def leaderboard(self, request, pk=None):
+        # 作业成绩排行榜，每个用户取最高成绩
+        homework = self.get_object()
+        return leaderboard_response(request, homework_leaderboard(homework.id), 'score')
 
     @action(detail=True, methods=['get'])
     def get_current_user_scores(self, request, pk=None):
@@ -650,22 +933,22 @@ def analyze_course_stats(request, course_id):
     try:
         # 统计课程中所有视频的数量
         total_videos = Video.objects.filter(category__collection_id=course_id).count()
-        total_progress_max = total_videos * 100  # 课程的总进度上限
 
-        # 获取播放统计数据，并按用户聚合总进度
-        user_course_stats = PlaybackStat.objects.filter(video__category__collection_id=course_id) \
-            .values('user__username') \
-            .annotate(total_progress_sum=Sum('progress')) \
-            .annotate(total_progress=Sum('progress') / total_progress_max * 100) \
-            .order_by('-total_progress')
+        # 课程进度排行榜（分数为进度总和），前十、倒数前十和达标人数均为 O(log n + k)
+        board = course_leaderboard(course_id)
+        top_10 = board.top(10)
+        bottom_10 = board.bottom(10)
+        usernames = dict(User.objects.filter(
+            id__in={user_id for user_id, _ in top_10 + bottom_10}
+        ).values_list('id', 'username'))
 
-        # 获取进度前十和倒数前十的用户
-        top_10 = user_course_stats[:10]
-        bottom_10 = user_course_stats.reverse()[:10]
+        def to_percent(progress_sum):
+            # 进度总和 / (视频数 * 100) * 100
+            return round(progress_sum / total_videos, 2) if total_videos else 0
 
         # 计算完成率超过80%的用户占比
-        total_users = user_course_stats.count()
-        completed_users = user_course_stats.filter(total_progress__gte=80).count()
+        total_users = len(board)
+        completed_users = board.count_at_least(80 * total_videos)
         pie_data = [
             {'value': completed_users, 'name': '完成率超过80%'},
             {'value': total_users - completed_users, 'name': '完成率低于80%'},
@@ -673,34 +956,74 @@ def analyze_course_stats(request, course_id):
 
         # 返回结果
         return Response({
-            'top_10': [{'username': stat['user__username'], 'progress': stat['total_progress']} for stat in top_10],
-            'bottom_10': [{'username': stat['user__username'], 'progress': stat['total_progress']} for stat in
-                          bottom_10],
+            'top_10': [{'username': usernames.get(user_id), 'progress': to_percent(progress_sum)}
+                       for user_id, progress_sum in top_10],
+            'bottom_10': [{'username': usernames.get(user_id), 'progress': to_percent(progress_sum)}
+                          for user_id, progress_sum in bottom_10],
             'pie_data': pie_data,
         })
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
 
+def leaderboard_response(request, board, value_name, to_value=lambda value: value):
+    """
+    排行榜通用返回格式
+    参数: k 前/后名数量（默认 10，最多 100），userId 查询名次的用户（默认当前用户）
+    返回: {"top": [...], "bottom": [...], "me": {"rank", "total", "percentile", value_name} 或 null}
+    """
+    try:
+        k = min(int(request.query_params.get('k', 10)), 100)
+        user_id = int(request.query_params.get('userId') or request.user.id or 0)
+    except (TypeError, ValueError):
+        return Response({'error': '参数格式错误'}, status=status.HTTP_400_BAD_REQUEST)
+
+    top = board.top(k)
+    bottom = board.bottom(k)
+    usernames = dict(User.objects.filter(
+        id__in={member for member, _ in top + bottom}
+    ).values_list('id', 'username'))
+
+    def entries(items):
+        return [{'userId': member, 'username': usernames.get(member), value_name: to_value(value)}
+                for member, value in items]
+
+    me = board.rank(user_id)
+    if me is not None:
+        me[value_name] = to_value(me.pop('score'))
+    return Response({'top': entries(top), 'bottom': entries(bottom), 'me': me})
+
+
+@api_view(['GET'])
+def get_course_leaderboard(request, course_id):
+    # 课程进度排行榜，进度为课程内所有视频进度的平均百分比
+    total_videos = Video.objects.filter(category__collection_id=course_id).count()
+    return leaderboard_response(
+        request,
+        course_leaderboard(course_id),
+        'progress',
+        lambda progress_sum: round(progress_sum / total_videos, 2) if total_videos else 0
+    )
+
+
 @api_view(['GET'])
 def get_course_scores(request, course_id):
-    # 获取某个课程的分数数据
-    scores = Score.objects.filter(homework__category__collection_id=course_id, user=request.user)
-    serializer = ScoreSerializer(scores, many=True)
-    return Response(serializer.data)
+    # 获取某个课程的分数数据，每个作业一行（最高分）
+    summaries = ScoreSummary.objects.filter(homework__category__collection_id=course_id, user=request.user)
+    return paginated_response(request, summaries, ScoreSummarySerializer)
 
 
 @api_view(['GET'])
 def get_favorite_course_stats(request):
     user = request.user
     # 获取用户喜欢的课程ID
-    favorite_collection_ids = user.favorite_collections.values_list('id', flat=True)
+    favorite_collection_ids = get_favorite_ids(user)
 
     # 获取用户喜欢的课程的播放记录
     playback_stats = PlaybackStat.objects.filter(
         user=user,
         video__category__collection__id__in=favorite_collection_ids
-    )
+    ).select_related('video')
 
     # 获取用户喜欢的课程的视频数据
     videos = Video.objects.filter(
@@ -714,3 +1037,34 @@ def get_favorite_course_stats(request):
     })
 
     return Response(serializer.data)
+
+
+@api_view(['GET'])
+def query_profile_report(request):
+    # 查询性能分析报告，仅管理员或 DEBUG 模式下的本机请求可以查看
+    is_local = request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1')
+    if not (request.user.is_staff or (settings.DEBUG and is_local)):
+        return Response({'error': '无权查看性能分析报告'}, status=403)
+    if not settings.QUERY_PROFILE.get('ENABLED'):
+        return Response({'error': '查询性能分析未开启'}, status=404)
+    return Response(profile_report())
+
+
+@api_view(['GET'])
+def get_catalog_changes(request):
+    """
+    目录增量同步
+    参数: since=上次返回的 cursor（不传时返回全部内容）
+    返回: {"cursor", "has_more", "collections", "categories", "videos", "homeworks", "materials",
+          "deleted": {"collections": [id], ...}}，has_more 为 true 时用新的 cursor 继续获取
+    """
+    since = request.query_params.get('since')
+    try:
+        since = decode_cursor(since) if since else None
+    except (ValueError, OverflowError):
+        return Response({'error': 'since 格式错误'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        changes = catalog_changes(since, {'request': request})
+    except CursorExpired:
+        return Response({'error': '同步游标已过期，请重新全量同步'}, status=status.HTTP_410_GONE)
+    return Response(changes)
@@ -0,0 +1,71 @@
+"""
+观看区间位图。
+
+视频按 SEGMENT_SECONDS 秒切分为若干分段，每个分段占一位：
+第 i 段对应第 i // 8 个字节的第 i % 8 位（小端序），位为 1 表示该段被实际观看过。
+多次心跳之间用按位或合并，完成度由置位数（popcount）计算，
+两小时的视频只需 180 字节。
+"""
+
+# 每个分段的秒数
+SEGMENT_SECONDS = 5
+
+# 位图最多记录的分段数，超出部分忽略
+MAX_SEGMENTS = 8 * 4096
+
+
+def segment_count(total_seconds):
+    """时长对应的分段数"""
+    if not total_seconds or total_seconds <= 0:
+        return 0
+    return min((int(total_seconds) + SEGMENT_SECONDS - 1) // SEGMENT_SECONDS, MAX_SEGMENTS)
+
+
+def _to_bytes(value, length):
+    return value.to_bytes(length, 'little') if value else b''
+
+
+def mark(bitmap, start_second, end_second=None):
+    """将 [start_second, end_second] 所在的分段置位，返回新的位图"""
+    if start_second is None or start_second < 0:
+        return bytes(bitmap or b'')
+    if end_second is None or end_second < start_second:
+        end_second = start_second
+    first = int(start_second) // SEGMENT_SECONDS
+    last = min(int(end_second) // SEGMENT_SECONDS, MAX_SEGMENTS - 1)
+    if first > last:
+        return bytes(bitmap or b'')
+    value = int.from_bytes(bitmap or b'', 'little')
+    value |= ((1 << (last - first + 1)) - 1) << first
+    return _to_bytes(value, max(len(bitmap or b''), last // 8 + 1))
+
+
+def merge(*bitmaps):
+    """按位或合并多个位图"""
+    value = 0
+    length = 0
+    for bitmap in bitmaps:
+        if bitmap:
+            value |= int.from_bytes(bitmap, 'little')
+            length = max(length, len(bitmap))
+    return _to_bytes(value, length)
+
+
+def difference(new, old):
+    """new 中置位而 old 中未置位的分段（new & ~old）"""
+    value = int.from_bytes(new or b'', 'little') & ~int.from_bytes(old or b'', 'little')
+    return _to_bytes(value, len(new or b''))
+
+
+def popcount(bitmap):
+    """已观看的分段数"""
+    return int.from_bytes(bitmap or b'', 'little').bit_count()
+
+
+def completion(bitmap, total_seconds):
+    """实际观看完成度，0~1"""
+    total = segment_count(total_seconds)
+    if not total:
+        return 0.0
+    watched = int.from_bytes(bitmap or b'', 'little') & ((1 << total) - 1)
+    return watched.bit_count() / total
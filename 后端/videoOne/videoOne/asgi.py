@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'videoOne.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Django 初始化完成后再导入，WebSocket 处理依赖模型
+from core.routing import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """HTTP 请求交给 Django，WebSocket 连接交给 core.routing"""
+    if scope['type'] == 'websocket':
+        await websocket_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
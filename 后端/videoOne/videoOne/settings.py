@@ -20,6 +20,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -71,7 +72,7 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -79,7 +80,9 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
-    'EXCEPTION_HANDLER': 'core.exceptions.custom_exception_handler'
+    'EXCEPTION_HANDLER': 'core.exceptions.custom_exception_handler',
+    # 列表接口传入 cursor 或 page_size 时按游标分页，见 core.pagination
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.OptionalKeysetPagination',
 }
 
 LANGUAGE_CODE = 'zh-hans'
@@ -108,4 +111,66 @@ for dir_path in THUMB_DIRS:
 
 # 默认缩略图配置
 DEFAULT_COLLECTION_THUMB = os.path.join(STATIC_URL, 'defaults/collection_default.jpg')
-DEFAULT_VIDEO_THUMB = os.path.join(STATIC_URL, 'defaults/video_default.jpg')
\ No newline at end of file
+DEFAULT_VIDEO_THUMB = os.path.join(STATIC_URL, 'defaults/video_default.jpg')
+
+# 播放心跳写缓冲配置（按用户+视频合并心跳后批量落库）
+PLAYBACK_BUFFER = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL': 5,  # 刷新间隔（秒）
+    'MAX_KEYS': 500,  # 缓冲中的最大键数量，超过后立即刷新
+}
+
+# 播放进度 WebSocket 通道配置（需通过 ASGI 服务器运行，如 uvicorn videoOne.asgi:application）
+PLAYBACK_STREAM = {
+    'FLUSH_INTERVAL': 10,  # 连接内合并进度的写库间隔（秒）
+}
+
+# 查询性能分析中间件（默认关闭，设置环境变量 QUERY_PROFILE=1 开启，报告见 /api/debug/query-profile/）
+QUERY_PROFILE = {
+    'ENABLED': os.environ.get('QUERY_PROFILE') == '1',
+    'N_PLUS_ONE_THRESHOLD': 5,  # 同一查询形态在一个请求内出现的次数达到该值即标记为 N+1
+    'HISTORY_SIZE': 200,  # 保留最近多少个请求的分析结果
+}
+
+# 缓存配置：resources 用于分类资源、合辑详情等只在内容编辑时变化的数据，可替换为 Redis 等共享后端
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'resources': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'resources',
+        # 信号只能删除本进程的条目，其他工作进程最多在过期后读到修改；部署为共享缓存时可以加长
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,  # 超过后按 LRU 淘汰
+        },
+    },
+    # 多个工作进程共享的缓存：认证缓存的撤销标记、收藏ID、答案表、重新判分的锁和进度。
+    # 这些键都不能被随机淘汰（撤销标记丢失会让已作废的 Token 在其他进程继续有效），
+    # Redis 需配置 maxmemory-policy noeviction
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
+
+# Token 认证缓存配置（core.authentication.CachedTokenAuthentication）
+TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,  # 进程内最多缓存的 Token 数量，超过后按 LRU 淘汰
+    'TTL': 300,  # 缓存条目的有效期（秒）
+    'SHARED_CACHE': 'shared',  # 存放撤销标记的缓存，必须在各进程间共享
+}
+
+# 目录增量同步配置（/api/catalog/changes/）
+CATALOG_SYNC = {
+    'MAX_CHANGES': 1000,  # 每类对象单次最多返回的变更数
+    'TOMBSTONE_DAYS': 30,  # 删除记录保留天数，早于该期限的游标需要重新全量同步
+}
+
+# 作业重新判分
+REGRADE = {
+    'WORKERS': None,  # 判分工作进程数，None 为 CPU 核数
+    'CHUNK_SIZE': 1000,  # 每块的成绩数量
+    'PARALLEL_THRESHOLD': 5000,  # 成绩数量达到该值时才使用多进程
+}
\ No newline at end of file